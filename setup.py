@@ -4,7 +4,10 @@ from setuptools import setup
 setup(
     name='ubercoordinator',
     version='0.1',
-    packages=open('requirements.txt').readlines(),
+    package_dir={'': 'src'},
+    py_modules=['uber'],
+    install_requires=open('requirements.txt').read().split(),
+    entry_points={'console_scripts': ['uber = uber:main']},
     python_requires='>=3.7',
     url='',
     license='',
@@ -0,0 +1,138 @@
+"""
+A static JSON export of the Index, for other tools.
+
+Rather than reading toc.xhtml and export.yaml with index.py, or scraping
+the website, tools such as archive_management's show indexing scripts
+can fetch the website's 'api/v1' files:
+
+    api/v1/manifest.json          the API version, and every shard's path,
+                                  SHA-256 hash, size and number of records
+    api/v1/articles/YEAR.json     the articles published in a year, with
+                                  their narrations
+    api/v1/shows.json             the shows, with their narrations
+
+so a tool can load just the years it needs, and use the hashes in the
+manifest (or the server's ETags) to skip shards that it has already got.
+
+Shards are serialised deterministically, and a shard whose hash is the
+same as in the website's previous manifest is not written again, so it
+keeps its modification time (and ETag). The version in the path changes
+when a change to the format would break existing readers.
+"""
+
+__all__ = ['API_VERSION', 'API_DIR', 'article_record', 'show_record', 'shards', 'write_api']
+
+import json
+from datetime import date, datetime
+from hashlib import sha256
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+from feeds import ArticleDates
+from index import Index, Article, Narration, Show
+from sinks import Sink, FileSystemSink
+from settings import WEBSITE_URL
+
+API_VERSION = 1
+"""The version of the export's format."""
+
+API_DIR = f'api/v{API_VERSION}'
+"""Where the export is in the website."""
+
+MANIFEST = 'manifest.json'
+
+
+def _date(d: Union[date, datetime]) -> str:
+    return d.strftime('%Y-%m-%d')
+
+
+def _narration_record(narration: Narration) -> Dict:
+    return {
+        'start_time': narration.start_time,
+        'end_time': narration.end_time,
+        'word_count': narration.word_count,
+        'byte_range': list(narration.byte_range) if narration.byte_range else None,
+        'mp3_url': narration.mp3_url,
+    }
+
+
+def article_record(article: Article, dates: Optional[ArticleDates] = None) -> Dict:
+    """
+    An article's JSON record: its ID, titles, dates, page URL and narrations.
+    The 'title_html' is the fully formatted title, as XHTML markup.
+    """
+    record = {
+        'id': article.id,
+        'title': article.title,
+        'title_html': article.link[article.link.index('>') + 1:article.link.rindex('</a>')],
+        'date': _date(article.date),
+        'blog': article.blog,
+        'url': f"{WEBSITE_URL}/Text/{article.id}.html",
+        'narrations': [{'show': narration.show.id, **_narration_record(narration)}
+                       for narration in sorted(article.narrations)],
+    }
+    if dates:
+        record['added'] = dates.added(article)
+        record['modified'] = dates.lastmod(article)
+    return record
+
+
+def show_record(show: Show) -> Dict:
+    """A show's JSON record, with its narrations in order."""
+    return {
+        'id': show.id,
+        'title': show.title,
+        'date': _date(show.date),
+        'duration': show.duration,
+        'internet_archive_url': show.internet_archive_url,
+        'mp3_url': show.mp3_url,
+        'narrations': [{'article': narration.article.id, **_narration_record(narration)}
+                       for narration in show.narrations],
+    }
+
+
+def _serialise(records: List[Dict]) -> bytes:
+    return json.dumps(records, ensure_ascii=False, sort_keys=True,
+                      separators=(',', ':')).encode('utf-8')
+
+
+def shards(index: Index, dates: Optional[ArticleDates] = None) -> Iterator[Tuple[str, List[Dict]]]:
+    """The shards' paths, relative to API_DIR, and their records."""
+    for year, articles in index.articles_by_year():
+        yield (f'articles/{year}.json',
+               [article_record(article, dates)
+                for article in sorted(articles, key=lambda a: a.id)])
+    yield 'shows.json', [show_record(show) for show in sorted(index.shows_by_id.values())]
+
+
+def _previous_manifest(sink: Sink) -> Dict:
+    """The manifest from the last build into a directory, if there is one."""
+    if isinstance(sink, FileSystemSink):
+        file = sink.root / API_DIR / MANIFEST
+        if file.exists():
+            try:
+                return json.loads(file.read_text())
+            except ValueError:
+                pass
+    return {}
+
+
+def write_api(sink: Sink, index: Index, dates: Optional[ArticleDates] = None) -> None:
+    """
+    Write the JSON export of an index into a website.
+
+    :param sink: the website
+    :param index: the index
+    :param dates: when articles were added and last modified, if known
+    """
+    previous = _previous_manifest(sink).get('shards', {})
+    manifest = {}
+    for path, records in shards(index, dates):
+        data = _serialise(records)
+        digest = sha256(data).hexdigest()
+        manifest[path] = {'sha256': digest, 'bytes': len(data), 'records': len(records)}
+        website_path = f'{API_DIR}/{path}'
+        if previous.get(path, {}).get('sha256') != digest or not sink.exists(website_path):
+            sink.write_bytes(website_path, data)
+    sink.write_text(f'{API_DIR}/{MANIFEST}',
+                    json.dumps({'version': API_VERSION, 'shards': manifest},
+                               indent=1, sort_keys=True))
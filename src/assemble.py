@@ -0,0 +1,178 @@
+""" Assemble an EPUB workspace from a book directory.
+
+    The files listed in a book's book.xml are copied into the workspace
+    and the EPUB index files are created from the metadata in book.xml.
+    Default files and XSLT style sheets from the templates directory
+    are used to supply files missing from the book directory.
+
+    The DTD and style sheets are loaded once, into a 'Resources' object,
+    so that one process can assemble any number of books.
+
+    With an image budget, the book's images are recompressed to fit it
+    (see 'epub_images.py'), and with a split size, sections' files that
+    are bigger are split into parts (see 'epub_split.py').
+"""
+
+__all__ = ['UBER', 'Resources', 'Assembly', 'fresh_epub_dir', 'assemble']
+
+import shutil
+import time
+from os.path import splitext
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from lxml.etree import DTD, XSLT
+
+import xml
+from epub_images import ImageBudget, fit_images
+from epub_split import split_sections
+
+UBER = Path(__file__).parent.parent
+"""The ubercoordinator directory."""
+
+
+class Resources:
+    """
+    Things that every book needs, loaded once and then shared.
+
+    :ivar templates: the EPUB templates directory
+    :ivar book_dtd: the DTD for book.xml files
+    """
+    templates: Path
+    book_dtd: DTD
+    _xslts: Dict[Path, XSLT]
+
+    def __init__(self, uber: Path = UBER) -> None:
+        self.templates = uber / 'templates' / 'epub'
+        assert self.templates.is_dir()
+        self.book_dtd = DTD(str(uber / 'src' / 'book.dtd'))
+        self._xslts = {}
+
+    def xslt(self, xsl_filepath: Path) -> XSLT:
+        """A compiled style sheet, compiled on first use."""
+        if xsl_filepath not in self._xslts:
+            self._xslts[xsl_filepath] = XSLT(xml.read(xsl_filepath))
+        return self._xslts[xsl_filepath]
+
+
+class Assembly:
+    """
+    The assembly of one book's EPUB workspace.
+
+    :ivar book_dir: the book's source directory
+    :ivar oebps: the workspace's 'OEBPS' directory
+    :ivar book: the root of the book's book.xml
+    :ivar images: the budget for the book's images, if they should be fitted to one
+    :ivar jobs: the number of processes to fit images with (default: one per CPU)
+    :ivar split_size: the largest section file size, if big sections should be split
+    :ivar errors: error messages, in 'file:line:column: message' format
+    """
+    book_dir: Path
+    oebps: Path
+    book: xml.Element
+    images: Optional[ImageBudget]
+    jobs: Optional[int]
+    split_size: Optional[int]
+    errors: List[str]
+
+    def __init__(self, book_dir: Path, epub_dir: Path, resources: Resources,
+                 images: ImageBudget = None, jobs: int = None,
+                 split_size: int = None) -> None:
+        assert book_dir.is_dir()
+        assert (epub_dir / 'OEBPS').is_dir()
+        self.book_dir = book_dir
+        self.oebps = epub_dir / 'OEBPS'
+        self.resources = resources
+        self.images = images
+        self.jobs = jobs
+        self.split_size = split_size
+        self.book = xml.read(book_dir / 'book.xml', dtd=resources.book_dtd)
+        self.errors = []
+
+    def error(self, message: str) -> None:
+        self.errors.append(f"{self.book_dir / 'book.xml'}:0:0: {message}")
+
+    def expand(self, xsl_filepath: Path, xml_filepath: Path, doctype: str = None) -> None:
+        """expand a template file using the book's book.xml metadata"""
+        result = self.resources.xslt(xsl_filepath)(self.book)
+        xml.save(xml_filepath, result, doctype)
+
+    def copy_files(self, subdirectory: str, filenames: Iterable[str]) -> None:
+        """copy files from the book to the EPUB, using a template when a file is missing"""
+        templates = self.resources.templates
+        for filename in filenames:
+            src = self.book_dir / subdirectory / filename
+            dst = self.oebps / subdirectory / filename
+            if src.exists():
+                shutil.copyfile(src, dst)
+            else:
+                default = templates / subdirectory / filename
+                if default.exists():
+                    shutil.copyfile(default, dst)
+                else:
+                    base, ext = splitext(filename)
+                    template = templates / 'XML' / (base + '.xsl')
+                    if ext in ('.html', 'xhtml') and template.exists():
+                        self.expand(template, dst, 'xhtml')
+                    else:
+                        self.error(f"{src} is missing")
+
+    def run(self) -> None:
+        book = self.book
+        book.attrib['date'] = time.strftime("%Y-%m-%d")
+
+        # copy the book's files
+        self.copy_files('Text', xml.get_all_str(book, "//section/@file"))
+        self.copy_files('Styles', xml.get_all_str(book, "//style/@file"))
+        images = list(xml.get_all_str(book, "//image/@file"))
+        self.copy_files('Images', images)
+        self.copy_files('Fonts', xml.get_all_str(book, "//font/@file"))
+
+        if self.images:
+            files = [self.oebps / 'Images' / filename for filename in images]
+            self.errors.extend(fit_images([file for file in files if file.exists()],
+                                          self.images, jobs=self.jobs))
+
+        # split big sections, adding their parts to book.xml's contents
+        if self.split_size:
+            self.errors.extend(split_sections(book, self.oebps / 'Text', self.split_size)[1])
+
+        # create index files from book.xml (see .xsl files for details)
+        templates = self.resources.templates
+        self.expand(templates / 'XML/ncx.xsl', self.oebps / 'toc.ncx')
+        self.expand(templates / 'XML/opf.xsl', self.oebps / 'content.opf', 'opf')
+
+
+def fresh_epub_dir(epub_dir: Path, resources: Resources) -> None:
+    """
+    Build an empty EPUB workspace, as 'clean-epub.sh' does.
+    """
+    for subdirectory in ('Text', 'Images', 'Styles', 'Fonts'):
+        directory = epub_dir / 'OEBPS' / subdirectory
+        directory.mkdir(parents=True, exist_ok=True)
+        for file in directory.glob('*'):
+            file.unlink()
+    (epub_dir / 'META-INF').mkdir(exist_ok=True)
+    shutil.copyfile(resources.templates / 'XML' / 'mimetype', epub_dir / 'mimetype')
+    shutil.copyfile(resources.templates / 'XML' / 'container.xml',
+                    epub_dir / 'META-INF' / 'container.xml')
+
+
+def assemble(book_dir: Path, epub_dir: Path, resources: Resources = None,
+             images: ImageBudget = None, jobs: int = None,
+             split_size: int = None) -> List[str]:
+    """
+    Assemble a book's EPUB workspace.
+
+    :param book_dir: the book's source directory, containing book.xml
+    :param epub_dir: the EPUB workspace, made by 'fresh_epub_dir' or 'clean-epub.sh'
+    :param resources: shared resources, loaded if not given
+    :param images: a budget to fit the book's images to, if any
+    :param jobs: the number of processes to fit images with (default: one per CPU)
+    :param split_size: split sections' files that are bigger than this many bytes
+    :return: error messages, an empty list if all went well
+    """
+    assembly = Assembly(book_dir, epub_dir, resources or Resources(), images, jobs,
+                        split_size)
+    assembly.run()
+    return assembly.errors
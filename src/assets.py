@@ -0,0 +1,107 @@
+"""
+Content-addressed website assets.
+
+With fingerprinting, each style sheet, font and image is published under
+a name that includes a hash of its contents, e.g. 'Styles/style.3f2a1b9c0d.css',
+so browsers can cache them forever: a changed file gets a new name.
+References to the assets in the rendered pages and in the style sheets
+are rewritten to the fingerprinted names.
+
+Every distinct file content is kept once in a store, by its hash
+(see cache.py), and published once. Byte-identical files, such as an image that is in
+both the Big Book and the templates, share one published file.
+"""
+
+__all__ = ['ASSET_DIRECTORIES', 'AssetStore']
+
+import re
+from hashlib import sha256
+from pathlib import Path, PurePosixPath
+from typing import Dict, List
+
+from cache import Store
+from pages import Splice
+from sinks import Sink
+
+ASSET_DIRECTORIES = ('Fonts', 'Images', 'Styles')
+"""The website directories whose files are fingerprinted."""
+
+# A relative reference to an asset, in a page or style sheet,
+# e.g. '../Images/yardlogo.gif' or 'Styles/style.css'.
+_ASSET_REFERENCE = r'''(?<=["'(])(?:\.\./)?(?P<path>(?:Fonts|Images|Styles)/[^"'()\s?#]+)'''
+_ASSET_TEXT = re.compile(_ASSET_REFERENCE)
+_ASSET_BYTES = re.compile(_ASSET_REFERENCE.encode())
+
+_FINGERPRINT_LENGTH = 10
+
+
+class AssetStore:
+    """
+    The website's assets, by content hash.
+
+    :ivar store: the store, with one entry per distinct content, by its hash
+    :ivar names: asset path, e.g. 'Images/x.png', to fingerprinted path
+    """
+    store: Store
+    names: Dict[str, str]
+    _stored: Dict[str, Path]  # fingerprinted path to stored file
+    _by_hash: Dict[str, str]  # content hash to fingerprinted path
+
+    def __init__(self, store: Store) -> None:
+        self.store = store
+        self.names = {}
+        self._stored = {}
+        self._by_hash = {}
+
+    def add(self, path: str, file: Path) -> str:
+        """
+        Add an asset. Style sheets should be added after the fonts and
+        images that they refer to, so that their references can be rewritten.
+
+        :param path: the asset's path in the website, e.g. 'Images/x.png'
+        :param file: the asset's source file
+        :return: the fingerprinted path
+        """
+        data = file.read_bytes()
+        if file.suffix == '.css':
+            data = self.rewrite(data.decode('utf-8')).encode('utf-8')
+        digest = sha256(data).hexdigest()
+
+        stored = self.store.file(digest) or self.store.put(digest, data)
+
+        if digest not in self._by_hash:
+            p = PurePosixPath(path)
+            name = str(p.with_name(f"{p.stem}.{digest[:_FINGERPRINT_LENGTH]}{p.suffix}"))
+            self._by_hash[digest] = name
+            self._stored[name] = stored
+        self.names[path] = self._by_hash[digest]
+        return self.names[path]
+
+    def add_directory(self, subdirectory: str, directory: Path) -> None:
+        """Add every file in a directory, as assets in a website subdirectory."""
+        for file in sorted(directory.glob('*')):
+            if file.is_file():
+                self.add(f"{subdirectory}/{file.name}", file)
+
+    def rewrite(self, text: str) -> str:
+        """Rewrite the asset references in a page or style sheet."""
+        def fingerprinted(match) -> str:
+            path = match.group('path')
+            return match.group().replace(path, self.names.get(path, path))
+        return _ASSET_TEXT.sub(fingerprinted, text)
+
+    def splices(self, data: bytes, start: int, end: int) -> List[Splice]:
+        """Splices that rewrite the asset references in part of a page's bytes."""
+        splices = []
+        for match in _ASSET_BYTES.finditer(data, start, end):
+            path = match.group('path').decode('utf-8')
+            if path in self.names:
+                splices.append(Splice(match.start('path'), match.end('path'),
+                                      self.names[path].encode('utf-8')))
+        return splices
+
+    def publish(self, sink: Sink) -> None:
+        """Copy every distinct asset into the website, unless it is already there."""
+        for name, stored in self._stored.items():
+            if not sink.exists(name):
+                sink.copy_file(name, stored)
@@ -0,0 +1,103 @@
+"""
+Which of the Big Book's articles link to which, for the list of the
+articles that link to each article, on its page in the website.
+
+The graph of links is kept in the website, in '.links.json', from build
+to build, like the articles' dates (see feeds.py). It is a render target
+(see render.py), so the links of the articles that are rendered are
+taken from the same scan of their files as their pages are; the links of
+the rest, whose files haven't changed, are as they were. An article that
+the graph doesn't know, e.g. on the first build, is read beforehand.
+
+A page can be rendered before an article that is rendered later links to
+it, and an unchanged page's list changes when an article that links to
+it is added, removed or retitled, or its links change. So after the
+articles are rendered, 'stale' gives the pages whose lists have changed
+since they were rendered, to be rendered again, and only those.
+"""
+
+__all__ = ['LinkGraph']
+
+import json
+from pathlib import Path
+from typing import Dict, Iterable, List, Set
+
+from index import Article, Index
+from render import Source, Target
+from sinks import Sink
+
+
+def _reverse(links: Dict[str, Set[str]]) -> Dict[str, Set[str]]:
+    linked_from: Dict[str, Set[str]] = {}
+    for source, targets in links.items():
+        for target in targets:
+            linked_from.setdefault(target, set()).add(source)
+    return linked_from
+
+
+class LinkGraph(Target):
+    """
+    The links between articles, by ID.
+
+    :ivar index: the Index
+    """
+    PATH = '.links.json'
+    """Where the graph is kept in the website."""
+
+    index: Index
+    _links: Dict[str, Set[str]]  # article to the articles that it links to
+    _linked_from: Dict[str, Set[str]]  # article to the articles that link to it
+    _previous: Dict[str, Set[str]]  # what the last build's pages listed
+    _rendered: Dict[str, Set[str]]  # what the pages rendered by this build list
+
+    def __init__(self, website_dir: Path, index: Index) -> None:
+        """
+        :param website_dir: the website directory of the previous build, if there is one
+        :param index: the Index, whose articles that have gone are forgotten
+        """
+        file = website_dir / self.PATH
+        links = {id: set(targets) for id, targets in
+                 (json.loads(file.read_text()) if file.exists() else {}).items()}
+        self.index = index
+        self._previous = _reverse(links)
+        self._links = {id: targets for id, targets in links.items()
+                       if id in index.articles_by_id}
+        self._linked_from = _reverse(self._links)
+        self._rendered = {}
+
+    def missing(self, articles: Iterable[Article]) -> List[Article]:
+        """The articles whose links the graph doesn't know."""
+        return [article for article in articles if article.id not in self._links]
+
+    def render(self, source: Source) -> None:
+        """Note an article's links."""
+        id = source.article.id
+        old = self._links.get(id, set())
+        new = set(source.internal_links) - {id}
+        for target in old - new:
+            self._linked_from[target].discard(id)
+        for target in new - old:
+            self._linked_from.setdefault(target, set()).add(id)
+        self._links[id] = new
+
+    def linked_from(self, article: Article) -> List[Article]:
+        """The articles that link to an article, by date, as its page lists them."""
+        ids = self._linked_from.get(article.id, set())
+        self._rendered[article.id] = set(ids)
+        return [self.index.articles_by_id[id] for id in sorted(ids)]
+
+    def linked_by(self, ids: Iterable[str]) -> Set[str]:
+        """The articles that some articles link to."""
+        return {target for id in ids for target in self._links.get(id, ())
+                if target in self.index.articles_by_id}
+
+    def stale(self) -> List[str]:
+        """The articles whose pages' lists have changed since they were rendered."""
+        return [id for id in self.index.articles_by_id
+                if self._linked_from.get(id, set())
+                != self._rendered.get(id, self._previous.get(id, set()))]
+
+    def save(self, sink: Sink) -> None:
+        sink.write_text(self.PATH, json.dumps({id: sorted(targets)
+                                               for id, targets in self._links.items()},
+                                              indent=1, sort_keys=True))
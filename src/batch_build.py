@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Build a family of ebooks in one go.
+
+Each book directory is (optionally) brought up to date with the Big Book
+of Key, as 'prepare_book.py' does, assembled and zipped into an EPUB
+named after its book.xml 'file' attribute. Articles are copied from EPUB
+sections written by 'make_website.py --epub-sections', if given.
+
+The book DTD, the compiled XSLT style sheets and the Big Book's Index
+are loaded once and shared by every book. Books are built in parallel,
+in worker processes that inherit the loaded resources.
+"""
+
+__all__ = ['build_all']
+
+import multiprocessing
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from sys import stderr, exit
+from typing import List, Optional
+
+import xml
+from assemble import UBER, Resources
+from index import Index
+from epub_images import ImageBudget
+from make_epub import build, add_build_arguments, image_budget
+from prepare_book import run as prepare
+from render import Sections
+
+# Shared by the worker processes. (These are set before the workers
+# are forked, or by '_init_worker' where processes are spawned.)
+_resources: Optional[Resources] = None
+_index: Optional[Index] = None
+_bigbook: Optional[Path] = None
+_images: Optional[ImageBudget] = None
+_split_size: Optional[int] = None
+_sections: Optional[Sections] = None
+
+
+def _init_worker(bigbook: Optional[Path], images: Optional[ImageBudget],
+                 split_size: Optional[int], sections: Optional[Path]) -> None:
+    global _resources, _index, _bigbook, _images, _split_size, _sections
+    if _resources is None:
+        _resources = Resources()
+    if bigbook and _index is None:
+        _index = Index(bigbook)
+    _bigbook = bigbook
+    _images = images
+    _split_size = split_size
+    if sections and _sections is None:
+        _sections = Sections(sections)
+
+
+def _build_one(book_dir: Path, workspace: Path, output: Path) -> List[str]:
+    if _bigbook:
+        prepare(book_dir, _bigbook, UBER, [], index=_index, book_dtd=_resources.book_dtd,
+                rendered=_sections)
+    book = xml.read(book_dir / 'book.xml', dtd=_resources.book_dtd)
+    name = book.attrib['file']
+    # The books are built in parallel already, so each fits its images in one process.
+    return build(book_dir, output / (name + '.epub'), workspace / name, _resources,
+                 _images, jobs=1, split_size=_split_size)
+
+
+def build_all(book_dirs: List[Path], workspace: Path, output: Path,
+              bigbook: Path = None, jobs: int = None,
+              images: ImageBudget = None, split_size: int = None,
+              sections: Path = None) -> List[str]:
+    """
+    Build EPUB files for several books.
+
+    :param book_dirs: the books' source directories
+    :param workspace: the directory to assemble the books in
+    :param output: the directory for the EPUB files
+    :param bigbook: the Big Book of Key directory, if the books should be
+                    brought up to date with it first
+    :param jobs: the number of worker processes (default: one per CPU)
+    :param images: a budget to fit each book's images to, if any
+    :param split_size: split sections' files that are bigger than this many bytes
+    :param sections: EPUB sections rendered with the website, to copy articles from
+    :return: error messages for all the books
+    """
+    _init_worker(bigbook, images, split_size, sections)
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+    errors = []
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=context, initializer=_init_worker,
+                             initargs=(bigbook, images, split_size, sections)) as pool:
+        futures = [pool.submit(_build_one, book_dir, workspace, output)
+                   for book_dir in book_dirs]
+        for book_dir, future in zip(book_dirs, futures):
+            try:
+                errors.extend(future.result())
+            except Exception as e:
+                errors.append(f"{book_dir / 'book.xml'}:0:0: {e}")
+    return errors
+
+
+def main() -> None:
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "-b", "--bigbook", metavar="DIR", type=Path,
+        help="the Big Book of Key directory, to update the books from first")
+    parser.add_argument(
+        "-s", "--sections", metavar="DIR", type=Path,
+        help="EPUB sections written by 'make_website.py --epub-sections', "
+             "to copy articles from")
+    parser.add_argument(
+        "-w", "--workspace", metavar="DIR", type=Path, required=True,
+        help="the directory to assemble the books in")
+    parser.add_argument(
+        "-o", "--output", metavar="DIR", type=Path, required=True,
+        help="the directory for the EPUB files")
+    parser.add_argument(
+        "-j", "--jobs", metavar="N", type=int,
+        help="the number of books to build at once (default: one per CPU)")
+    add_build_arguments(parser)
+    parser.add_argument(
+        "books", type=Path, metavar="BOOK", nargs="+",
+        help="book source directories")
+    args = parser.parse_args()
+
+    errors = build_all(args.books, args.workspace, args.output, args.bigbook, args.jobs,
+                       image_budget(args), args.split_size, args.sections)
+    for message in errors:
+        print(message, file=stderr)
+    if errors:
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -9,22 +9,40 @@ This tests that Big Book of Key XHTML files:
     (c) contain no broken relative links.
 
 Optionally all linked image files can be checked for validity.
+
+Most Schematron rules are checked by compiled Python (see
+fast_schematron.py), and the rest by lxml's Schematron. With the
+--strict option, every file is also checked with lxml's Schematron
+alone, and any disagreement between the two is an error.
+
+With the --corpus option, results are recorded in the parsed article
+store (see corpus.py) and files that have passed are not tested again
+until they, the tests, or the files that they link to or show change.
+
+With the --changed-since option, the files tested are those that git
+says have been changed or added since a revision, plus every file that
+links to a file or image that has since been changed, deleted or renamed,
+in the Big Book's repository: that of the first file given, or else the
+default Big Book directory (see settings.py).
 """
 
 # The default DTD and Schematron files should reside in the same
 # directory as this script.
 
 
+import os
+import re
 from sys import stderr, exit
+from os.path import normpath
 from pathlib import Path
 from argparse import ArgumentParser
-from urllib.request import url2pathname
-from typing import List
-from PIL import Image
+from subprocess import run as run_process, PIPE, CalledProcessError
+from urllib.parse import unquote
+from typing import Dict, Iterable, List, Optional, Set, TextIO, TYPE_CHECKING
+from hashlib import sha1
 
-from lxml.isoschematron import Schematron
 from lxml.html import XHTMLParser
-from lxml.etree import DTD, DTDParseError, fromstring
+from lxml.etree import DTD, DTDParseError
 from lxml.etree import parse, XMLSyntaxError
 from lxml.etree import clear_error_log
 
@@ -32,8 +50,21 @@ from lxml.etree import clear_error_log
 # noinspection PyProtectedMember
 from lxml.etree import _Element, _ErrorLog
 
+# PIL and the fast Schematron are imported when they are first needed,
+# as importing them takes longer than validating a file.
+if TYPE_CHECKING:
+    from corpus import Corpus
+    from fast_schematron import FastSchematron
 
-__all__ = ['settings', 'run']
+# 'urllib.request' is slow to import, and only its 'url2pathname' is used,
+# which outside Windows is 'unquote'.
+if os.name == 'nt':
+    from nturl2path import url2pathname
+else:
+    url2pathname = unquote
+
+
+__all__ = ['settings', 'run', 'link_targets']
 
 
 # XML namespaces for everything that might be used.
@@ -59,6 +90,10 @@ class Settings:
     files: List[Path]  # XHTML files to test
     test_images: bool  # True for image file validity checks
     verbose: bool      # if True print the names of files as they are checked
+    corpus: Optional[Path]  # the parsed article store, to record results in
+    changed_since: Optional[str]  # a git revision, to test files changed since
+    strict: bool       # if True cross-check the fast Schematron with lxml's
+    errors: TextIO     # where to print error messages
 
     def __init__(self):
         """
@@ -69,6 +104,10 @@ class Settings:
         """
         self.test_images = False
         self.verbose = False
+        self.corpus = None
+        self.changed_since = None
+        self.strict = False
+        self.errors = stderr
         self.files = []
         self.dtd = Path(__file__).parent / 'bigbook.dtd'
         self.schematron = Path(__file__).parent / 'bigbook.sch'
@@ -83,24 +122,80 @@ def run(xhtml_files: List[Path]) -> bool:
     """
     Run tests on a bunch of XHTML files.
     All files are tested, even if one fails.
-    Error messages are printed to stderr for files that fail.
+    Error messages are printed to settings.errors for files that fail.
 
     :param xhtml_files: the files
     :return: True if everything passes
     """
-    dtd = open_dtd(settings.dtd)
-    schematron = open_schematron(settings.schematron)
+    dtd = schematron = None
+    corpus = None
+    if settings.corpus:
+        from corpus import Corpus
+        corpus = Corpus(settings.corpus)
+        key = validation_key()
     success = True
     for file in xhtml_files:
-        if not test(file, dtd, schematron):
+        if corpus:
+            try:
+                corpus.update_file(file)
+            except ValueError as e:  # the file can't be read or parsed
+                print(e, file=settings.errors)
+                success = False
+                continue
+            dependencies = dependency_key(file, corpus)
+            if corpus.is_valid(file, key, dependencies):
+                continue
+        if not dtd:
+            dtd = open_dtd(settings.dtd)
+            schematron = open_schematron(settings.schematron)
+        passed = test(file, dtd, schematron)
+        if corpus:
+            corpus.set_validation(file, key, dependencies, passed)
+        if not passed:
             success = False
+    if corpus:
+        corpus.close()
     return success
 
 
-def test(xhtml_file: Path, dtd: DTD, schematron: Schematron) -> bool:
+def validation_key() -> str:
+    """
+    Identifies the tests that the current settings make,
+    so that results recorded with other settings are not used.
+    """
+    key = sha1(settings.dtd.read_bytes())
+    key.update(settings.schematron.read_bytes())
+    for module in ('bigbook.py', 'fast_schematron.py'):
+        key.update((Path(__file__).parent / module).read_bytes())
+    key.update(b'images' if settings.test_images else b'')
+    key.update(b'strict' if settings.strict else b'')
+    return key.hexdigest()
+
+
+def dependency_key(xhtml_file: Path, corpus: 'Corpus') -> str:
+    """
+    Identifies the state of the files that an XHTML file links to, and the
+    images that it shows, as the store has them, so that a result recorded
+    before one of them was added, deleted or changed is not used.
+    """
+    key = sha1()
+    for target in corpus.links_from(xhtml_file.stem):
+        key.update(f'{target} {(xhtml_file.parent / target).exists()}\n'.encode('utf-8'))
+    for src in corpus.images(xhtml_file.stem):
+        if ':' not in src:
+            try:
+                stat = (xhtml_file.parent / url2pathname(src)).stat()
+                state = f'{stat.st_size} {stat.st_mtime_ns}'
+            except OSError:
+                state = 'missing'
+            key.update(f'{src} {state}\n'.encode('utf-8'))
+    return key.hexdigest()
+
+
+def test(xhtml_file: Path, dtd: DTD, schematron: 'FastSchematron') -> bool:
     """
     Test that an XHTML file matches a DTD and passes Schematron tests.
-    Error messages are printed to stderr if the file doesn't pass.
+    Error messages are printed to settings.errors if the file doesn't pass.
 
     :param xhtml_file: the XHTML file to test
     :param dtd: the DTD
@@ -117,7 +212,7 @@ def test(xhtml_file: Path, dtd: DTD, schematron: Schematron) -> bool:
         tree = parse(source=str(xhtml_file), parser=parser)
         html = tree.getroot()
     except IOError as e:
-        print(f"{xhtml_file}: {e.strerror}", file=stderr)
+        print(f"{xhtml_file}: {e.strerror}", file=settings.errors)
         return False
     except XMLSyntaxError:
         print_error_log(parser.error_log)
@@ -127,40 +222,21 @@ def test(xhtml_file: Path, dtd: DTD, schematron: Schematron) -> bool:
         print_error_log(dtd.error_log)
         return False
 
-    if not schematron.validate(html):
-        print_schematron_error_log(html, schematron)
+    failures = schematron.validate(html)
+    if failures:
+        for line, message in failures:
+            print(f"{xhtml_file}:{line}:0: {message}", file=settings.errors)
         return False
 
     return test_links(xhtml_file, html) and test_images(xhtml_file, html)
 
 
-def print_schematron_error_log(xhtml: _Element, schematron: Schematron) -> None:
-    """
-    Print a Schematron's error log in a readable format.
-
-    :param xhtml: the root of the XHTML file with the errors
-    :param schematron: the Schematron with the error log
-    """
-    for e in schematron.error_log:
-
-        # The message is a XML string containing an 'srvl:failed-assert' element
-        xml = fromstring(e.message)
-
-        # Schematron reports the location of a faulty element with an Xpath selector.
-        location_xpath = xml.xpath('//svrl:failed-assert/@location', namespaces=XMLNS)[0]
-        line = xhtml.xpath(location_xpath, namespaces=XMLNS)[0].sourceline
-
-        message = xml.xpath('normalize-space(//svrl:text)', namespaces=XMLNS)
-
-        print(f"{e.filename}:{line}:0: {message}", file=stderr)
-
-
 def print_error_log(log: _ErrorLog) -> None:
     """
     Print a generic Lxml error log in a readable format.
     """
     for e in log:
-        print(f"{e.filename}:{e.line}:{e.column}: {e.message}", file=stderr)
+        print(f"{e.filename}:{e.line}:{e.column}: {e.message}", file=settings.errors)
 
 
 def test_images(xhtml_file: Path, xhtml: _Element) -> bool:
@@ -183,13 +259,14 @@ def test_images(xhtml_file: Path, xhtml: _Element) -> bool:
                 print("\t", img_path)
 
             if not img_path.is_file():
-                print(f"{xhtml_file}:1:0: missing image {img_path}", file=stderr)
+                print(f"{xhtml_file}:1:0: missing image {img_path}", file=settings.errors)
                 success = False
             elif settings.test_images:
+                from PIL import Image
                 try:
                     Image.open(img_path).verify()
                 except IOError:
-                    print(f"{xhtml_file}:1:0: invalid image {img_path}", file=stderr)
+                    print(f"{xhtml_file}:1:0: invalid image {img_path}", file=settings.errors)
                     success = False
     return success
 
@@ -210,11 +287,98 @@ def test_links(xhtml_file: Path, xhtml: _Element) -> bool:
             if settings.verbose:
                 print("\t", path)
             if not path.exists():
-                print(f"{xhtml_file}:1:0: broken relative link {path}", file=stderr)
+                print(f"{xhtml_file}:1:0: broken relative link {path}", file=settings.errors)
                 success = False
     return success
 
 
+# A relative link or image URL in an XHTML file.
+RELATIVE_URL = re.compile(rb'(?:href|src)="([^":#]+)[^"]*"')
+
+
+def changed_since(revision: str, directory: Path) -> List[Path]:
+    """
+    The XHTML files that need testing after the changes since a git revision:
+    changed and added XHTML files, including uncommitted and untracked ones,
+    and files that link to changed, deleted or renamed files.
+
+    :param revision: a git revision, e.g. 'HEAD~3' or 'origin/master'
+    :param directory: a directory in the git repository
+    :return: the files
+    """
+    root = Path(_git(directory, 'rev-parse', '--show-toplevel').strip())
+    changed: Set[str] = set()
+    removed: Set[str] = set()
+
+    fields = _git(root, 'diff', '--name-status', '-z', '-M', revision, '--').split('\0')
+    while len(fields) > 1:
+        status = fields.pop(0)
+        if status.startswith(('R', 'C')):
+            old, new = fields.pop(0), fields.pop(0)
+            if status.startswith('R'):
+                removed.add(normpath(root / old))
+            changed.add(normpath(root / new))
+        elif status == 'D':
+            removed.add(normpath(root / fields.pop(0)))
+        else:
+            changed.add(normpath(root / fields.pop(0)))
+    for name in _git(root, 'ls-files', '-z', '--others', '--exclude-standard').split('\0'):
+        if name:
+            changed.add(normpath(root / name))
+
+    files = {path for path in changed if path.endswith('.xhtml') and Path(path).is_file()}
+    all_xhtml = _git(root, 'ls-files', '-z', '--cached', '--others',
+                     '--exclude-standard', '--', '*.xhtml').split('\0')
+    links_to = reverse_link_index(Path(root / name) for name in all_xhtml if name)
+    for target in removed | changed:
+        files.update(path for path in links_to.get(target, ()) if Path(path).is_file())
+    return sorted(Path(path) for path in files)
+
+
+def reverse_link_index(xhtml_files: Iterable[Path]) -> Dict[str, Set[str]]:
+    """
+    Map the normalised path of every file that is linked to, or used as an image,
+    to the set of normalised paths of XHTML files that link to it.
+    The files are scanned with a regular expression, not parsed.
+    """
+    links_to: Dict[str, Set[str]] = {}
+    for file in xhtml_files:
+        try:
+            data = file.read_bytes()
+        except IOError:
+            continue
+        source = normpath(file)
+        for target in link_targets(file, data):
+            links_to.setdefault(target, set()).add(source)
+    return links_to
+
+
+def link_targets(xhtml_file: Path, data: bytes) -> Set[str]:
+    """
+    The normalised paths of the files that an XHTML file links to, or uses as images.
+
+    :param xhtml_file: the file's path
+    :param data: the file's contents
+    """
+    targets = set()
+    for match in RELATIVE_URL.finditer(data):
+        url = unquote(match.group(1).decode('utf-8', 'replace'))
+        targets.add(normpath(xhtml_file.parent / url2pathname(url)))
+    return targets
+
+
+def _git(directory: Path, *args: str) -> str:
+    """Run a git command and return its output. Exit program on failure."""
+    try:
+        result = run_process(['git', *args], cwd=str(directory), stdout=PIPE,
+                             stderr=PIPE, check=True, universal_newlines=True)
+    except (CalledProcessError, OSError) as e:
+        message = getattr(e, 'stderr', None) or str(e)
+        print(f"{directory}:0:0: git {' '.join(args)}: {message.strip()}", file=settings.errors)
+        exit(1)
+    return result.stdout
+
+
 def open_dtd(dtd_file: Path) -> DTD:
     """
     Open a validate an XML DTD. Exit program on failure.
@@ -225,23 +389,28 @@ def open_dtd(dtd_file: Path) -> DTD:
     try:
         return DTD(str(dtd_file))
     except DTDParseError as e:
-        print(f"{dtd_file}:1: {e}", file=stderr)
+        print(f"{dtd_file}:1: {e}", file=settings.errors)
         exit(1)
 
 
-def open_schematron(schematron_file: Path) -> Schematron:
+def open_schematron(schematron_file: Path) -> 'FastSchematron':
     """
     Open a Schematron schema. Exit program on failure.
 
     :param schematron_file: path to a Schematron XML file
-    :return: A Schematron object
+    :return: A FastSchematron object
     """
+    from fast_schematron import FastSchematron
     try:
         xml = parse(str(schematron_file))
-        return Schematron(xml, store_report=True)
+        schematron = FastSchematron(xml, strict=settings.strict)
     except XMLSyntaxError as e:
-        print(f"{schematron_file}:1: {e}", file=stderr)
+        print(f"{schematron_file}:1: {e}", file=settings.errors)
         exit(1)
+    if settings.verbose:
+        for pattern in schematron.unsupported:
+            print(f"{schematron_file}: pattern {pattern}, checked by lxml's Schematron")
+    return schematron
 
 
 def main() -> None:
@@ -262,12 +431,35 @@ def main() -> None:
     parser.add_argument(
         "-v", "--verbose", action="store_true",
         help="print file names as they are tested")
+    parser.add_argument(
+        "-c", "--corpus", metavar="FILE", type=Path,
+        help="record results in a parsed article store, "
+             "and skip files that have passed since they last changed")
+    parser.add_argument(
+        "-g", "--changed-since", metavar="REVISION",
+        help="also test files changed since a git revision, and files that link to them")
+    parser.add_argument(
+        "-s", "--strict", action="store_true",
+        help="also test files with lxml's Schematron alone, "
+             "and fail if the fast Schematron checks disagree")
     parser.add_argument(
         "files", type=Path, metavar="XHTML", nargs="*",
         help="Big Book of Key files to test")
     parser.parse_args(namespace=settings)
 
-    success = run(settings.files)
+    files = list(settings.files)
+    if settings.changed_since:
+        # The Big Book's repository: that of the files given, or the default Big Book's.
+        if files:
+            directory = files[0].parent
+        else:
+            from settings import BIGBOOK_DIR
+            directory = BIGBOOK_DIR
+        given = {file.resolve() for file in files}
+        files += [file for file in changed_since(settings.changed_since, directory)
+                  if file.resolve() not in given]
+
+    success = run(files)
     if not success:
         if settings.verbose:
             print(f"FAILURE")
@@ -0,0 +1,255 @@
+"""
+The tools' build caches, kept together in one directory, settings.CACHE_DIR.
+
+Each cache is a store, a subdirectory of the cache directory named for
+what it holds, e.g. 'epub-images' for images fitted into EPUB budgets,
+with entries by key. Entries are written atomically, so an interrupted
+tool, or two tools at once, never leave half an entry to be read.
+
+A store is stamped with a version, in its 'VERSION' file, and is emptied
+when it is opened with another one. Stores are versioned by the code that
+makes their entries (see code_version), so when a tool changes its cached
+results are thrown away rather than used.
+
+Together the stores are kept within settings.CACHE_SIZE by deleting the
+least recently used entries, those read or written longest ago, as each
+tool that opened a store exits. The cache can be inspected and pruned with:
+
+    uber cache stats               each store's version, entries and size
+    uber cache prune [-s SIZE]     fit the stores into the budget, or SIZE
+
+Other files in the cache directory, such as the corpus database
+(see corpus.py), are counted in the statistics, but are never pruned.
+"""
+
+__all__ = ['VERSION_FILE', 'Store', 'StoreStats', 'code_version', 'open_store', 'stats', 'prune']
+
+import atexit
+import os
+from argparse import ArgumentParser
+from hashlib import sha256
+from pathlib import Path
+from typing import Iterator, List, NamedTuple, Optional, Set, Tuple
+
+VERSION_FILE = 'VERSION'
+"""The name of the file in each store that holds its version."""
+
+_SRC_DIR = Path(__file__).resolve().parent
+
+_opened: Set[Path] = set()  # the cache directories to prune at exit
+
+
+def code_version(*modules: str, version: str = '') -> str:
+    """
+    A store's version, from the source code of the tools' modules that
+    make its entries, e.g. code_version('epub_images'), and anything else
+    that they depend on.
+    """
+    digest = sha256(version.encode('utf-8'))
+    for module in modules:
+        digest.update((_SRC_DIR / f'{module}.py').read_bytes())
+    return digest.hexdigest()[:16]
+
+
+def _write_atomically(file: Path, data: bytes) -> None:
+    from tempfile import NamedTemporaryFile  # slow to import
+    file.parent.mkdir(parents=True, exist_ok=True)
+    with NamedTemporaryFile(dir=str(file.parent), prefix='.', delete=False) as f:
+        f.write(data)
+    os.replace(f.name, str(file))
+
+
+class Store:
+    """
+    A cache's entries, in files named by the hashes of their keys.
+    Reading an entry updates its modification time, which is when it was last used.
+
+    :ivar directory: the store's directory
+    :ivar version: the store's version
+    """
+    directory: Path
+    version: str
+
+    def __init__(self, directory: Path, version: str) -> None:
+        """Open a store, emptying it if it has another version, or none."""
+        self.directory = directory
+        self.version = version
+        stamp = directory / VERSION_FILE
+        try:
+            current = stamp.read_text().strip()
+        except OSError:
+            current = None
+        if current != version:
+            import shutil
+            shutil.rmtree(str(directory), ignore_errors=True)
+            _write_atomically(stamp, version.encode('utf-8'))
+
+    def path(self, key: str) -> Path:
+        """Where an entry is kept, whether or not it is there."""
+        digest = sha256(key.encode('utf-8')).hexdigest()
+        return self.directory / digest[:2] / digest
+
+    def file(self, key: str) -> Optional[Path]:
+        """An entry's file, to read or copy, or None if there is no such entry."""
+        file = self.path(key)
+        try:
+            os.utime(str(file))
+        except FileNotFoundError:
+            return None
+        return file
+
+    def get(self, key: str) -> Optional[bytes]:
+        """An entry, or None if there is no such entry."""
+        file = self.file(key)
+        try:
+            return file.read_bytes() if file else None
+        except FileNotFoundError:  # pruned meanwhile
+            return None
+
+    def put(self, key: str, data: bytes) -> Path:
+        """Write an entry, and return its file."""
+        file = self.path(key)
+        _write_atomically(file, data)
+        return file
+
+
+def open_store(name: str, version: str, cache_dir: Path = None) -> Store:
+    """
+    Open a store, to be pruned, with the rest, when this process exits.
+
+    :param name: the store's name, e.g. 'epub-images'
+    :param version: the store's version (see code_version)
+    :param cache_dir: the cache directory (default: settings.CACHE_DIR)
+    """
+    if cache_dir is None:
+        from settings import CACHE_DIR
+        cache_dir = CACHE_DIR
+    if cache_dir not in _opened:
+        _opened.add(cache_dir)
+        atexit.register(prune, cache_dir, _budget())
+    return Store(cache_dir / name, version)
+
+
+class StoreStats(NamedTuple):
+    """
+    A store's statistics.
+
+    :ivar name: the store's name, or the name of another file or directory in the cache
+    :ivar version: the store's version, or None if it isn't a store
+    :ivar files: the number of entries
+    :ivar size: their total size in bytes
+    :ivar last_used: when an entry was last used, as a POSIX timestamp, if there are any
+    """
+    name: str
+    version: Optional[str]
+    files: int
+    size: int
+    last_used: Optional[float]
+
+
+def _files(directory: Path) -> Iterator[Tuple[Path, os.stat_result]]:
+    """The files under a directory, and their stats."""
+    for root, _, names in os.walk(str(directory)):
+        for name in names:
+            file = Path(root) / name
+            try:
+                yield file, file.stat()
+            except FileNotFoundError:
+                pass
+
+
+def _stores(cache_dir: Path) -> Iterator[Path]:
+    for directory in sorted(cache_dir.iterdir()) if cache_dir.is_dir() else []:
+        if (directory / VERSION_FILE).is_file():
+            yield directory
+
+
+def stats(cache_dir: Path) -> List[StoreStats]:
+    """The statistics of the stores, and of anything else, in a cache directory."""
+    result = []
+    stores = set(_stores(cache_dir))
+    for path in sorted(cache_dir.iterdir()) if cache_dir.is_dir() else []:
+        if path in stores:
+            files = [stat for file, stat in _files(path) if file.name != VERSION_FILE]
+            version = (path / VERSION_FILE).read_text().strip()
+        else:
+            files = [stat for _, stat in _files(path)] if path.is_dir() else [path.stat()]
+            version = None
+        result.append(StoreStats(path.name, version, len(files),
+                                 sum(stat.st_size for stat in files),
+                                 max((stat.st_mtime for stat in files), default=None)))
+    return result
+
+
+def _budget() -> int:
+    from settings import CACHE_SIZE
+    from functions import parse_size
+    return parse_size(CACHE_SIZE)
+
+
+def prune(cache_dir: Path, size: int = None) -> Tuple[int, int]:
+    """
+    Delete the least recently used entries of the stores in a cache
+    directory, until they fit in a size.
+
+    :param cache_dir: the cache directory
+    :param size: the most bytes that the stores may take (default: settings.CACHE_SIZE)
+    :return: the number of entries deleted, and their total size
+    """
+    if size is None:
+        size = _budget()
+    entries = [(stat.st_mtime, stat.st_size, file)
+               for store in _stores(cache_dir)
+               for file, stat in _files(store) if file.name != VERSION_FILE]
+    total = sum(entry[1] for entry in entries)
+    deleted = freed = 0
+    for _, entry_size, file in sorted(entries, key=lambda entry: entry[0]):
+        if total - freed <= size:
+            break
+        try:
+            file.unlink()
+        except FileNotFoundError:
+            continue
+        deleted += 1
+        freed += entry_size
+    return deleted, freed
+
+
+def _megabytes(size: int) -> str:
+    return f"{size / 1024 ** 2:.1f} MB"
+
+
+def main() -> None:
+    from settings import CACHE_DIR, CACHE_SIZE
+    from functions import parse_size
+
+    parser = ArgumentParser(description=__doc__.split('\n\n')[0])
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('stats', help="print each store's version, entries and size")
+    prune_parser = subparsers.add_parser(
+        'prune', help="delete the least recently used entries, to fit the stores into the budget")
+    prune_parser.add_argument(
+        "-s", "--size", metavar="SIZE", type=parse_size, default=_budget(),
+        help=f"the most that the stores may take, e.g. '500M' (default: {CACHE_SIZE})")
+    args = parser.parse_args()
+
+    if args.command == 'prune':
+        deleted, freed = prune(CACHE_DIR, args.size)
+        print(f"deleted {deleted} entries, {_megabytes(freed)}")
+        return
+    from datetime import datetime
+    print(f"{CACHE_DIR}")
+    total = 0
+    for store in stats(CACHE_DIR):
+        last_used = (datetime.fromtimestamp(store.last_used).strftime('%Y-%m-%d %H:%M')
+                     if store.last_used else '')
+        print(f"{store.name:20} {store.version or '(not a store)':16} {store.files:7} files "
+              f"{_megabytes(store.size):>10}  {last_used}")
+        if store.version is not None:
+            total += store.size
+    print(f"{'stores':20} {'':16} {'':13} {_megabytes(total):>10}  "
+          f"of {_megabytes(_budget())}")
+
+
+if __name__ == '__main__':
+    main()
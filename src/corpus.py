@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+A store of parsed Big Book of Key articles, in an SQLite database.
+
+Each article file is parsed once, and again only when its contents
+change, i.e. when its hash changes. The store holds each article's
+metadata, body, outgoing links, image references, anchors and
+validation status, so that these can be looked up rather than the files
+re-parsed, and so that the archive can be queried with SQL:
+
+    corpus.py update
+    corpus.py query "SELECT id, title FROM articles WHERE blog = 0 ORDER BY title_key"
+    corpus.py duplicates
+
+(See 'duplicates.py' for finding near-duplicate articles.)
+
+So far bigbook.py's --corpus option and duplicates.py use the store. The
+website and the books don't: they read each article's file once per build
+anyway (see render.py), and the Index reads the table of contents.
+"""
+
+__all__ = ['Corpus']
+
+import sqlite3
+import sys
+from argparse import ArgumentParser
+from datetime import datetime
+from hashlib import sha1
+from pathlib import Path
+from typing import List, Optional, Tuple
+from urllib.parse import unquote, urldefrag
+
+from lxml.etree import XMLSyntaxError
+
+from files import parse_xhtml_file
+from functions import dictionary_order_sorting_key
+from index import blog_of
+from pages import body_span
+
+_SCHEMA_VERSION = 3  # stores made with other schemas are emptied
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS articles (
+    id             TEXT PRIMARY KEY,
+    file           TEXT NOT NULL,
+    hash           TEXT NOT NULL,
+    title          TEXT,
+    title_key      TEXT,
+    date           TEXT,
+    blog           INTEGER,
+    body           TEXT,
+    validation_key TEXT,
+    dependencies   TEXT,
+    valid          INTEGER
+);
+CREATE INDEX IF NOT EXISTS articles_date ON articles (date);
+CREATE INDEX IF NOT EXISTS articles_title_key ON articles (title_key);
+
+CREATE TABLE IF NOT EXISTS links (
+    source   TEXT NOT NULL REFERENCES articles (id) ON DELETE CASCADE,
+    target   TEXT NOT NULL,
+    fragment TEXT
+);
+CREATE INDEX IF NOT EXISTS links_source ON links (source);
+CREATE INDEX IF NOT EXISTS links_target ON links (target);
+
+CREATE TABLE IF NOT EXISTS images (
+    article TEXT NOT NULL REFERENCES articles (id) ON DELETE CASCADE,
+    src     TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS images_article ON images (article);
+
+CREATE TABLE IF NOT EXISTS anchors (
+    article TEXT NOT NULL REFERENCES articles (id) ON DELETE CASCADE,
+    anchor  TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS anchors_article ON anchors (article);
+
+CREATE TABLE IF NOT EXISTS signatures (
+    hash      TEXT PRIMARY KEY,
+    signature BLOB NOT NULL
+);
+'''
+
+
+class Corpus:
+    """
+    The parsed article store.
+
+    Articles are keyed by ID, which is the file name without '.xhtml'.
+    Links are to file names relative to the linking article,
+    e.g. '2004-05-01-badgers.xhtml'. Images are 'src' URLs as written.
+    """
+
+    def __init__(self, file: Path) -> None:
+        file.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(str(file))
+        self.db.row_factory = sqlite3.Row
+        self.db.execute('PRAGMA foreign_keys = ON')
+        if self.db.execute('PRAGMA user_version').fetchone()[0] != _SCHEMA_VERSION:
+            self.db.executescript('DROP TABLE IF EXISTS links; DROP TABLE IF EXISTS images;'
+                                  'DROP TABLE IF EXISTS anchors; DROP TABLE IF EXISTS signatures;'
+                                  'DROP TABLE IF EXISTS articles;')
+            self.db.execute(f'PRAGMA user_version = {_SCHEMA_VERSION}')
+        self.db.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        self.db.commit()
+        self.db.close()
+
+    def __enter__(self) -> 'Corpus':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def update(self, bigbook_dir: Path, verbose: bool = False) -> Tuple[int, int]:
+        """
+        Bring the store up to date with the Big Book's 'Text' directory.
+
+        :param bigbook_dir: the Big Book of Key directory
+        :param verbose: print the names of files as they are parsed
+        :return: the numbers of articles parsed and removed
+        """
+        files = {file.stem: file for file in (bigbook_dir / 'Text').glob('*.xhtml')
+                 if file.name != 'toc.xhtml'}
+        parsed = 0
+        for file in sorted(files.values()):
+            try:
+                if not self.update_file(file):
+                    continue
+            except ValueError as e:
+                print(e, file=sys.stderr)
+                continue
+            parsed += 1
+            if verbose:
+                print(file)
+        removed = [(row['id'],) for row in self.db.execute('SELECT id FROM articles')
+                   if row['id'] not in files]
+        self.db.executemany('DELETE FROM articles WHERE id = ?', removed)
+        self.db.commit()
+        return parsed, len(removed)
+
+    def update_file(self, file: Path) -> bool:
+        """
+        Parse an article file into the store, unless it is unchanged.
+
+        :return: True if the file was parsed
+        :raise ValueError: if the file can't be read or parsed, with a
+                           'file:line:col: message' error; it is removed
+                           from the store
+        """
+        try:
+            data = file.read_bytes()
+        except OSError as e:
+            raise self._unparsable(file, e.strerror) from None
+        digest = sha1(data).hexdigest()
+        row = self.db.execute('SELECT hash FROM articles WHERE id = ?', (file.stem,)).fetchone()
+        if row and row['hash'] == digest:
+            return False
+
+        try:
+            html = parse_xhtml_file(file)
+            if html is None:
+                raise ValueError("no html element")
+            start, end = body_span(data)
+            body = data[start:end].decode('utf-8')
+        except (ValueError, XMLSyntaxError) as e:  # including UnicodeDecodeError
+            raise self._unparsable(file, str(e)) from None
+        headings = html.xpath('//body//h1') or html.xpath('//head/title')
+        title = headings[0].text_content().strip() if headings else None
+        dates = html.xpath('//head/meta[@name="date"]/@content')
+        date = _iso_date(dates[0] if dates else file.stem)
+
+        with self.db:
+            self.db.execute('DELETE FROM articles WHERE id = ?', (file.stem,))
+            self.db.execute(
+                'INSERT INTO articles (id, file, hash, title, title_key, date, blog, body) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (file.stem, str(file), digest, title,
+                 dictionary_order_sorting_key(title) if title else None,
+                 date, blog_of(datetime.fromisoformat(date)) if date else None, body))
+            links = []
+            for href in html.xpath('//a/@href'):
+                url, fragment = urldefrag(str(href))
+                if ':' not in url and (url or fragment):
+                    links.append((file.stem, unquote(url) or file.name, fragment or None))
+            self.db.executemany('INSERT INTO links VALUES (?, ?, ?)', links)
+            self.db.executemany('INSERT INTO images VALUES (?, ?)',
+                                ((file.stem, str(src)) for src in html.xpath('//img/@src')))
+            self.db.executemany('INSERT INTO anchors VALUES (?, ?)',
+                                ((file.stem, str(anchor)) for anchor in html.xpath('//@id')))
+        return True
+
+    def _unparsable(self, file: Path, message: str) -> ValueError:
+        """Remove a file that can't be parsed from the store, and return its error."""
+        with self.db:
+            self.db.execute('DELETE FROM articles WHERE id = ?', (file.stem,))
+        return ValueError(f"{file}:1:0: {message}")
+
+    def query(self, sql: str, parameters: tuple = ()) -> List[sqlite3.Row]:
+        """Run an SQL query on the store."""
+        return self.db.execute(sql, parameters).fetchall()
+
+    def article(self, id: str) -> Optional[sqlite3.Row]:
+        return self.db.execute('SELECT * FROM articles WHERE id = ?', (id,)).fetchone()
+
+    def links_from(self, id: str) -> List[str]:
+        """The files that an article links to."""
+        return [row['target'] for row in self.db.execute(
+            'SELECT DISTINCT target FROM links WHERE source = ? ORDER BY target', (id,))]
+
+    def links_to(self, filename: str) -> List[str]:
+        """The IDs of the articles that link to a file, e.g. 'x.xhtml'."""
+        return [row['source'] for row in self.db.execute(
+            'SELECT DISTINCT source FROM links WHERE target = ? ORDER BY source', (filename,))]
+
+    def images(self, id: str) -> List[str]:
+        """The 'src' URLs of an article's images."""
+        return [row['src'] for row in self.db.execute(
+            'SELECT DISTINCT src FROM images WHERE article = ? ORDER BY src', (id,))]
+
+    def is_valid(self, file: Path, validation_key: str, dependencies: str) -> bool:
+        """
+        True if a file passed validation as it was when last parsed
+        (see update_file), with the same validator and the same files
+        that it links to and shows.
+
+        :param file: an article file
+        :param validation_key: identifies the validator and its settings
+        :param dependencies: identifies the state of the files that it links to and shows
+        """
+        row = self.db.execute(
+            'SELECT valid FROM articles WHERE id = ? AND validation_key = ? AND dependencies = ?',
+            (file.stem, validation_key, dependencies)).fetchone()
+        return bool(row and row['valid'])
+
+    def set_validation(self, file: Path, validation_key: str, dependencies: str,
+                       valid: bool) -> None:
+        """Record the result of validating a file, as it was when last parsed."""
+        with self.db:
+            self.db.execute('UPDATE articles SET validation_key = ?, dependencies = ?, valid = ? '
+                            'WHERE id = ?', (validation_key, dependencies, int(valid), file.stem))
+
+
+def _iso_date(s: str) -> Optional[str]:
+    try:
+        return datetime.fromisoformat(s[:10]).date().isoformat()
+    except ValueError:
+        return None
+
+
+def main() -> None:
+    from settings import BIGBOOK_DIR, CORPUS_FILE
+
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "-c", "--corpus", metavar="FILE", type=Path, default=CORPUS_FILE,
+        help="the SQLite store")
+    parser.add_argument(
+        "-b", "--bigbook", metavar="DIR", type=Path, default=BIGBOOK_DIR,
+        help="the Big Book of Key directory")
+    parser.add_argument(
+        "-v", "--verbose", action="store_true",
+        help="print file names as they are parsed")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('update', help="parse new and changed articles")
+    query = subparsers.add_parser('query', help="run an SQL query")
+    query.add_argument("sql", metavar="SQL")
+    duplicates = subparsers.add_parser(
+        'duplicates', help="update, then list clusters of near-duplicate articles")
+    duplicates.add_argument(
+        "-t", "--threshold", metavar="SIMILARITY", type=float, default=0.7,
+        help="the least estimated similarity, from 0 to 1 (default: 0.7)")
+    args = parser.parse_args()
+
+    with Corpus(args.corpus) as corpus:
+        if args.command == 'update':
+            parsed, removed = corpus.update(args.bigbook, args.verbose)
+            if args.verbose:
+                print(f"{parsed} parsed, {removed} removed")
+        elif args.command == 'duplicates':
+            from duplicates import report  # needs NumPy
+            corpus.update(args.bigbook, args.verbose)
+            for line in report(corpus, args.threshold):
+                print(line)
+        else:
+            for row in corpus.query(args.sql):
+                print('\t'.join('' if value is None else str(value) for value in row))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+"""
+Find duplicate and near-duplicate articles in the parsed article store.
+
+The Big Book merges three blogs, and the same piece sometimes turns up
+in more than one of them. Each article's body text is split into
+shingles, runs of SHINGLE_WORDS words, and summarised by a MinHash
+signature: for each of SIGNATURE_SIZE random hash functions, the least
+hash of any of its shingles. The fraction of equal values in two
+signatures estimates the Jaccard similarity of the articles' shingles.
+
+Rather than comparing every pair of articles, the signatures are cut
+into BANDS bands, and articles with an identical band are candidates
+(locality-sensitive hashing), which takes near-linear time. Candidates
+whose estimated similarity reaches the threshold are grouped into
+clusters. Articles with fewer than SHINGLE_WORDS words, such as those
+that are only an image or a recording, have no shingles, and are left
+out rather than all looking alike.
+
+Signatures are kept in the store by article hash, so only new and
+changed articles are shingled again:
+
+    corpus.py duplicates [--threshold 0.7]
+"""
+
+__all__ = ['SIGNATURE_SIZE', 'BANDS', 'SHINGLE_WORDS',
+           'shingles', 'signature', 'signatures', 'candidates', 'clusters', 'report']
+
+import re
+from html import unescape
+from itertools import combinations
+from typing import Dict, Iterable, List, Set, Tuple
+from zlib import crc32
+
+import numpy as np
+
+from corpus import Corpus
+
+SIGNATURE_SIZE = 128
+"""The number of hash functions in a MinHash signature."""
+
+BANDS = 32
+"""
+The number of bands the signatures are cut into. With 4 values per band,
+articles that are 40% similar have an even chance of being candidates,
+and 80% similar ones are almost certain to be.
+"""
+
+SHINGLE_WORDS = 5
+"""The number of words in a shingle."""
+
+_PRIME = np.uint64((1 << 31) - 1)
+_SEED = 1849  # fixed, so that cached signatures stay comparable
+_TAG = re.compile(r'<[^>]*>')
+_WORD = re.compile(r'\w+')
+
+_random = np.random.default_rng(_SEED)
+_A = _random.integers(1, int(_PRIME), SIGNATURE_SIZE, dtype=np.uint64)
+_B = _random.integers(0, int(_PRIME), SIGNATURE_SIZE, dtype=np.uint64)
+
+
+def shingles(body: str) -> np.ndarray:
+    """
+    The 31 bit hashes of the word shingles in an article's XHTML body,
+    none if it has fewer than SHINGLE_WORDS words.
+
+    >>> len(shingles('')), len(shingles('<img src="x"/>')), len(shingles('<p>a b c d e f</p>'))
+    (0, 0, 2)
+    """
+    words = _WORD.findall(unescape(_TAG.sub(' ', body)).casefold())
+    hashes = np.fromiter((crc32(word.encode('utf-8')) for word in words),
+                         dtype=np.uint64, count=len(words))
+    if len(hashes) < SHINGLE_WORDS:
+        return np.array([], dtype=np.uint64)
+    # Combine each run of word hashes as a polynomial, mod 2^64, in one pass per word.
+    n = len(hashes) - SHINGLE_WORDS + 1
+    combined = np.zeros(n, dtype=np.uint64)
+    for i in range(SHINGLE_WORDS):
+        combined = combined * np.uint64(1000003) + hashes[i:i + n]
+    return np.unique((combined ^ (combined >> np.uint64(31))) & _PRIME)
+
+
+def signature(hashes: np.ndarray) -> np.ndarray:
+    """The MinHash signature of a set of shingle hashes, empty if there are none."""
+    if not len(hashes):
+        return np.array([], dtype=np.uint32)
+    # (a * x + b) mod p for each hash function and shingle: a, b, x < 2^31, so no overflow.
+    return ((np.outer(_A, hashes) + _B[:, None]) % _PRIME).min(axis=1).astype(np.uint32)
+
+
+def signatures(corpus: Corpus) -> Dict[str, np.ndarray]:
+    """
+    The signatures of the articles in the store that have shingles, by
+    article ID, computing those that aren't in the store already.
+    """
+    cached = {row['hash']: np.frombuffer(row['signature'], dtype=np.uint32)
+              for row in corpus.query('SELECT hash, signature FROM signatures')}
+    result = {}
+    new = []
+    for row in corpus.query('SELECT id, hash, body FROM articles ORDER BY id'):
+        if row['hash'] not in cached:
+            cached[row['hash']] = signature(shingles(row['body'] or ''))
+            new.append((row['hash'], cached[row['hash']].tobytes()))
+        if len(cached[row['hash']]):
+            result[row['id']] = cached[row['hash']]
+    with corpus.db:
+        corpus.db.executemany('INSERT OR REPLACE INTO signatures VALUES (?, ?)', new)
+        corpus.db.execute('DELETE FROM signatures WHERE hash NOT IN (SELECT hash FROM articles)')
+    return result
+
+
+def candidates(signatures: Dict[str, np.ndarray]) -> Set[Tuple[str, str]]:
+    """Pairs of article IDs that share a band of their signatures."""
+    rows = SIGNATURE_SIZE // BANDS
+    pairs = set()
+    for band in range(BANDS):
+        buckets: Dict[bytes, List[str]] = {}
+        for id, values in signatures.items():
+            buckets.setdefault(values[band * rows:(band + 1) * rows].tobytes(), []).append(id)
+        for ids in buckets.values():
+            pairs.update(combinations(ids, 2))
+    return pairs
+
+
+def clusters(signatures: Dict[str, np.ndarray],
+             threshold: float) -> List[Tuple[float, List[str]]]:
+    """
+    Groups of similar articles.
+
+    :param signatures: the articles' signatures, by ID
+    :param threshold: the least estimated similarity, from 0 to 1
+    :return: each cluster's least similarity between linked articles,
+             and its article IDs, sorted
+    """
+    parent = {}
+
+    def root(id: str) -> str:
+        while parent.get(id, id) != id:
+            id = parent[id]
+        return id
+
+    similar: List[Tuple[str, str, float]] = []
+    for a, b in candidates(signatures):
+        similarity = float(np.mean(signatures[a] == signatures[b]))
+        if similarity >= threshold:
+            similar.append((a, b, similarity))
+            parent[root(a)] = root(b)
+
+    groups: Dict[str, Set[str]] = {}
+    least: Dict[str, float] = {}
+    for a, b, similarity in similar:
+        r = root(a)
+        least[r] = min(least.get(r, 1.0), similarity)
+        groups.setdefault(r, set()).update((a, b))
+    return sorted((least[r], sorted(ids)) for r, ids in groups.items())
+
+
+def report(corpus: Corpus, threshold: float) -> Iterable[str]:
+    """Lines describing each cluster of similar articles, with their blogs."""
+    blogs = {row['id']: row['blog'] for row in corpus.query('SELECT id, blog FROM articles')}
+    for similarity, ids in sorted(clusters(signatures(corpus), threshold),
+                                  key=lambda cluster: cluster[1]):  # by first ID
+        yield f"{similarity:.2f}  " + '  '.join(f"{id} (blog {blogs[id]})" for id in ids)
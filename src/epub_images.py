@@ -0,0 +1,194 @@
+"""
+Fit a book's images into a size budget.
+
+Some books are too big for e-reader stores and email delivery, and
+slow to open on low-end readers, because of their images. With an
+ImageBudget, the images copied into an EPUB workspace are recompressed
+and, if need be, downscaled until they fit: each image into the
+per-image budget, and all of them together into the total budget, which
+is shared out in proportion to the images' sizes.
+
+Every image keeps its name and its format, so book.xml and the media
+types in content.opf stay correct: JPEG files are re-encoded at lower
+qualities, while PNG and GIF files, which are used where the image must
+be lossless, are only optimized and downscaled. Images that already fit
+are left as they are, and animated GIFs are never changed.
+
+Images are fitted in parallel, and the results are cached by the hash
+of the source image and the budget, so rebuilding a book is quick
+(see cache.py; the cache is emptied when this module changes).
+"""
+
+__all__ = ['ImageBudget', 'fit_image', 'fit_images', 'parse_size']
+
+from dataclasses import dataclass
+from hashlib import sha256
+from io import BytesIO
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple, TYPE_CHECKING
+
+from functions import parse_size
+
+if TYPE_CHECKING:
+    from cache import Store
+
+FORMATS = {'.jpg': 'JPEG', '.jpeg': 'JPEG', '.png': 'PNG', '.gif': 'GIF'}
+"""Image file extensions, and the format that files with them are saved in."""
+
+JPEG_QUALITIES = (85, 75, 65, 55, 45)
+"""The qualities tried, in turn, at each size of a JPEG image."""
+
+SCALE_STEP = 0.8
+"""How much an image is shrunk by, each time it does not fit."""
+
+MIN_EDGE = 32
+"""Images are not shrunk so that their longer edge is less than this many pixels."""
+
+
+@dataclass(frozen=True)
+class ImageBudget:
+    """
+    The most bytes that a book's images may take.
+
+    :ivar total: the most for all of the images together
+    :ivar per_image: the most for any one image
+    """
+    total: Optional[int] = None
+    per_image: Optional[int] = None
+
+
+def fit_image(data: bytes, extension: str, budget: int) -> bytes:
+    """
+    Recompress and shrink an image until it fits a budget, keeping its format.
+    If it can't be made to fit the smallest version is returned.
+
+    :param data: the image file's contents
+    :param extension: the image file's extension, e.g. '.png'
+    :param budget: the most bytes that the image may take
+    :return: the new contents, or the original contents if they fit
+    """
+    from PIL import Image  # slow to import
+
+    image_format = FORMATS[extension.lower()]
+    if len(data) <= budget:
+        return data
+    image = Image.open(BytesIO(data))
+    if getattr(image, 'is_animated', False):
+        return data
+
+    best = data
+    original_size = image.size
+    scale = 1.0
+    while True:
+        size = (max(1, round(original_size[0] * scale)),
+                max(1, round(original_size[1] * scale)))
+        scaled = image if scale == 1.0 else _resized(image, size)
+        for candidate in _encodings(scaled, image_format):
+            if len(candidate) < len(best):
+                best = candidate
+            if len(candidate) <= budget:
+                return candidate
+        if max(size) * SCALE_STEP < MIN_EDGE:
+            return best
+        scale *= SCALE_STEP
+
+
+def _resized(image, size: Tuple[int, int]):
+    from PIL import Image
+    if image.mode in ('P', '1'):
+        # Palette images are resized in full colour, and made into palette images again.
+        converted = image.convert('RGBA').resize(size, Image.LANCZOS)
+        return converted.quantize(256) if image.mode == 'P' else converted.convert('1')
+    return image.resize(size, Image.LANCZOS)
+
+
+def _encodings(image, image_format: str) -> Iterable[bytes]:
+    """An image's encodings in a format, best first."""
+    if image_format == 'JPEG':
+        if image.mode not in ('RGB', 'L', 'CMYK'):
+            image = image.convert('RGB')
+        for quality in JPEG_QUALITIES:
+            yield _save(image, 'JPEG', quality=quality, optimize=True, progressive=True)
+    else:
+        yield _save(image, image_format, optimize=True)
+
+
+def _save(image, image_format: str, **options) -> bytes:
+    f = BytesIO()
+    image.save(f, image_format, **options)
+    return f.getvalue()
+
+
+def _fit_file(file: Path, budget: int, cache: 'Store') -> Tuple[Path, int, int]:
+    """
+    Fit an image file into a budget, in place.
+    :return: the file, and its sizes before and after
+    """
+    data = file.read_bytes()
+    key = f'{sha256(data).hexdigest()}:{file.suffix.lower()}:{budget}'
+    fitted = cache.get(key)
+    if fitted is None:
+        fitted = fit_image(data, file.suffix, budget)
+        cache.put(key, fitted)
+    if fitted != data:
+        file.write_bytes(fitted)
+    return file, len(data), len(fitted)
+
+
+def _budgets(sizes: Dict[Path, int], budget: ImageBudget) -> Dict[Path, int]:
+    """Each image's share of the budget."""
+    total = sum(sizes.values())
+    budgets = {}
+    for file, size in sizes.items():
+        share = size
+        if budget.total is not None and total > budget.total:
+            share = size * budget.total // total
+        if budget.per_image is not None:
+            share = min(share, budget.per_image)
+        budgets[file] = share
+    return budgets
+
+
+def fit_images(files: List[Path], budget: ImageBudget,
+               cache: 'Store' = None,
+               jobs: Optional[int] = None) -> List[str]:
+    """
+    Fit image files into a budget, in place. Files that aren't
+    JPEG, PNG or GIF images are left alone, and not counted.
+
+    :param files: the image files, e.g. in an EPUB workspace's 'OEBPS/Images'
+    :param budget: the budget
+    :param cache: where to keep fitted images (default: the 'epub-images' store)
+    :param jobs: the number of worker processes (default: one per CPU;
+                 1 fits the images in this process)
+    :return: error messages for images that could not be made to fit,
+             either the per-image budget or, together, the total budget
+    """
+    if cache is None:
+        from cache import code_version, open_store
+        cache = open_store('epub-images', code_version('epub_images'))
+    sizes = {file: file.stat().st_size for file in files
+             if file.suffix.lower() in FORMATS}
+    budgets = _budgets(sizes, budget)
+    todo = [(file, budgets[file], cache) for file in sizes if sizes[file] > budgets[file]]
+
+    if jobs == 1 or len(todo) < 2:
+        results = [_fit_file(*args) for args in todo]
+    else:
+        from concurrent.futures import ProcessPoolExecutor  # slow to import
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            results = list(pool.map(_fit_file, *zip(*todo)))
+
+    # An image that can't be made to fit its share of the total
+    # doesn't matter, as long as the images fit the total.
+    errors = []
+    for file, _, after in results:
+        sizes[file] = after
+        if budget.per_image is not None and after > budget.per_image:
+            errors.append(f"{file}:0:0: image is {after} bytes, "
+                          f"and can't be made to fit in {budget.per_image}")
+    total = sum(sizes.values())
+    if budget.total is not None and total > budget.total:
+        errors.append(f"{files[0].parent}:0:0: images are {total} bytes, "
+                      f"over the budget of {budget.total}")
+    return errors
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+A quick structural check of an EPUB, for the edit-build loop.
+
+This catches the common mistakes without starting up Java for epubcheck:
+
+    (a) the 'mimetype' file must come first, uncompressed, in an EPUB zip;
+
+    (b) the 'content.opf' manifest must match the EPUB's files;
+
+    (c) the spine and 'toc.ncx' entries must resolve;
+
+    (d) the sections and images listed in 'book.xml' must be present;
+
+    (e) links and images in the text files must not be broken.
+
+Errors are printed in the same 'path:line:column: message' format as
+'epubcheck_filter.py', with errors in text files pointing at the book's
+source files. Epubcheck is still needed for a full check.
+"""
+
+__all__ = ['EpubFiles', 'check']
+
+from argparse import ArgumentParser
+from pathlib import Path, PurePosixPath
+from posixpath import normpath
+from sys import stderr, exit
+from typing import Dict, List, Optional, Set, Tuple
+from urllib.parse import unquote, urldefrag
+from zipfile import ZipFile, ZIP_STORED
+
+from lxml.etree import XMLParser, XMLSyntaxError, fromstring
+
+from epubcheck_filter import source_path
+from xml import namespaces, Element
+
+EPUB_MIMETYPE = b'application/epub+zip'
+
+CONTAINER_NS = {'c': 'urn:oasis:names:tc:opendocument:xmlns:container'}
+
+
+class EpubFiles:
+    """
+    Read-only access to the files of an EPUB,
+    either a workspace directory or a zipped '.epub' file.
+    File names are relative POSIX paths, e.g. 'OEBPS/Text/toc.html'.
+    """
+
+    def __init__(self, epub: Path) -> None:
+        self.epub = epub
+        self.zip = None if epub.is_dir() else ZipFile(str(epub))
+        if self.zip:
+            self.names = [info.filename for info in self.zip.infolist()
+                          if not info.filename.endswith('/')]
+        else:
+            self.names = sorted(str(PurePosixPath(*path.relative_to(epub).parts))
+                                for path in epub.rglob('*') if path.is_file())
+        self._name_set = set(self.names)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._name_set
+
+    def read(self, name: str) -> bytes:
+        if self.zip:
+            return self.zip.read(name)
+        return (self.epub / name).read_bytes()
+
+    def location(self, name: str) -> str:
+        """Where to report errors in a file."""
+        return f"{self.epub}/{name}"
+
+
+class _Checker:
+    """Collects error messages while checking an EPUB."""
+
+    def __init__(self, book: Path, files: EpubFiles) -> None:
+        self.book = book
+        self.files = files
+        self.errors: List[str] = []
+        self.ids: Dict[str, Set[str]] = {}  # ids defined in each XML file
+
+    def error(self, name: str, line: Optional[int], message: str) -> None:
+        location = None
+        if name.startswith('OEBPS/Text/'):
+            location = source_path(str(self.book), name[len('OEBPS/Text/'):])
+        if not location:
+            location = self.files.location(name)
+        self.errors.append(f"{location}:{line or 1}:0: {message}")
+
+    def parse(self, name: str) -> Optional[Element]:
+        """Parse an XML file in the EPUB, reporting syntax errors."""
+        if name not in self.files:
+            return None
+        parser = XMLParser(resolve_entities=False, no_network=True, load_dtd=False)
+        try:
+            root = fromstring(self.files.read(name), parser)
+        except XMLSyntaxError as e:
+            self.error(name, e.lineno, str(e.msg))
+            return None
+        self.ids[name] = set(root.xpath('//@id'))
+        return root
+
+    def check_mimetype(self) -> None:
+        files = self.files
+        if 'mimetype' not in files:
+            self.error('mimetype', 1, "missing 'mimetype' file")
+            return
+        if files.read('mimetype') != EPUB_MIMETYPE:
+            self.error('mimetype', 1, f"'mimetype' must contain exactly {EPUB_MIMETYPE.decode()}")
+        if files.zip:
+            first = files.zip.infolist()[0]
+            if first.filename != 'mimetype':
+                self.error('mimetype', 1, "'mimetype' must be the first file in the zip")
+            elif first.compress_type != ZIP_STORED or first.extra:
+                self.error('mimetype', 1, "'mimetype' must be stored uncompressed, "
+                                          "with no extra field")
+
+    def check_container(self) -> Optional[str]:
+        """Check the container file, and return the OPF file's name."""
+        name = 'META-INF/container.xml'
+        container = self.parse(name)
+        if container is None:
+            if name not in self.files:
+                self.error(name, 1, 'missing container file')
+            return None
+        rootfiles = container.xpath('//c:rootfile/@full-path', namespaces=CONTAINER_NS)
+        if not rootfiles:
+            self.error(name, 1, 'no rootfile')
+            return None
+        if rootfiles[0] not in self.files:
+            self.error(name, 1, f"missing package file {rootfiles[0]}")
+            return None
+        return str(rootfiles[0])
+
+    def check_package(self, opf_name: str) -> Tuple[Dict[str, str], Optional[str]]:
+        """
+        Check the manifest and spine.
+        Return the manifest, as id to file name, and the NCX file's name.
+        """
+        opf = self.parse(opf_name)
+        if opf is None:
+            return {}, None
+        manifest = {}
+        for item in opf.xpath('//opf:manifest/opf:item', namespaces=namespaces):
+            name = _resolve(opf_name, item.get('href'))
+            manifest[item.get('id')] = name
+            if name not in self.files:
+                self.error(opf_name, item.sourceline, f"manifest item {name} is missing")
+
+        listed = set(manifest.values()) | {opf_name, 'mimetype'}
+        for name in self.files.names:
+            if not name.startswith('META-INF/') and name not in listed:
+                self.error(opf_name, 1, f"{name} is not in the manifest")
+
+        for itemref in opf.xpath('//opf:spine/opf:itemref', namespaces=namespaces):
+            if itemref.get('idref') not in manifest:
+                self.error(opf_name, itemref.sourceline,
+                           f"spine item {itemref.get('idref')} is not in the manifest")
+
+        spine = opf.xpath('//opf:spine', namespaces=namespaces)
+        ncx_id = spine[0].get('toc') if spine else None
+        return manifest, manifest.get(ncx_id)
+
+    def check_ncx(self, ncx_name: str) -> None:
+        ncx = self.parse(ncx_name)
+        if ncx is None:
+            return
+        for content in ncx.xpath('//ncx:content', namespaces=namespaces):
+            self.check_reference(ncx_name, content.sourceline, content.get('src'))
+
+    def check_book_xml(self) -> None:
+        """Check that every section and image in book.xml made it into the EPUB."""
+        book_xml = self.book / 'book.xml'
+        try:
+            book = fromstring(book_xml.read_bytes(), XMLParser(load_dtd=False))
+        except (IOError, XMLSyntaxError) as e:
+            self.errors.append(f"{book_xml}:1:0: {e}")
+            return
+        for subdirectory, xpath in (('Text', '//section[@file]'),
+                                    ('Images', '//image'),
+                                    ('Styles', '//style'),
+                                    ('Fonts', '//font')):
+            for e in book.xpath(xpath):
+                if f"OEBPS/{subdirectory}/{e.get('file')}" not in self.files:
+                    self.errors.append(f"{book_xml}:{e.sourceline}:0: "
+                                       f"{subdirectory}/{e.get('file')} is missing")
+
+    def check_text(self, manifest: Dict[str, str]) -> None:
+        """Check the links and images in every XHTML file in the manifest."""
+        documents = {}
+        for name in manifest.values():
+            if name.endswith(('.html', '.xhtml')) and name in self.files:
+                documents[name] = self.parse(name)
+        for name, html in documents.items():
+            if html is None:
+                continue
+            for a in html.xpath('//xhtml:a[@href]', namespaces=namespaces):
+                self.check_reference(name, a.sourceline, a.get('href'))
+            for img in html.xpath('//xhtml:img[@src]', namespaces=namespaces):
+                self.check_reference(name, img.sourceline, img.get('src'))
+
+    def check_reference(self, name: str, line: int, href: str) -> None:
+        """Check that a relative URL in a file resolves to a file and anchor in the EPUB."""
+        if ':' in href:
+            return
+        url, fragment = urldefrag(href)
+        target = _resolve(name, url) if url else name
+        if target not in self.files:
+            self.error(name, line, f"broken link {href}")
+        elif fragment:
+            if target not in self.ids:
+                self.parse(target)
+            if fragment not in self.ids.get(target, ()):
+                self.error(name, line, f"broken link {href}, no such id in {target}")
+
+
+def _resolve(base_name: str, href: str) -> str:
+    """The EPUB file name that a relative URL in a file refers to."""
+    directory = PurePosixPath(base_name).parent
+    return normpath(str(directory / unquote(href)))
+
+
+def check(book: Path, epub: Path) -> List[str]:
+    """
+    Check an EPUB.
+
+    :param book: the book source directory, containing 'book.xml'
+    :param epub: the EPUB workspace directory or '.epub' file
+    :return: error messages, an empty list if the EPUB passes
+    """
+    checker = _Checker(book, EpubFiles(epub))
+    checker.check_mimetype()
+    opf_name = checker.check_container()
+    if opf_name:
+        manifest, ncx_name = checker.check_package(opf_name)
+        if ncx_name:
+            checker.check_ncx(ncx_name)
+        checker.check_text(manifest)
+    checker.check_book_xml()
+    return checker.errors
+
+
+def main() -> None:
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "book", type=Path, metavar="BOOK",
+        help="the book source directory")
+    parser.add_argument(
+        "epub", type=Path, metavar="EPUB",
+        help="the EPUB workspace directory or .epub file")
+    args = parser.parse_args()
+
+    errors = check(args.book, args.epub)
+    for message in errors:
+        print(message, file=stderr)
+    if errors:
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
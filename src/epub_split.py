@@ -0,0 +1,162 @@
+"""
+Split oversized sections of an EPUB into parts.
+
+Some e-readers are slow to load long files, or refuse files over a
+size limit, and some Big Book articles and compiled sections are long.
+A section's file that is bigger than the threshold is split between
+the top-level blocks of its body, preferably before a heading, into
+parts of about the threshold's size. The first part keeps the section's
+file name, and the others are named after it, e.g. 'long-2.xhtml'.
+
+The parts are added to the book's book.xml tree, as the section's first
+subsections with toc="no" and part="yes", so they follow the section in
+the OPF spine, and the NCX and contents page leave them out. (The tree
+is the one in memory: the book's own book.xml file is not changed.)
+Links to anchors that have moved into other parts are rewritten, in
+every text file in the workspace.
+"""
+
+__all__ = ['Split', 'split_file', 'rewrite_links', 'split_sections']
+
+import re
+from copy import deepcopy
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from lxml.etree import XMLParser, XMLSyntaxError, parse, tostring
+
+import xml
+
+HEADINGS = {f"{{{xml.namespaces['xhtml']}}}h{n}" for n in range(1, 7)}
+
+_ANCHOR_LINK = re.compile(rb'href="([^"#:]*)#([^"]+)"')
+
+
+class Split(NamedTuple):
+    """
+    A section's file, split into parts.
+
+    :ivar file: the section's file name, which is also the first part's
+    :ivar parts: the other parts' file names, in order
+    :ivar anchors: every 'id' in the parts, and the part that it is in
+    """
+    file: str
+    parts: List[str]
+    anchors: Dict[str, str]
+
+
+def _breaks(sizes: List[int], headings: List[bool], limit: int) -> List[int]:
+    """
+    The indexes of the blocks that start each part. A part is ended early
+    before a heading, when it is at least half full.
+
+    >>> _breaks([40, 40, 40, 40], [False] * 4, 100)
+    [0, 2]
+    >>> _breaks([40, 10, 40, 40], [False, False, True, False], 100)
+    [0, 2]
+    """
+    breaks = [0]
+    size = 0
+    for i, (block_size, heading) in enumerate(zip(sizes, headings)):
+        if i > breaks[-1] and (size + block_size > limit or (heading and size >= limit // 2)):
+            breaks.append(i)
+            size = 0
+        size += block_size
+    return breaks
+
+
+def split_file(file: Path, threshold: int) -> Optional[Split]:
+    """
+    Split an XHTML file into parts of about 'threshold' bytes, if it is bigger.
+    The first part replaces the file, and the others are written beside it.
+
+    :return: the split, or None if the file is small enough, or has too
+             few blocks to split
+    :raise XMLSyntaxError: if the file can't be parsed, e.g. if it uses
+                           entities, such as '&nbsp;', whose DTD can't be loaded
+    """
+    if file.stat().st_size <= threshold:
+        return None
+    tree = parse(str(file), XMLParser(load_dtd=True, resolve_entities=True, no_network=True))
+    body = tree.getroot().find(f"{{{xml.namespaces['xhtml']}}}body")
+    blocks = list(body) if body is not None else []
+    sizes = [len(tostring(block, encoding='utf-8')) for block in blocks]
+    overhead = file.stat().st_size - sum(sizes)
+    breaks = _breaks(sizes, [block.tag in HEADINGS for block in blocks],
+                     max(threshold - overhead, 1))
+    if len(breaks) < 2:
+        return None
+
+    names = [file.name] + [f"{file.stem}-{n}{file.suffix}" for n in range(2, len(breaks) + 1)]
+    anchors = {}
+    documents = []
+    for number, (start, end) in enumerate(zip(breaks, breaks[1:] + [len(blocks)])):
+        part = deepcopy(tree)
+        part_body = part.getroot().find(f"{{{xml.namespaces['xhtml']}}}body")
+        for i, block in enumerate(list(part_body)):
+            if not start <= i < end:
+                part_body.remove(block)
+        if number > 0:
+            part_body.text = '\n'
+        for id in part_body.xpath('.//@id'):
+            anchors[str(id)] = names[number]
+        documents.append(part)
+    for name, part in zip(names, documents):
+        (file.parent / name).write_bytes(
+            tostring(part, encoding='utf-8', xml_declaration=True))
+    return Split(file.name, names[1:], anchors)
+
+
+def rewrite_links(text_dir: Path, splits: List[Split]) -> None:
+    """
+    Point links to anchors in split files at the parts that the anchors
+    are now in, in every file in a workspace's 'Text' directory.
+    """
+    anchors = {split.file: split.anchors for split in splits}
+    origin = {part: split.file for split in splits for part in split.parts}
+
+    for file in sorted(text_dir.glob('*')):
+        def rewrite(match) -> bytes:
+            target = match.group(1).decode('utf-8') or origin.get(file.name, file.name)
+            id = match.group(2).decode('utf-8')
+            if target not in anchors or id not in anchors[target]:
+                return match.group()
+            part = anchors[target][id]
+            return f'href="{"" if part == file.name else part}#{id}"'.encode('utf-8')
+
+        data = file.read_bytes()
+        rewritten = _ANCHOR_LINK.sub(rewrite, data)
+        if rewritten != data:
+            file.write_bytes(rewritten)
+
+
+def split_sections(book: xml.Element, text_dir: Path,
+                   threshold: int) -> Tuple[List[Split], List[str]]:
+    """
+    Split the files of a book's sections that are bigger than a threshold,
+    add the parts to the book.xml tree and rewrite links to the parts.
+    A file that can't be parsed is left whole.
+
+    :param book: the root of the book's book.xml
+    :param text_dir: the EPUB workspace's 'OEBPS/Text' directory
+    :param threshold: the largest file size, in bytes
+    :return: the splits, and error messages for files that can't be parsed
+    """
+    splits = []
+    errors = []
+    for section in xml.get_all(book, '//section[@file]'):
+        file = text_dir / section.get('file')
+        try:
+            split = split_file(file, threshold) if file.exists() else None
+        except XMLSyntaxError as e:
+            errors.append(f"{file}:{e.lineno}:0: {e.msg}")
+            continue
+        if split:
+            position = 1 if section.find('title') is not None else 0
+            for n, part in enumerate(split.parts):
+                section.insert(position + n,
+                               xml.element('section', file=part, toc='no', part='yes'))
+            splits.append(split)
+    if splits:
+        rewrite_links(text_dir, splits)
+    return splits, errors
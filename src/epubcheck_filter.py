@@ -6,8 +6,6 @@ import os
 import re
 import sys
 
-BOOK = sys.argv[1]  # book source directory
-
 HTML_ERROR_LINE = re.compile(r'''
    .* : .* / .* [.]epub/OEBPS/Text/
    (.*)
@@ -16,7 +14,7 @@ HTML_ERROR_LINE = re.compile(r'''
 ''', re.VERBOSE)
 
 XML_ERROR_LINE = re.compile(r'''
-   .*: 
+   .*:
    (.*)
    / .* [.]epub
    / (.*)
@@ -24,29 +22,46 @@ XML_ERROR_LINE = re.compile(r'''
    (.*)
 ''', re.VERBOSE)
 
-error = False
 
-for line in sys.stdin.readlines():
-    
-    match = HTML_ERROR_LINE.match(line)
-    if match:
-        filename, line, column, message = match.group(1, 2, 3, 4)
-        for directory in ['Edited', 'Text']:
-            path = os.path.join(BOOK, directory, filename)
-            if os.path.exists(path):
+def source_path(book, filename):
+    """
+    The book source file that an EPUB 'OEBPS/Text' file was copied from,
+    or None if it was not copied from the book's directory.
+    """
+    for directory in ['Edited', 'Text']:
+        path = os.path.join(book, directory, filename)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def main():
+    book = sys.argv[1]  # book source directory
+    error = False
+
+    for line in sys.stdin.readlines():
+
+        match = HTML_ERROR_LINE.match(line)
+        if match:
+            filename, line, column, message = match.group(1, 2, 3, 4)
+            path = source_path(book, filename)
+            if path:
                 sys.stderr.write('%s:%s:%s%s\n' % (path, line, column, message))
                 error = True
-                break
-        continue
-    
-    match = XML_ERROR_LINE.match(line)
-    if match:
-        path1, path2, line, column, message = match.group(1, 2, 3, 4, 5)
-        sys.stderr.write('%s/epub/%s:%s:%s%s\n' % (path1, path2, line, column, message))
-        error = True
-        continue
-    
-    sys.stderr.write(line)
-
-if error:
-    sys.exit(1)
+            continue
+
+        match = XML_ERROR_LINE.match(line)
+        if match:
+            path1, path2, line, column, message = match.group(1, 2, 3, 4, 5)
+            sys.stderr.write('%s/epub/%s:%s:%s%s\n' % (path1, path2, line, column, message))
+            error = True
+            continue
+
+        sys.stderr.write(line)
+
+    if error:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
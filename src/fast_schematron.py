@@ -0,0 +1,721 @@
+"""
+A fast path for validating XHTML files with a Schematron schema.
+
+lxml's Schematron compiles a schema into XSLT, which evaluates every
+rule's context, with XPath, over the whole document, one pattern at a
+time. Most of the rules in bigbook.sch are simple structural assertions,
+and FastSchematron compiles those into Python functions instead, then
+checks every compiled pattern in one walk of the document's elements,
+finding the rules that apply to each element by its tag.
+
+The XPath that can be compiled is a subset of XPath 1.0: location paths
+on the child, descendant, parent, ancestor, preceding-sibling, following-
+sibling, self and attribute axes, without positional predicates; 'and',
+'or', comparisons; and the functions in FUNCTIONS, which include EXSLT's
+'regexp:test' and 'regexp:match', implemented with Python's regular
+expressions just as lxml implements them. A pattern with a rule that
+uses anything else (variables, abstract rules, messages with
+'sch:value-of', etc.) is left to lxml's Schematron, which then only
+evaluates the patterns that could not be compiled.
+
+As in Schematron, an element is only checked by the first rule in each
+pattern whose context it matches, and failures are reported in pattern
+order, then document order.
+
+With 'strict' set, documents are also validated with lxml's Schematron,
+and any differences between the two are reported as failures.
+"""
+
+__all__ = ['Failure', 'Unsupported', 'FastSchematron', 'FUNCTIONS', 'schematron_failures']
+
+import re
+from copy import deepcopy
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple, TYPE_CHECKING
+
+from lxml.etree import fromstring, QName
+
+# noinspection PyProtectedMember
+from lxml.etree import _Element, _ElementTree
+
+# Schematron is imported when it is first needed,
+# as importing it takes longer than validating a file.
+if TYPE_CHECKING:
+    from lxml.isoschematron import Schematron
+
+SCH = "http://purl.oclc.org/dsdl/schematron"
+SVRL = "http://purl.oclc.org/dsdl/svrl"
+
+
+class Failure(NamedTuple):
+    """A failed assertion, or successful report: the element's line, and the message."""
+    line: int
+    message: str
+
+
+class Unsupported(Exception):
+    """Raised for Schematron or XPath that the fast path can't compile."""
+
+
+# Compiled XPath expressions are functions of the context element that return
+# a list of nodes (elements, or the string values of attributes and text nodes),
+# a string, a float or a bool. Each is compiled with the type it returns.
+Value = object
+Function = Callable[[_Element], Value]
+Expression = Tuple[str, Function]  # ('nodes' | 'string' | 'number' | 'boolean', function)
+
+
+def _string_value(node) -> str:
+    return node if isinstance(node, str) else ''.join(node.itertext())
+
+
+def _to_string(kind: str, value: Value) -> str:
+    if kind == 'nodes':
+        return _string_value(value[0]) if value else ''
+    if kind == 'number':
+        return str(int(value)) if value == int(value) else str(value)
+    if kind == 'boolean':
+        return 'true' if value else 'false'
+    return value
+
+
+def _to_number(kind: str, value: Value) -> float:
+    if kind == 'boolean':
+        return 1.0 if value else 0.0
+    if kind == 'number':
+        return value
+    try:
+        return float(_to_string(kind, value).strip())
+    except ValueError:
+        return float('nan')
+
+
+def _to_boolean(kind: str, value: Value) -> bool:
+    if kind == 'number':
+        return value != 0 and value == value  # NaN is false
+    return bool(value)
+
+
+def _qname(node) -> str:
+    if isinstance(node, str):
+        raise Unsupported("the names of attributes and text nodes")
+    local = QName(node).localname
+    return f"{node.prefix}:{local}" if node.prefix else local
+
+
+_regexps: Dict[Tuple[str, bool], 're.Pattern'] = {}
+
+
+def _regexp(pattern: str, flags: str) -> 're.Pattern':
+    key = (pattern, 'i' in flags)
+    if key not in _regexps:
+        _regexps[key] = re.compile(pattern, re.IGNORECASE if 'i' in flags else 0)
+    return _regexps[key]
+
+
+# Each function takes its arguments as (kind, value) pairs, and returns its type and a
+# function of them. ('name' with no arguments gets the context element as its argument.)
+FUNCTIONS: Dict[str, Tuple[str, Callable]] = {
+    'not': ('boolean', lambda a: not _to_boolean(*a[0])),
+    'true': ('boolean', lambda a: True),
+    'false': ('boolean', lambda a: False),
+    'boolean': ('boolean', lambda a: _to_boolean(*a[0])),
+    'count': ('number', lambda a: float(len(a[0][1]))),
+    'string': ('string', lambda a: _to_string(*a[0])),
+    'number': ('number', lambda a: _to_number(*a[0])),
+    'normalize-space': ('string', lambda a: ' '.join(_to_string(*a[0]).split())),
+    'string-length': ('number', lambda a: float(len(_to_string(*a[0])))),
+    'starts-with': ('boolean', lambda a: _to_string(*a[0]).startswith(_to_string(*a[1]))),
+    'contains': ('boolean', lambda a: _to_string(*a[1]) in _to_string(*a[0])),
+    'name': ('string', lambda a: _qname(a[0][1][0]) if a[0][1] else ''),
+    'local-name': ('string', lambda a: QName(a[0][1][0]).localname if a[0][1] else ''),
+    'regexp:test': ('boolean', lambda a: _regexp(_to_string(*a[1]), _to_string(*a[2]) if len(a) > 2 else '')
+                    .search(_to_string(*a[0])) is not None),
+    'regexp:match': ('boolean', lambda a: _regexp(_to_string(*a[1]), _to_string(*a[2]) if len(a) > 2 else '')
+                     .search(_to_string(*a[0])) is not None),
+}
+"""
+The XPath functions that can be compiled. ('regexp:match' is only
+compiled for its truth, i.e. whether there is a match.)
+"""
+
+_CONTEXT_FUNCTIONS = {'name', 'local-name', 'string', 'normalize-space', 'string-length', 'number'}
+
+_TOKEN = re.compile(r"""\s*(?:
+    (?P<string>"[^"]*"|'[^']*')
+  | (?P<number>[0-9]+(?:\.[0-9]*)?|\.[0-9]+)
+  | (?P<operator>//|/|::|!=|<=|>=|\.\.|[()\[\]@,=<>.*])
+  | (?P<name>[A-Za-z_][\w.-]*(?::(?!:)(?:[A-Za-z_][\w.-]*|\*))?)
+  )""", re.VERBOSE)
+
+_AXES = {'child', 'descendant', 'parent', 'ancestor', 'self', 'attribute',
+         'preceding-sibling', 'following-sibling', 'descendant-or-self', 'ancestor-or-self'}
+
+
+def _tokens(xpath: str) -> List[str]:
+    tokens = []
+    position = 0
+    xpath = xpath.strip()
+    while position < len(xpath):
+        match = _TOKEN.match(xpath, position)
+        if not match or match.end() == position:
+            raise Unsupported(f"can't parse {xpath!r} at {xpath[position:]!r}")
+        tokens.append(match.group().strip())
+        position = match.end()
+    return tokens
+
+
+def _children(node: _Element):
+    return [child for child in node if isinstance(child.tag, str)]
+
+
+def _texts(node: _Element) -> List[str]:
+    texts = [node.text] if node.text is not None else []
+    texts += [child.tail for child in node if child.tail is not None]
+    return texts
+
+
+_AXIS_FUNCTIONS = {
+    'child': _children,
+    'descendant': lambda node: [n for n in node.iterdescendants() if isinstance(n.tag, str)],
+    'descendant-or-self': lambda node: [n for n in node.iter() if isinstance(n.tag, str)],
+    'self': lambda node: [node],
+    'parent': lambda node: [n for n in [node.getparent()] if n is not None],
+    'ancestor': lambda node: list(node.iterancestors())[::-1],
+    'ancestor-or-self': lambda node: list(node.iterancestors())[::-1] + [node],
+    'preceding-sibling': lambda node: [n for n in node.itersiblings(preceding=True)
+                                       if isinstance(n.tag, str)][::-1],
+    'following-sibling': lambda node: [n for n in node.itersiblings() if isinstance(n.tag, str)],
+}
+
+
+class _Compiler:
+    """A recursive descent compiler for a subset of XPath 1.0."""
+
+    def __init__(self, xpath: str, namespaces: Dict[str, str]) -> None:
+        self.xpath = xpath
+        self.namespaces = namespaces
+        self.tokens = _tokens(xpath)
+        self.position = 0
+
+    def peek(self, offset: int = 0) -> Optional[str]:
+        position = self.position + offset
+        return self.tokens[position] if position < len(self.tokens) else None
+
+    def next(self, expected: str = None) -> str:
+        token = self.peek()
+        if token is None or (expected is not None and token != expected):
+            raise Unsupported(f"can't parse {self.xpath!r}: expected {expected or 'more'}")
+        self.position += 1
+        return token
+
+    def expression(self) -> Expression:
+        expression = self.or_expression()
+        if self.peek() is not None:
+            raise Unsupported(f"can't compile {self.xpath!r} at {self.peek()!r}")
+        return expression
+
+    def or_expression(self) -> Expression:
+        operands = [self.and_expression()]
+        while self.peek() == 'or':
+            self.next()
+            operands.append(self.and_expression())
+        if len(operands) == 1:
+            return operands[0]
+        function = _boolean(operands[0])
+        for operand in map(_boolean, operands[1:]):
+            function = (lambda a, b: lambda node: a(node) or b(node))(function, operand)
+        return 'boolean', function
+
+    def and_expression(self) -> Expression:
+        operands = [self.comparison(('=', '!='), self.relation)]
+        while self.peek() == 'and':
+            self.next()
+            operands.append(self.comparison(('=', '!='), self.relation))
+        if len(operands) == 1:
+            return operands[0]
+        function = _boolean(operands[0])
+        for operand in map(_boolean, operands[1:]):
+            function = (lambda a, b: lambda node: a(node) and b(node))(function, operand)
+        return 'boolean', function
+
+    def relation(self) -> Expression:
+        return self.comparison(('<', '<=', '>', '>='), self.primary)
+
+    def comparison(self, operators: Tuple[str, ...], operand: Callable[[], Expression]) -> Expression:
+        left = operand()
+        while self.peek() in operators:
+            operator = self.next()
+            left = _comparison(operator, left, operand())
+        return left
+
+    def primary(self) -> Expression:
+        token = self.peek()
+        if token is None:
+            raise Unsupported(f"can't parse {self.xpath!r}: unexpected end")
+        if token[0] in '"\'':
+            self.next()
+            return 'string', _literal(token[1:-1])
+        if token[0].isdigit() or (token[0] == '.' and token[1:2].isdigit()):
+            self.next()
+            return 'number', lambda node, value=float(token): value
+        if token == '(':
+            self.next()
+            expression = self.or_expression()
+            self.next(')')
+            return expression
+        if (self.peek(1) == '(' and token[0].isalpha()
+                and token not in ('text', 'node', 'comment', 'processing-instruction')):
+            return self.function_call()
+        return self.path()
+
+    def function_call(self) -> Expression:
+        name = self.next()
+        if name not in FUNCTIONS:
+            raise Unsupported(f"the function {name}()")
+        self.next('(')
+        arguments = []
+        while self.peek() != ')':
+            arguments.append(self.or_expression())
+            if self.peek() == ',':
+                self.next()
+        self.next(')')
+        if not arguments and name in _CONTEXT_FUNCTIONS:
+            arguments = [('nodes', lambda node: [node])]
+        if name in ('count', 'name', 'local-name') and any(k != 'nodes' for k, _ in arguments):
+            raise Unsupported(f"{name}() of something that isn't a node set")
+        kind, function = FUNCTIONS[name]
+        return kind, lambda node: function([(k, f(node)) for k, f in arguments])
+
+    def path(self) -> Expression:
+        """A location path, as a function of the context node."""
+        steps = []
+        absolute = self.peek() in ('/', '//')
+        separator = self.next() if absolute else '/'
+        if separator == '/' and absolute and self.peek() is None:
+            raise Unsupported("the document root")
+        while True:
+            # 'a//b' is 'a/descendant::b', as there are no positional predicates.
+            steps.append(self.step(descendant=separator == '//'))
+            if self.peek() not in ('/', '//'):
+                break
+            if steps[-1] is _text_step or getattr(steps[-1], 'attributes', False):
+                raise Unsupported("steps after attributes or text nodes")
+            separator = self.next()
+
+        def evaluate(node: _Element) -> List:
+            nodes = [_DocumentRoot(node.getroottree().getroot())] if absolute else [node]
+            for step in steps:
+                found = []
+                seen = set()
+                for context in nodes:
+                    for result in step(context):
+                        if isinstance(result, str):
+                            found.append(result)
+                        elif id(result) not in seen:
+                            seen.add(id(result))
+                            found.append(result)
+                nodes = found
+            return nodes
+
+        if len(steps) == 1 and not absolute:
+            return 'nodes', steps[0]  # which has no duplicates to remove
+        return 'nodes', evaluate
+
+    def step(self, descendant: bool = False) -> Callable:
+        """A step, or with 'descendant', a step after '//'."""
+        if descendant and (self.peek() in ('.', '..', '@') or self.peek(1) in ('::', '(')):
+            step = self.step()
+            if step is _text_step or getattr(step, 'attributes', False):
+                raise Unsupported("attributes or text nodes after '//'")
+            return lambda node: [n for d in _AXIS_FUNCTIONS['descendant-or-self'](node)
+                                 for n in step(d)]
+        token = self.next()
+        if token == '.':
+            return _AXIS_FUNCTIONS['self']
+        if token == '..':
+            return _AXIS_FUNCTIONS['parent']
+        if token == '@':
+            axis = 'attribute'
+            token = self.next()
+        elif self.peek() == '::':
+            axis = token
+            if axis not in _AXES:
+                raise Unsupported(f"the {axis} axis")
+            self.next('::')
+            token = self.next()
+        else:
+            axis = 'descendant' if descendant else 'child'
+
+        if axis == 'attribute':
+            step = self.attribute_step(token)
+        elif token == 'text' and self.peek() == '(':
+            self.next('(')
+            self.next(')')
+            if axis != 'child':
+                raise Unsupported(f"text() on the {axis} axis")
+            step = _text_step
+        else:
+            if token == 'node' and self.peek() == '(':
+                raise Unsupported("node() tests")
+            test = self.name_test(token)
+            axis_function = _AXIS_FUNCTIONS[axis]
+            step = lambda node: [n for n in axis_function(node) if test(n)]
+
+        predicates = []
+        while self.peek() == '[':
+            self.next()
+            predicates.append(_predicate(self.or_expression()))
+            self.next(']')
+        if not predicates:
+            return step
+        if step is _text_step or axis == 'attribute':
+            raise Unsupported("predicates on attributes or text nodes")
+
+        def filtered(node: _Element) -> List:
+            return [n for n in step(node) if all(p(n) for p in predicates)]
+        return filtered
+
+    def attribute_step(self, token: str) -> Callable:
+        if ':' in token:
+            raise Unsupported("namespaced attributes")
+        if token == '*':
+            def step(node):
+                return [] if isinstance(node, _DocumentRoot) else list(node.attrib.values())
+        else:
+            def step(node):
+                value = node.get(token)
+                return [] if value is None else [value]
+            step.attribute = token
+        step.attributes = True
+        return step
+
+    def name_test(self, token: str) -> Callable[[_Element], bool]:
+        """A test for elements with a name, e.g. 'xhtml:p' or '*'."""
+        if token == '*':
+            return lambda node: True
+        prefix, _, local = token.rpartition(':')
+        if prefix and prefix not in self.namespaces:
+            raise Unsupported(f"the undeclared prefix {prefix}")
+        if local == '*':
+            uri = self.namespaces[prefix]
+            return lambda node: QName(node).namespace == uri
+        tag = f"{{{self.namespaces[prefix]}}}{local}" if prefix else local
+        return lambda node: node.tag == tag
+
+
+class _DocumentRoot:
+    """The root node of a document, whose only child is the root element."""
+
+    def __init__(self, element: _Element) -> None:
+        self.element = element
+
+    def __iter__(self):
+        return iter([self.element])
+
+    def iter(self):
+        return self.element.iter()
+
+    def iterdescendants(self):
+        return self.element.iter()
+
+    def iterancestors(self):
+        return iter([])
+
+    def itersiblings(self, preceding=False):
+        return iter([])
+
+    def get(self, name):
+        return None
+
+    def getparent(self):
+        return None
+
+    tag = None
+    text = None
+
+
+def _text_step(node) -> List[str]:
+    return [] if isinstance(node, _DocumentRoot) else _texts(node)
+
+
+def _literal(value: str) -> Function:
+    def function(node):
+        return value
+    function.literal = value
+    return function
+
+
+def _boolean(expression: Expression) -> Callable[[_Element], bool]:
+    """An expression's truth, as a function of the context node."""
+    kind, function = expression
+    if kind == 'boolean':
+        return function
+    return lambda node: _to_boolean(kind, function(node))
+
+
+def _predicate(expression: Expression) -> Callable[[_Element], bool]:
+    if expression[0] == 'number':
+        raise Unsupported("positional predicates")
+    return _boolean(expression)
+
+
+_COMPARE = {
+    '=': lambda a, b: a == b, '!=': lambda a, b: a != b,
+    '<': lambda a, b: a < b, '<=': lambda a, b: a <= b,
+    '>': lambda a, b: a > b, '>=': lambda a, b: a >= b,
+}
+
+
+def _comparison(operator: str, left: Expression, right: Expression) -> Expression:
+    """An XPath 1.0 comparison, with its rules for comparing node sets."""
+    compare = _COMPARE[operator]
+    equality = operator in ('=', '!=')
+    (left_kind, left_function), (right_kind, right_function) = left, right
+
+    def convert(kind: str, value: Value, other_kind: str):
+        if equality and 'boolean' in (kind, other_kind):
+            return _to_boolean(kind, value)
+        if equality and 'number' not in (kind, other_kind):
+            return _to_string(kind, value)
+        return _to_number(kind, value)
+
+    def values(kind: str, value: Value, other_kind: str) -> List:
+        if kind == 'nodes' and other_kind != 'boolean':
+            return [convert('string', _string_value(n), other_kind) for n in value]
+        return [convert(kind, value, other_kind)]
+
+    def function(node: _Element) -> bool:
+        a = values(left_kind, left_function(node), right_kind)
+        b = values(right_kind, right_function(node), left_kind)
+        return any(compare(x, y) for x in a for y in b)
+
+    if left_kind == right_kind == 'nodes':
+        raise Unsupported("comparisons of two node sets")
+
+    # Attributes compared with strings, e.g. "@class = 'verse'", are the commonest.
+    for a, b in ((left_function, right_function), (right_function, left_function)):
+        name, literal = getattr(a, 'attribute', None), getattr(b, 'literal', None)
+        if name and literal is not None and equality:
+            if operator == '=':
+                return 'boolean', lambda node: node.get(name) == literal
+
+            def differs(node: _Element) -> bool:
+                value = node.get(name)
+                return value is not None and value != literal
+            return 'boolean', differs
+    return 'boolean', function
+
+
+class _Pattern(NamedTuple):
+    """A compiled Schematron pattern: its rules' contexts, and their assertions."""
+    rules: List[Tuple[Optional[str], Callable[[_Element], bool],
+                      List[Tuple[bool, Function, str]]]]  # tag, context, (report, test, message)
+
+
+def _compile_context(xpath: str, namespaces: Dict[str, str]) -> Tuple[Optional[str], Callable]:
+    """
+    Compile a rule's context, an XSLT pattern, into a test of elements.
+    :return: the tag that matching elements must have, if there is one,
+             and the test, which assumes that elements have that tag
+    """
+    compiler = _Compiler(xpath, namespaces)
+    steps = []  # (separator, name, test of the name and predicates)
+    separator = compiler.next() if compiler.peek() in ('/', '//') else '//'
+    while True:
+        name = compiler.next()
+        if name in ('.', '..', '@') or compiler.peek() in ('::', '('):
+            raise Unsupported(f"the context {xpath!r}")
+        tests = [compiler.name_test(name)]
+        while compiler.peek() == '[':
+            compiler.next()
+            tests.append(_predicate(compiler.or_expression()))
+            compiler.next(']')
+        steps.append((separator, name, tests))
+        if compiler.peek() is None:
+            break
+        separator = compiler.next()
+        if separator not in ('/', '//'):
+            raise Unsupported(f"the context {xpath!r}")
+
+    name = steps[-1][1]
+    tag = None
+    if name != '*' and not name.endswith(':*'):
+        prefix, _, local = name.rpartition(':')
+        tag = f"{{{namespaces[prefix]}}}{local}" if prefix else local
+        del steps[-1][2][0]  # rules are only tried on elements with the tag
+
+    def matches(node: _Element, i: int) -> bool:
+        separator, _, tests = steps[i]
+        if not all(test(node) for test in tests):
+            return False
+        if i == 0:
+            return separator == '//' or node.getparent() is None
+        if separator == '/':
+            parent = node.getparent()
+            return parent is not None and matches(parent, i - 1)
+        return any(matches(ancestor, i - 1) for ancestor in node.iterancestors())
+
+    if len(steps) == 1 and steps[0][0] == '//':
+        tests = steps[0][2]
+        if not tests:
+            return tag, lambda node: True
+        if len(tests) == 1:
+            return tag, tests[0]
+    return tag, lambda node: matches(node, len(steps) - 1)
+
+
+def _compile_pattern(pattern: _Element, namespaces: Dict[str, str]) -> _Pattern:
+    if pattern.get('abstract') == 'true' or pattern.get('is-a'):
+        raise Unsupported("abstract patterns")
+    rules = []
+    for child in pattern:
+        if not isinstance(child.tag, str) or child.tag in (f"{{{SCH}}}title", f"{{{SCH}}}p"):
+            continue
+        if child.tag != f"{{{SCH}}}rule" or child.get('abstract') == 'true':
+            raise Unsupported(f"'{QName(child).localname}' in patterns")
+        tag, context = _compile_context(child.get('context'), namespaces)
+        assertions = []
+        for test in child:
+            if not isinstance(test.tag, str):
+                continue
+            if test.tag not in (f"{{{SCH}}}assert", f"{{{SCH}}}report") or len(test):
+                raise Unsupported(f"'{QName(test).localname}' in rules")
+            assertions.append((test.tag == f"{{{SCH}}}report",
+                               _boolean(_Compiler(test.get('test'), namespaces).expression()),
+                               ' '.join((test.text or '').split())))
+        rules.append((tag, context, assertions))
+    return _Pattern(rules)
+
+
+class FastSchematron:
+    """
+    A Schematron schema, validated with compiled Python where it can be,
+    and with lxml's Schematron where it can't.
+
+    :ivar patterns: the compiled patterns
+    :ivar fallback: a Schematron of the patterns that could not be
+                    compiled, or None if there are none
+    :ivar unsupported: the IDs (or numbers) of the patterns that could not
+                       be compiled, and why
+    :ivar strict: True to also validate documents with lxml's Schematron,
+                  and report any differences
+    """
+    patterns: List[_Pattern]
+    fallback: Optional['Schematron']
+    unsupported: List[str]
+    strict: bool
+
+    def __init__(self, schema: _ElementTree, strict: bool = False) -> None:
+        self.schema = schema
+        self.strict = strict
+        self.patterns = []
+        self.unsupported = []
+        self._full = None
+        self._rules: Dict[str, List[Tuple[int, list]]] = {}  # by tag
+
+        root = schema.getroot()
+        namespaces = {ns.get('prefix'): ns.get('uri') for ns in root.iterfind(f"{{{SCH}}}ns")}
+        residual = deepcopy(root)
+        residual_patterns = residual.findall(f"{{{SCH}}}pattern")
+        whole_schema = [QName(e).localname for e in root
+                        if e.tag in (f"{{{SCH}}}include", f"{{{SCH}}}let", f"{{{SCH}}}phase")]
+        if root.tag != f"{{{SCH}}}schema":
+            self.unsupported.append("the schema isn't an ISO Schematron schema")
+        for n, (pattern, copy) in enumerate(zip(root.iterfind(f"{{{SCH}}}pattern"), residual_patterns)):
+            try:
+                if whole_schema:
+                    raise Unsupported(f"'{whole_schema[0]}' in schemas")
+                self.patterns.append(_compile_pattern(pattern, namespaces))
+                residual.remove(copy)
+            except Unsupported as e:
+                self.unsupported.append(f"{pattern.get('id') or n + 1}: {e}")
+
+        self.fallback = None
+        if self.unsupported:
+            from lxml.isoschematron import Schematron
+            self.fallback = Schematron(residual, store_report=True)
+
+    def validate(self, root: _Element) -> List[Failure]:
+        """
+        Validate a document.
+
+        :param root: the document's root element
+        :return: its failures, none if it is valid
+        """
+        failures = self._native(root)
+        if self.fallback is not None and not self.fallback.validate(root):
+            failures += schematron_failures(root, self.fallback)
+        if self.strict:
+            failures = self._cross_check(root, failures)
+        return failures
+
+    def _native(self, root: _Element) -> List[Failure]:
+        found = []  # (pattern, element, assertion, failure)
+        for order, element in enumerate(root.iter()):
+            tag = element.tag
+            if not isinstance(tag, str):
+                continue
+            patterns = self._rules.get(tag)
+            if patterns is None:
+                patterns = self._rules[tag] = self._rules_for(tag)
+            for p, rules in patterns:
+                for context, assertions in rules:
+                    if context(element):
+                        for a, (report, test, message) in enumerate(assertions):
+                            if test(element) == report:
+                                found.append((p, order, a, Failure(element.sourceline, message)))
+                        break
+        return [failure for *_, failure in sorted(found, key=lambda f: f[:3])]
+
+    def _rules_for(self, tag: str) -> List[Tuple[int, list]]:
+        """The patterns with rules that might match elements with a tag, and those rules."""
+        patterns = []
+        for p, pattern in enumerate(self.patterns):
+            rules = [(context, assertions) for rule_tag, context, assertions in pattern.rules
+                     if rule_tag in (None, tag)]
+            if rules:
+                patterns.append((p, rules))
+        return patterns
+
+    def _cross_check(self, root: _Element, failures: List[Failure]) -> List[Failure]:
+        """The full Schematron's failures, and any differences from the fast path's."""
+        if self._full is None:
+            from lxml.isoschematron import Schematron
+            self._full = Schematron(self.schema, store_report=True)
+        full = [] if self._full.validate(root) else schematron_failures(root, self._full)
+        missed = _subtract(full, failures)
+        extra = _subtract(failures, full)
+        return (full
+                + [Failure(line, f"the fast Schematron missed: {message}") for line, message in missed]
+                + [Failure(line, f"the fast Schematron wrongly reported: {message}")
+                   for line, message in extra])
+
+
+def _subtract(a: List[Failure], b: List[Failure]) -> List[Failure]:
+    """The failures in 'a' that aren't in 'b', counting duplicates."""
+    remaining = list(b)
+    result = []
+    for failure in a:
+        if failure in remaining:
+            remaining.remove(failure)
+        else:
+            result.append(failure)
+    return result
+
+
+def schematron_failures(root: _Element, schematron: 'Schematron') -> List[Failure]:
+    """The failures in the error log of an lxml Schematron that has validated a document."""
+    failures = []
+    for e in schematron.error_log:
+
+        # The message is a XML string containing an 'srvl:failed-assert' element
+        xml = fromstring(e.message)
+
+        # Schematron reports the location of a faulty element with an Xpath selector.
+        location_xpath = xml.xpath('//svrl:*/@location', namespaces={'svrl': SVRL})[0]
+        line = root.xpath(location_xpath)[0].sourceline
+
+        message = xml.xpath('normalize-space(//svrl:text)', namespaces={'svrl': SVRL})
+        failures.append(Failure(line, message))
+    return failures
+
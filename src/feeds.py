@@ -0,0 +1,220 @@
+"""
+Sitemaps and Atom feeds for the website.
+
+'sitemap.xml' lists every page, split into several sitemaps and a
+sitemap index when there are more pages than one sitemap may hold.
+The Atom feeds are 'Feeds/recent.atom', for recently added articles,
+and one per blog era, e.g. 'Feeds/blog-2.atom'.
+
+Everything is written with lxml's incremental 'xmlfile' writer, one
+entry at a time, so no whole document is built in memory.
+
+An article's last modification date is the date that its file's hash
+last changed, so the dates of unchanged articles are stable from one
+build to the next. These dates are kept in the website's '.lastmod.json'
+file. (Files starting with '.' are not published by GitHub Pages.)
+
+Everything is written to a website sink, see 'sinks.py'.
+"""
+
+__all__ = ['ArticleDates', 'write_sitemaps', 'write_feeds']
+
+import json
+from datetime import date, datetime
+from hashlib import sha1
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Set, Tuple
+
+from lxml.etree import Element, SubElement, xmlfile
+
+from index import Index, Article
+from sinks import Sink
+from settings import WEBSITE_URL
+
+SITEMAP_NS = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+ATOM_NS = 'http://www.w3.org/2005/Atom'
+
+MAX_SITEMAP_URLS = 50000
+"""The sitemap protocol's limit on URLs per sitemap."""
+
+RECENT_ARTICLES = 50
+"""The number of articles in the recent additions feed."""
+
+BLOG_TITLES = (
+    'The Hooting Yard Web Page, 1992–2002',
+    'The Hooting Yard Blog, 2003–2006',
+    'Hooting Yard, a Website By Frank Key, 2007–2019',
+)
+
+
+class ArticleDates:
+    """
+    When each article was added to the website, and when it last changed.
+    Dates are ISO format strings.
+
+    :ivar entries: article ID to hash, date added and date last modified
+    """
+    entries: Dict[str, Dict[str, str]]
+
+    PATH = '.lastmod.json'
+    """Where the dates are kept in the website."""
+
+    def __init__(self, website_dir: Path) -> None:
+        """
+        :param website_dir: the website directory of the previous build, if there is one
+        """
+        file = website_dir / self.PATH
+        self.entries = json.loads(file.read_text()) if file.exists() else {}
+
+    def update(self, index: Index, today: date = None) -> Set[str]:
+        """
+        Note new and changed articles, and forget deleted ones.
+
+        :return: the IDs of the new articles and of those whose files have changed
+        """
+        today = (today or date.today()).isoformat()
+        entries = {}
+        changed = set()
+        for article in index.articles():
+            digest = sha1(article.file.read_bytes()).hexdigest()
+            entry = self.entries.get(article.id, {'added': today})
+            if entry.get('hash') != digest:
+                entry = dict(entry, hash=digest, lastmod=today)
+                changed.add(article.id)
+            entries[article.id] = entry
+        self.entries = entries
+        return changed
+
+    def save(self, sink: Sink) -> None:
+        sink.write_text(self.PATH, json.dumps(self.entries, indent=1, sort_keys=True))
+
+    def lastmod(self, article: Article) -> str:
+        return self.entries[article.id]['lastmod']
+
+    def added(self, article: Article) -> str:
+        return self.entries[article.id]['added']
+
+
+def _page_url(path: str) -> str:
+    return f"{WEBSITE_URL}/{path}"
+
+
+def _article_url(article: Article) -> str:
+    return _page_url(f"Text/{article.id}.html")
+
+
+def _sitemap_urls(index: Index, dates: ArticleDates,
+                  index_pages: Iterable[str]) -> Iterator[Tuple[str, str]]:
+    """URLs and last modification dates (or '') for every page."""
+    newest = max((dates.lastmod(a) for a in index.articles()), default='')
+    yield _page_url('index.html'), newest
+    for page in index_pages:
+        yield _page_url(page), newest
+    for article in index.articles():
+        yield _article_url(article), dates.lastmod(article)
+
+
+def _write_sitemap(sink: Sink, path: str, urls: List[Tuple[str, str]]) -> None:
+    with sink.open(path) as f, xmlfile(f, encoding='utf-8') as xf:
+        xf.write_declaration()
+        with xf.element('urlset', nsmap={None: SITEMAP_NS}):
+            for loc, lastmod in urls:
+                url = Element('url')
+                SubElement(url, 'loc').text = loc
+                if lastmod:
+                    SubElement(url, 'lastmod').text = lastmod
+                xf.write(url)
+
+
+def write_sitemaps(sink: Sink, index: Index, dates: ArticleDates,
+                   index_pages: Iterable[str]) -> None:
+    """
+    Write 'sitemap.xml'. If there are more than MAX_SITEMAP_URLS pages,
+    it is a sitemap index for 'sitemap-1.xml', 'sitemap-2.xml', etc.
+
+    :param sink: the website
+    :param index: the Index
+    :param dates: article modification dates
+    :param index_pages: paths of the index pages, relative to the website
+    """
+    chunk = []
+    chunks = []  # (file name, newest date) for each sitemap file
+    for url in _sitemap_urls(index, dates, index_pages):
+        chunk.append(url)
+        if len(chunk) == MAX_SITEMAP_URLS:
+            chunks.append(_flush_sitemap(sink, len(chunks) + 1, chunk))
+            chunk = []
+    if not chunks:
+        _write_sitemap(sink, 'sitemap.xml', chunk)
+        return
+    if chunk:
+        chunks.append(_flush_sitemap(sink, len(chunks) + 1, chunk))
+
+    with sink.open('sitemap.xml') as f, xmlfile(f, encoding='utf-8') as xf:
+        xf.write_declaration()
+        with xf.element('sitemapindex', nsmap={None: SITEMAP_NS}):
+            for name, lastmod in chunks:
+                sitemap = Element('sitemap')
+                SubElement(sitemap, 'loc').text = _page_url(name)
+                SubElement(sitemap, 'lastmod').text = lastmod
+                xf.write(sitemap)
+
+
+def _flush_sitemap(sink: Sink, number: int,
+                   urls: List[Tuple[str, str]]) -> Tuple[str, str]:
+    name = f'sitemap-{number}.xml'
+    _write_sitemap(sink, name, urls)
+    return name, max(lastmod for _, lastmod in urls)
+
+
+def _write_feed(sink: Sink, name: str, title: str,
+                articles: List[Article], dates: ArticleDates) -> None:
+    updated = max((dates.lastmod(a) for a in articles), default=date.today().isoformat())
+    with sink.open(f'Feeds/{name}') as f, xmlfile(f, encoding='utf-8') as xf:
+        xf.write_declaration()
+        with xf.element('feed', nsmap={None: ATOM_NS}):
+            header = [('id', _page_url(f'Feeds/{name}')),
+                      ('title', title),
+                      ('updated', updated + 'T00:00:00Z')]
+            for tag, text in header:
+                e = Element(tag)
+                e.text = text
+                xf.write(e)
+            xf.write(Element('link', href=_page_url(f'Feeds/{name}'), rel='self'))
+            xf.write(Element('link', href=_page_url('index.html')))
+            author = Element('author')
+            SubElement(author, 'name').text = 'Frank Key'
+            xf.write(author)
+            for article in articles:
+                xf.write(_feed_entry(article, dates))
+
+
+def _feed_entry(article: Article, dates: ArticleDates) -> Element:
+    entry = Element('entry')
+    SubElement(entry, 'id').text = _article_url(article)
+    SubElement(entry, 'title').text = article.title
+    SubElement(entry, 'link', href=_article_url(article))
+    SubElement(entry, 'published').text = article.date.strftime('%Y-%m-%dT00:00:00Z')
+    SubElement(entry, 'updated').text = dates.lastmod(article) + 'T00:00:00Z'
+    return entry
+
+
+def write_feeds(sink: Sink, index: Index, dates: ArticleDates) -> None:
+    """
+    Write the Atom feeds into the website's 'Feeds' directory.
+
+    :param sink: the website
+    :param index: the Index
+    :param dates: article modification dates
+    """
+    def newest_first(article: Article) -> Tuple[str, datetime]:
+        return dates.added(article), article.date
+
+    recent = sorted(index.articles(), key=newest_first, reverse=True)[:RECENT_ARTICLES]
+    _write_feed(sink, 'recent.atom',
+                'Hooting Yard: recent additions', recent, dates)
+
+    for blog, title in enumerate(BLOG_TITLES):
+        articles = sorted(index.articles(blog), key=lambda a: a.date, reverse=True)
+        name = f'blog-{blog}.atom'
+        _write_feed(sink, name, title, articles, dates)
@@ -14,11 +14,12 @@ def parse_xhtml_file(file: Path) -> HtmlElement:
     Parse an XHTML file into plain HTML,
     i.e. a tree of HTMLElements without namespace annotations.
 
-    :param file: XHTML file
+    :param file: XHTML file, a Path or a GitPath (see git_tree.py)
     :return: the 'html' element
     """
     # The HTMLParser seems to do what I want okay...
-    return parse(str(file), parser=HTMLParser()).getroot()
+    with file.open('rb') as f:
+        return parse(f, parser=HTMLParser()).getroot()
 
 
 def read_html_content(file: Path, heading: bool = False) -> str:
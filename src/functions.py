@@ -4,13 +4,12 @@ Handy miscellaneous functions.
 
 __all__ = [
     'sift',
-    'dictionary_order_sorting_key'
+    'dictionary_order_sorting_key',
+    'parse_size',
 ]
 
 import re
 from typing import List, TypeVar, Tuple, Callable, Iterable
-from num2words import num2words
-from unidecode import unidecode
 
 A = TypeVar('A')
 
@@ -45,6 +44,10 @@ def dictionary_order_sorting_key(title: str) -> str:
     :param title: an article title
     :return: a key string representing the correct dictionary position
     """
+    # These are slow to import, and only needed when titles are sorted.
+    from num2words import num2words
+    from unidecode import unidecode
+
     s = unidecode(title.casefold())
     s = s.replace("&", "and")
     s = re.sub(r"\W+", " ", s).strip()
@@ -59,3 +62,17 @@ def dictionary_order_sorting_key(title: str) -> str:
         s = num2words(int(digits)) + rest
         s = re.sub(r"\W+", " ", s)
     return s.replace(' ', '')
+
+
+def parse_size(size: str) -> int:
+    """
+    A size in bytes, from a command line argument.
+
+    >>> parse_size('250K'), parse_size('2.5M'), parse_size('1000')
+    (256000, 2621440, 1000)
+    """
+    match = re.fullmatch(r'([0-9.]+)\s*([KMG]?)B?', size.strip().upper())
+    if not match:
+        raise ValueError(f"not a size: {size}")
+    number, unit = match.groups()
+    return int(float(number) * 1024 ** ' KMG'.index(unit or ' '))
@@ -0,0 +1,235 @@
+"""
+Read the files of a revision of a git repository, without checking it out.
+
+A GitTree lists a revision's files with one 'git ls-tree' command, and
+reads them from git's object database through one long-lived
+'git cat-file --batch' process, rather than starting a process for each
+file. Its paths, GitPaths, have the parts of pathlib.Path's interface
+that the tools use to read the Big Book and the show index:
+
+    with GitTree(BIGBOOK_DIR, 'v1.2') as tree:
+        index = Index(tree.path(BIGBOOK_DIR), tree.path(SHOW_INDEX_FILE))
+
+so the website, an Index diff or the books can be built from any
+revision, as fast as from the working tree, and with no copy on disk.
+Code that reads files should use 'read_bytes', 'read_text' or 'open',
+not 'str(path)', for a GitPath's string is a description, such as
+'v1.2:bigbook/Text/toc.xhtml', and not a file's name.
+"""
+
+__all__ = ['GitTree', 'GitPath', 'GitStat', 'at_revision']
+
+import fnmatch
+import posixpath
+import subprocess
+from contextlib import ExitStack
+from io import BytesIO, TextIOWrapper
+from pathlib import Path, PurePosixPath
+from typing import Dict, IO, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+
+class GitStat(NamedTuple):
+    """
+    The parts of 'os.stat_result' that the tools use. There are no
+    modification times in git, so 'st_mtime_ns' is made from the file's
+    object ID, so that caches keyed by size and modification time (see
+    image_sizes.py) still notice changed contents.
+    """
+    st_size: int
+    st_mtime_ns: int
+
+
+class GitTree:
+    """
+    The files of a revision of a git repository.
+
+    :ivar repo_dir: the repository's top directory
+    :ivar revision: the revision, as given, e.g. 'v1.2' or 'HEAD~3'
+    :ivar commit: the revision's commit ID
+    """
+    repo_dir: Path
+    revision: str
+    commit: str
+    _blobs: Dict[str, Tuple[str, int]]  # path to object ID and size
+    _directories: Dict[str, List[str]]  # path to the names of the entries in it
+
+    def __init__(self, directory: Path, revision: str) -> None:
+        """
+        :param directory: the repository's directory, or any directory in it
+        :param revision: the revision
+        """
+        self.revision = revision
+        try:
+            self.repo_dir = Path(self._git(directory, 'rev-parse', '--show-toplevel').strip())
+            self.commit = self._git(self.repo_dir, 'rev-parse', '--quiet', '--verify',
+                                    f'{revision}^{{commit}}').strip()
+        except subprocess.CalledProcessError:
+            raise ValueError(f"{directory}: no git revision {revision}") from None
+        self._blobs = {}
+        self._directories = {'': []}
+        listing = self._git(self.repo_dir, 'ls-tree', '-r', '-l', '-z', '--full-tree', self.commit)
+        for entry in listing.split('\0'):
+            if not entry:
+                continue
+            info, path = entry.split('\t', 1)
+            mode, kind, object_id, size = info.split()
+            if kind == 'blob':
+                self._blobs[path] = (object_id, int(size))
+                self._add_to_directory(path)
+        self._process: Optional[subprocess.Popen] = None
+
+    @staticmethod
+    def _git(directory: Path, *args: str) -> str:
+        return subprocess.run(['git', '-C', str(directory), *args], stdout=subprocess.PIPE,
+                              check=True).stdout.decode('utf-8')
+
+    def _add_to_directory(self, path: str) -> None:
+        parent, name = posixpath.split(path)
+        if parent not in self._directories:
+            self._directories[parent] = []
+            self._add_to_directory(parent)
+        self._directories[parent].append(name)
+
+    def path(self, file: Path) -> 'GitPath':
+        """The GitPath of a file or directory, given its path in the working tree."""
+        relative = file.resolve().relative_to(self.repo_dir.resolve()).as_posix()
+        return GitPath(self, '' if relative == '.' else relative)
+
+    def read(self, path: str) -> bytes:
+        """A file's contents, by its path from the top of the repository."""
+        if path not in self._blobs:
+            raise FileNotFoundError(f"{self.revision}:{path}")
+        if self._process is None:
+            self._process = subprocess.Popen(
+                ['git', '-C', str(self.repo_dir), 'cat-file', '--batch'],
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        object_id, size = self._blobs[path]
+        self._process.stdin.write(object_id.encode('ascii') + b'\n')
+        self._process.stdin.flush()
+        header = self._process.stdout.readline().split()
+        if len(header) != 3 or header[1] != b'blob':
+            raise OSError(f"{self.revision}:{path}: git cat-file: {b' '.join(header).decode()}")
+        data = self._process.stdout.read(int(header[2]))
+        self._process.stdout.read(1)  # the newline after the contents
+        return data
+
+    def close(self) -> None:
+        """
+        Stop the 'git cat-file' process, if it was started.
+        It is started again if more files are read.
+        """
+        if self._process:
+            self._process.stdin.close()
+            self._process.wait()
+            self._process.stdout.close()
+            self._process = None
+
+    def __enter__(self) -> 'GitTree':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class GitPath:
+    """
+    A file or directory in a GitTree, which can be read like a pathlib.Path.
+
+    :ivar tree: the tree
+    :ivar path: the path from the top of the repository, '' for the top
+    """
+    tree: GitTree
+    path: str
+
+    def __init__(self, tree: GitTree, path: str) -> None:
+        self.tree = tree
+        self.path = path
+
+    def __truediv__(self, other: str) -> 'GitPath':
+        path = posixpath.normpath(posixpath.join(self.path, str(other)))
+        return GitPath(self.tree, '' if path == '.' else path)
+
+    def __str__(self) -> str:
+        return f"{self.tree.revision}:{self.path}"
+
+    def __repr__(self) -> str:
+        return f"GitPath({str(self)!r})"
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, GitPath) and (self.tree, self.path) == (other.tree, other.path)
+
+    def __hash__(self) -> int:
+        return hash((id(self.tree), self.path))
+
+    def __lt__(self, other: 'GitPath') -> bool:
+        return self.path < other.path
+
+    @property
+    def name(self) -> str:
+        return PurePosixPath(self.path).name
+
+    @property
+    def stem(self) -> str:
+        return PurePosixPath(self.path).stem
+
+    @property
+    def suffix(self) -> str:
+        return PurePosixPath(self.path).suffix
+
+    @property
+    def parent(self) -> 'GitPath':
+        return self / '..'
+
+    def exists(self) -> bool:
+        return self.is_file() or self.is_dir()
+
+    def is_file(self) -> bool:
+        return self.path in self.tree._blobs
+
+    def is_dir(self) -> bool:
+        return self.path in self.tree._directories
+
+    def stat(self) -> GitStat:
+        if self.path not in self.tree._blobs:
+            raise FileNotFoundError(str(self))
+        object_id, size = self.tree._blobs[self.path]
+        return GitStat(size, int(object_id[:15], 16))
+
+    def glob(self, pattern: str) -> Iterator['GitPath']:
+        """The entries in this directory whose names match a pattern, e.g. '*.xhtml'."""
+        if '/' in pattern or '**' in pattern:
+            raise ValueError(f"only patterns of the entries' names are supported: {pattern}")
+        for name in sorted(self.tree._directories.get(self.path, [])):
+            if fnmatch.fnmatchcase(name, pattern):
+                yield self / name
+
+    def read_bytes(self) -> bytes:
+        return self.tree.read(self.path)
+
+    def read_text(self, encoding: str = 'utf-8') -> str:
+        return self.read_bytes().decode(encoding)
+
+    def open(self, mode: str = 'r', encoding: str = 'utf-8') -> IO:
+        """The file's contents as a binary ('rb') or text ('r') file object."""
+        if mode not in ('r', 'rb'):
+            raise ValueError(f"{self} can only be read")
+        data = BytesIO(self.read_bytes())
+        return data if mode == 'rb' else TextIOWrapper(data, encoding=encoding)
+
+
+def at_revision(file: Path, revision: Optional[str], stack: ExitStack) -> Union[Path, GitPath]:
+    """
+    A file or directory in the working tree, or as it is at a git revision, if one is given.
+
+    :param file: the file or directory
+    :param revision: the revision, or None for the working tree
+    :param stack: where to close the GitTree when done with it
+    :raise SystemExit: if there is no such revision, for the tools' command lines
+    """
+    if not revision:
+        return file
+    try:
+        tree = GitTree(file if file.is_dir() else file.parent, revision)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    return stack.enter_context(tree).path(file)
@@ -0,0 +1,84 @@
+"""
+The dimensions of the Big Book's images, for 'width' and 'height'
+attributes that stop pages from shifting about as images load.
+
+Dimensions are read from the images' headers, as Pillow opens files
+lazily and doesn't decode the pixels until asked to. They are kept in
+a cache (see cache.py) by the hash of each image, and the hashes by each file's
+path, size and modification time, so an unchanged image is not read
+again, and a renamed one isn't measured again.
+"""
+
+__all__ = ['ImageSizes']
+
+import json
+from hashlib import sha1
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+from cache import Store
+
+
+class ImageSizes:
+    """
+    A persistent index of image dimensions.
+
+    :ivar store: the store that the index is kept in, as JSON
+    """
+    store: Store
+    _sizes: Dict[str, List[int]]  # hash to width and height
+    _files: Dict[str, List]  # path to modification time, size and hash
+    _used: Set[str]  # the paths asked about
+    _keep: bool  # whether to keep the paths not asked about
+    _KEY = 'image-sizes.json'
+
+    def __init__(self, store: Store) -> None:
+        self.store = store
+        data = json.loads(store.get(self._KEY) or b'{}')
+        self._sizes = data.get('sizes', {})
+        self._files = data.get('files', {})
+        self._used = set()
+        self._keep = False
+
+    def size(self, image: Path) -> Optional[Tuple[int, int]]:
+        """An image's width and height, or None if it is missing or isn't an image."""
+        try:
+            stat = image.stat()
+        except OSError:
+            return None
+        key = str(image)
+        self._used.add(key)
+        entry = self._files.get(key)
+        if not entry or entry[:2] != [stat.st_mtime_ns, stat.st_size]:
+            digest = sha1(image.read_bytes()).hexdigest()
+            self._files[key] = entry = [stat.st_mtime_ns, stat.st_size, digest]
+        digest = entry[2]
+        if digest not in self._sizes:
+            self._sizes[digest] = _read_size(image)
+        size = self._sizes[digest]
+        return tuple(size) if size else None
+
+    def keep(self) -> None:
+        """Remember every image when saving, as when only some pages are rendered."""
+        self._keep = True
+
+    def save(self) -> None:
+        """
+        Save the index, forgetting images that were not asked about since it
+        was loaded, unless told to keep them.
+        """
+        files = {key: entry for key, entry in self._files.items()
+                 if key in self._used or self._keep}
+        hashes = {entry[2] for entry in files.values()}
+        sizes = {digest: size for digest, size in self._sizes.items() if digest in hashes}
+        self.store.put(self._KEY, json.dumps({'sizes': sizes, 'files': files},
+                                             indent=1, sort_keys=True).encode('utf-8'))
+
+
+def _read_size(image: Path) -> Optional[List[int]]:
+    from PIL import Image, UnidentifiedImageError  # slow to import
+    try:
+        with image.open('rb') as f, Image.open(f) as im:
+            return list(im.size)
+    except (UnidentifiedImageError, OSError):
+        return None
@@ -4,12 +4,12 @@ This data comes from the 'bigbook/Text/toc.xhtml' file in the HootingYard 'keyml
 repository and the 'export.yaml' file in the 'archive_management' repository.
 """
 
-__all__ = ['Narration', 'Article', 'Show', 'Index']
+__all__ = ['Narration', 'Article', 'Show', 'Index', 'blog_of']
 
 import re
 from dataclasses import dataclass
 from itertools import groupby
-from typing import Dict, List, Any, Tuple, Iterator, Set
+from typing import Dict, List, Any, Tuple, Iterator, Set, Optional
 from pathlib import Path
 from datetime import datetime
 
@@ -20,6 +20,19 @@ from functions import (dictionary_order_sorting_key, sift)
 from files import parse_xhtml_file, read_html_content
 
 
+def blog_of(date: datetime) -> int:
+    """
+    Which version Frank Key's blog was current on a date.
+    Version 0 is the old Hooting Yard Home Page.
+    """
+    if date > datetime(2006, 12, 31):
+        return 2
+    elif datetime(2003, 1, 1) < date <= datetime(2006, 12, 31):
+        return 1
+    else:
+        return 0
+
+
 class Article:
     """
     An story, quotation, book chapter or blog post from one of Frank's previous websites.
@@ -64,12 +77,7 @@ class Article:
         Which version Frank Key's blog this article came from.
         Version 0 is the old Hooting Yard Home Page.
         """
-        if self.date > datetime(2006, 12, 31):
-            return 2
-        elif datetime(2003, 1, 1) < self.date <= datetime(2006, 12, 31):
-            return 1
-        else:
-            return 0
+        return blog_of(self.date)
 
     @property
     def first_letter(self) -> str:
@@ -90,12 +98,20 @@ class Narration:
                      (in seconds from the start of the show)
     :ivar end_time: roughly when the narration ends (i.e. when the next one starts)
     :ivar word_count: the number of words spoken (?)
+    :ivar byte_range: the narration's inclusive byte range in the show's MP3 file,
+                     if the show has a seek index (see 'mp3index.py')
     """
     article: Article
     show: 'Show'
     start_time: int
     end_time: int
     word_count: int
+    byte_range: Optional[Tuple[int, int]] = None
+
+    @property
+    def mp3_url(self) -> str:
+        """The show's MP3 URL with a media fragment that selects the narration."""
+        return f"{self.show.mp3_url}#t={self.start_time},{self.end_time}"
 
     def __lt__(self, other) -> bool:  # sorts by show date and start time
         if self.show.date == other.show.date:
@@ -0,0 +1,291 @@
+"""
+Compare two states of the Index, i.e. of the Big Book's toc.xhtml and
+archive_management's export.yaml, for changelogs and incremental builds.
+
+An Index's state is kept as a snapshot, a JSON-compatible dictionary of
+what the website's pages show of it: each article's formatted title,
+in table of contents order, each show's details, and each article's
+narrations. make_website.py keeps the last build's snapshot in the
+website's '.index.json' file, and compares it with the current Index
+to render only the pages that have changed.
+
+    uber diff                   what has changed since the website was built
+    uber diff v1.2              ... since a git revision of the Big Book
+    uber diff v1.2:abc123 v1.3  ... between revisions of the Big Book and
+                                (after the ':') of archive_management
+
+The report is a changelog of added, removed and retitled articles, new
+and removed shows, and narrations that have been added, removed or
+moved, or with '--json', the changes and the pages that they affect.
+"""
+
+__all__ = [
+    'SNAPSHOT_PATH',
+    'snapshot',
+    'read_snapshot',
+    'index_at',
+    'NarrationChange',
+    'IndexDiff',
+]
+
+import json
+from argparse import ArgumentParser
+from contextlib import ExitStack
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Set
+
+from dates import minute_second
+from git_tree import at_revision
+from index import Index, blog_of
+
+SNAPSHOT_PATH = '.index.json'
+"""Where the last build's snapshot is kept in the website."""
+
+
+def snapshot(index: Index) -> Dict:
+    """An Index's snapshot."""
+    return {
+        'articles': {article.id: {'title': article.title, 'link': article.link}
+                     for article in index.articles()},
+        'shows': {show.id: {'title': show.title,
+                            'date': show.date.isoformat(),
+                            'duration': show.duration,
+                            'internet_archive_url': show.internet_archive_url}
+                  for show in index.shows_by_id.values()},
+        'narrations': {article.id: [[narration.show.id, narration.start_time,
+                                     narration.end_time, narration.word_count,
+                                     list(narration.byte_range) if narration.byte_range else None]
+                                    for narration in article.narrations]
+                       for article in index.articles() if article.narrations},
+    }
+
+
+def read_snapshot(file: Path) -> Optional[Dict]:
+    """A snapshot from a JSON file, or None if there isn't one."""
+    try:
+        return json.loads(file.read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def index_at(bigbook_dir: Path, show_index_file: Path,
+             revision: Optional[str] = None, shows_revision: Optional[str] = None) -> Index:
+    """
+    The Index at git revisions of the Big Book and of the show index,
+    read without checking them out (see git_tree.py).
+
+    :param bigbook_dir: the Big Book of Key directory
+    :param show_index_file: archive_management's export.yaml file
+    :param revision: the Big Book's revision, or None for the working tree
+    :param shows_revision: the show index's revision, or None for the working tree
+    """
+    with ExitStack() as stack:
+        return Index(at_revision(bigbook_dir, revision, stack),
+                     at_revision(show_index_file, shows_revision, stack))
+
+
+class NarrationChange(NamedTuple):
+    """
+    A narration added, removed or moved within its show.
+
+    :ivar article: the article's ID
+    :ivar show: the show's ID
+    :ivar old: the narration's start and end times before, if it was there
+    :ivar new: its start and end times after, if it is still there
+    """
+    article: str
+    show: str
+    old: Optional[List[int]]
+    new: Optional[List[int]]
+
+
+def _blog(article_id: str) -> int:
+    return blog_of(datetime.fromisoformat(article_id[:10]))
+
+
+class IndexDiff:
+    """
+    The differences between two snapshots.
+
+    :ivar old: the old snapshot
+    :ivar new: the new snapshot
+    :ivar added: the IDs of new articles
+    :ivar removed: the IDs of removed articles
+    :ivar retitled: the IDs of articles whose formatted titles have changed
+    :ivar new_shows: the IDs of new shows
+    :ivar removed_shows: the IDs of removed shows
+    :ivar changed_shows: the IDs of shows whose details have changed
+    :ivar narrations: narrations that were added, removed or moved
+                      (but not those whose word counts or byte ranges alone changed)
+    :ivar pages: the IDs of the articles whose pages have changed
+    :ivar blogs: the blogs whose date index pages have changed
+    :ivar titles: True if the title index page has changed
+    """
+    old: Dict
+    new: Dict
+    added: List[str]
+    removed: List[str]
+    retitled: List[str]
+    new_shows: List[str]
+    removed_shows: List[str]
+    changed_shows: List[str]
+    narrations: List[NarrationChange]
+    pages: Set[str]
+    blogs: Set[int]
+    titles: bool
+
+    def __init__(self, old: Dict, new: Dict) -> None:
+        self.old = old
+        self.new = new
+        old_articles, new_articles = old['articles'], new['articles']
+        self.added = [id for id in new_articles if id not in old_articles]
+        self.removed = [id for id in old_articles if id not in new_articles]
+        self.retitled = [id for id in new_articles if id in old_articles
+                         and old_articles[id]['link'] != new_articles[id]['link']]
+
+        old_shows, new_shows = old['shows'], new['shows']
+        self.new_shows = [id for id in new_shows if id not in old_shows]
+        self.removed_shows = [id for id in old_shows if id not in new_shows]
+        self.changed_shows = [id for id in new_shows if id in old_shows
+                              and old_shows[id] != new_shows[id]]
+
+        old_narrations, new_narrations = old['narrations'], new['narrations']
+        renarrated = [id for id in new_articles
+                      if old_narrations.get(id, []) != new_narrations.get(id, [])]
+        self.narrations = []
+        for id in renarrated:
+            self.narrations += self._narration_changes(id, old_narrations.get(id, []),
+                                                       new_narrations.get(id, []))
+
+        changed_shows = set(self.changed_shows)
+        self.pages = set(self.added + self.retitled + renarrated)
+        self.pages.update(id for id, narrations in new_narrations.items()
+                          if any(n[0] in changed_shows for n in narrations))
+
+        # The index pages show the articles, in order, and which have narrations.
+        narrated = [id for id in new_articles
+                    if bool(old_narrations.get(id)) != bool(new_narrations.get(id))]
+        listed = self.added + self.removed + self.retitled + narrated
+        self.titles = bool(listed)
+        self.blogs = {_blog(id) for id in listed}
+        for blog in {0, 1, 2} - self.blogs:
+            if ([id for id in old_articles if _blog(id) == blog] !=
+                    [id for id in new_articles if _blog(id) == blog]):
+                self.blogs.add(blog)
+
+    @staticmethod
+    def _narration_changes(article: str, old: List[List], new: List[List]) -> List[NarrationChange]:
+        """The changes to an article's narrations' times, in each show."""
+        old_times = sorted(n[:3] for n in old)
+        new_times = sorted(n[:3] for n in new)
+        changes = []
+        for show in sorted({n[0] for n in old_times + new_times}):
+            before = [n[1:] for n in old_times if n[0] == show]
+            after = [n[1:] for n in new_times if n[0] == show]
+            if before == after:
+                continue
+            for i in range(max(len(before), len(after))):
+                changes.append(NarrationChange(article, show,
+                                               before[i] if i < len(before) else None,
+                                               after[i] if i < len(after) else None))
+        return changes
+
+    def __bool__(self) -> bool:
+        return bool(self.pages or self.removed or self.blogs or self.titles
+                    or self.new_shows or self.removed_shows or self.changed_shows)
+
+    def _title(self, id: str, snapshot: Dict = None) -> str:
+        return f"{id[:10]} “{(snapshot or self.new)['articles'][id]['title']}”"
+
+    def _show(self, id: str, snapshot: Dict = None) -> str:
+        show = (snapshot or self.new)['shows'][id]
+        return f"{show['date'][:10]} “{show['title']}” ({id})"
+
+    def changelog(self) -> str:
+        """A human-readable report of the changes, in Markdown."""
+        def times(t: List[int]) -> str:
+            return f"{minute_second(t[0])}–{minute_second(t[1])}"
+
+        sections = [
+            ('Added articles', [self._title(id) for id in self.added]),
+            ('Removed articles', [self._title(id, self.old) for id in self.removed]),
+            ('Retitled articles',
+             [f"{self._title(id, self.old)} → “{self.new['articles'][id]['title']}”"
+              if self.old['articles'][id]['title'] != self.new['articles'][id]['title']
+              else f"{self._title(id)} (formatting)" for id in self.retitled]),
+            ('New shows', [self._show(id) for id in self.new_shows]),
+            ('Removed shows', [self._show(id, self.old) for id in self.removed_shows]),
+            ('Changed shows', [self._show(id) for id in self.changed_shows]),
+            ('Narrations', [
+                f"{self._title(c.article)} in {c.show}: "
+                + (f"added at {times(c.new)}" if not c.old else
+                   f"removed from {times(c.old)}" if not c.new else
+                   f"moved from {times(c.old)} to {times(c.new)}")
+                for c in self.narrations]),
+        ]
+        lines = []
+        for heading, items in sections:
+            if items:
+                lines += [f"## {heading}", ''] + [f"- {item}" for item in items] + ['']
+        return '\n'.join(lines) if lines else "No changes.\n"
+
+    def as_json(self) -> Dict:
+        """The changes, and the pages that they affect, as a JSON-compatible dictionary."""
+        return {
+            'added': self.added,
+            'removed': self.removed,
+            'retitled': self.retitled,
+            'new_shows': self.new_shows,
+            'removed_shows': self.removed_shows,
+            'changed_shows': self.changed_shows,
+            'narrations': [c._asdict() for c in self.narrations],
+            'pages': sorted(self.pages),
+            'blogs': sorted(self.blogs),
+            'titles': self.titles,
+        }
+
+
+def _snapshot_of(spec: Optional[str]) -> Dict:
+    """A snapshot from a JSON file, or git revisions 'REV[:SHOWS_REV]', or the working trees."""
+    from settings import BIGBOOK_DIR, SHOW_INDEX_FILE, MP3_INDEX_DIR
+
+    if spec and spec.endswith('.json'):
+        data = read_snapshot(Path(spec))
+        if data is None:
+            raise SystemExit(f"{spec}: not an Index snapshot")
+        return data
+    revision, _, shows_revision = (spec or '').partition(':')
+    index = index_at(BIGBOOK_DIR, SHOW_INDEX_FILE, revision or None, shows_revision or None)
+    if MP3_INDEX_DIR.is_dir():
+        from mp3index import add_byte_ranges
+        add_byte_ranges(index, MP3_INDEX_DIR)
+    return snapshot(index)
+
+
+def main() -> None:
+    from settings import WEBSITE_DIR
+
+    parser = ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument(
+        "old", metavar="OLD", nargs='?', default=str(WEBSITE_DIR / SNAPSHOT_PATH),
+        help="a snapshot file, or a git revision of the Big Book, with a revision "
+             "of archive_management after a ':', if that has changed too "
+             f"(default: the last website build's snapshot, {WEBSITE_DIR / SNAPSHOT_PATH})")
+    parser.add_argument(
+        "new", metavar="NEW", nargs='?',
+        help="likewise (default: the Big Book and show index as they are)")
+    parser.add_argument(
+        "-j", "--json", action="store_true",
+        help="print the changes and the pages that they affect as JSON")
+    args = parser.parse_args()
+
+    diff = IndexDiff(_snapshot_of(args.old), _snapshot_of(args.new))
+    if args.json:
+        print(json.dumps(diff.as_json(), indent=1, ensure_ascii=False))
+    else:
+        print(diff.changelog(), end='')
+
+
+if __name__ == '__main__':
+    main()
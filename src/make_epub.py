@@ -1,86 +1,116 @@
-""" Copy the files listed in a book's book.xml,
-    and create EPUB index files from the metadata in book.xml.
-    Default files and XSLT style sheets from the code directory
-    are used to supply files missing from the book directory.
+""" Build a book's EPUB file: make a fresh workspace, assemble the book
+    into it (see 'assemble.py') and zip it up.
+
+    usage: make_epub.py BOOK EPUB [-w WORKSPACE] [--image-budget SIZE]
+                        [--max-image-size SIZE] [--split-size SIZE]
 """
 
-import shutil
-import sys
-import time
-from os.path import splitext
+__all__ = ['zip_epub', 'build', 'add_build_arguments', 'image_budget']
 
-import lxml.etree
-from typing import List, Optional
-import xml
+from argparse import ArgumentParser
 from pathlib import Path
+from sys import stderr, exit
+from tempfile import TemporaryDirectory
+from typing import List, Optional, TYPE_CHECKING
+from zipfile import ZipFile, ZipInfo, ZIP_DEFLATED, ZIP_STORED
 
-from xml import read
-
-BOOK = Path(sys.argv[1])
-EPUB = Path(sys.argv[2])
-CODE = Path(__file__).parent
-
-OEBPS = EPUB / 'OEBPS'
-DEFAULTS = [CODE / 'templates' / 'epub', CODE / 'templates' / 'common']
-TEMPLATES = CODE / 'templates' / 'epub' / 'XML'
-
-book_dtd = lxml.etree.DTD(str(CODE / 'book.dtd'))
+from functions import parse_size
 
-book = xml.read(BOOK / 'book.xml', dtd=book_dtd)
-book.attrib['date'] = time.strftime("%Y-%m-%d")
+# assemble.py and epub_images.py, with XSLT and the image tools, are
+# imported when a book is built, so that the command line starts quickly.
+if TYPE_CHECKING:
+    from assemble import Resources
+    from epub_images import ImageBudget
 
 
-def expand(xsl_filepath: Path,
-           xml_filepath: Path,
-           doctype: Optional[str] = None):
-    """expand a template file using the book's book.xml metadata"""
-    template = lxml.etree.XSLT(read(xsl_filepath))
-    result = template(book)
-    xml.save(xml_filepath, result, doctype)
-
-
-def copy_files(subdirectory: str, filenames: List[str]) -> None:
+def zip_epub(epub_dir: Path, epub_file: Path) -> None:
+    """
+    Zip an EPUB workspace, with the 'mimetype' file first and uncompressed,
+    as the EPUB standard requires.
+    """
+    with ZipFile(str(epub_file), 'w', ZIP_DEFLATED, compresslevel=9) as epub:
+        mimetype = ZipInfo('mimetype')
+        mimetype.compress_type = ZIP_STORED
+        epub.writestr(mimetype, (epub_dir / 'mimetype').read_bytes())
+        for subdirectory in ('META-INF', 'OEBPS'):
+            for file in sorted((epub_dir / subdirectory).rglob('*')):
+                if file.is_file():
+                    epub.write(str(file), file.relative_to(epub_dir).as_posix())
+
+
+def build(book_dir: Path, epub_file: Path, workspace: Path,
+          resources: 'Resources' = None, images: 'ImageBudget' = None,
+          jobs: int = None, split_size: int = None) -> List[str]:
     """
-    copy files from BOOK to EPUB, using a default or template
-    when a file is missing
+    Build a book's EPUB file.
+
+    :param book_dir: the book's source directory, containing book.xml
+    :param epub_file: the EPUB file to make
+    :param workspace: the directory to assemble the book in
+    :param resources: shared resources, loaded if not given
+    :param images: a budget to fit the book's images to, if any
+    :param jobs: the number of processes to fit images with (default: one per CPU)
+    :param split_size: split sections' files that are bigger than this many bytes
+    :return: error messages, an empty list if the EPUB was made
     """
-    for filename in filenames:
-        src = BOOK / subdirectory / filename
-        dst = OEBPS / subdirectory / filename
-        if src.exists():
-            shutil.copyfile(str(src), str(dst))
-            return
-
-        for default_dir in DEFAULTS:
-            default = default_dir / subdirectory / filename
-            if default.exists():
-                shutil.copyfile(str(default), str(dst))
-            return
-
-        base, ext = splitext(filename)
-        xsl_filepath = TEMPLATES / (base + '.xsl')
-        if ext == '.xhtml' and xsl_filepath.exists():
-            expand(xsl_filepath, dst, doctype='xhtml')
-            return
-
-        raise IOError(f'No file for {subdirectory}/{filename}')
-
-
-# copy in EPUB identification files
-(EPUB / 'META-INF').mkdir(parents=True, exist_ok=True)
-shutil.copyfile(TEMPLATES / 'xml/mimetype',
-                EPUB / 'mimetype')
-shutil.copy(TEMPLATES / 'xml/container.xml',
-            EPUB / 'META-INF' / 'container.xml')
-
-
-# create index files from book.xml (see .xsl files for details)
-expand(TEMPLATES / 'ncx.xsl', OEBPS / 'toc.ncx', doctype=None)
-expand(TEMPLATES / 'opf.xsl', OEBPS / 'content.opf', doctype='opf')
-
-
-# copy the book's files
-copy_files('Text', xml.get_all_str(book, "//section/@file"))
-copy_files('Images', xml.get_all_str(book, "//image/@file"))
-copy_files('Fonts', xml.get_all_str(book, "//font/@file"))
-copy_files('Styles', xml.get_all_str(book, "//style/@file"))
+    from assemble import Resources, fresh_epub_dir, assemble  # slow to import
+    resources = resources or Resources()
+    fresh_epub_dir(workspace, resources)
+    errors = assemble(book_dir, workspace, resources, images, jobs, split_size)
+    if not errors:
+        epub_file.parent.mkdir(parents=True, exist_ok=True)
+        zip_epub(workspace, epub_file)
+    return errors
+
+
+def add_build_arguments(parser: ArgumentParser) -> None:
+    """Add the image budget and section splitting options to a command line parser."""
+    parser.add_argument(
+        "--image-budget", metavar="SIZE", type=parse_size,
+        help="recompress the images to fit in this many bytes in all, e.g. 5M")
+    parser.add_argument(
+        "--max-image-size", metavar="SIZE", type=parse_size,
+        help="recompress any image bigger than this many bytes, e.g. 300K")
+    parser.add_argument(
+        "--split-size", metavar="SIZE", type=parse_size,
+        help="split sections' files that are bigger than this many bytes, e.g. 250K")
+
+
+def image_budget(args) -> Optional['ImageBudget']:
+    """The image budget from the command line, if there is one."""
+    if args.image_budget is None and args.max_image_size is None:
+        return None
+    from epub_images import ImageBudget
+    return ImageBudget(args.image_budget, args.max_image_size)
+
+
+def main() -> None:
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "book", type=Path, metavar="BOOK",
+        help="the book's source directory")
+    parser.add_argument(
+        "epub", type=Path, metavar="EPUB",
+        help="the EPUB file to make")
+    parser.add_argument(
+        "-w", "--workspace", metavar="DIR", type=Path,
+        help="the directory to assemble the book in (default: a temporary directory)")
+    add_build_arguments(parser)
+    args = parser.parse_args()
+
+    images = image_budget(args)
+    if args.workspace:
+        errors = build(args.book, args.epub, args.workspace, images=images,
+                       split_size=args.split_size)
+    else:
+        with TemporaryDirectory() as workspace:
+            errors = build(args.book, args.epub, Path(workspace), images=images,
+                           split_size=args.split_size)
+    for message in errors:
+        print(message, file=stderr)
+    if errors:
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,58 +1,247 @@
-import re
-from shutil import copyfile
-from mako.lookup import TemplateLookup
+""" Build the Hooting Yard Archive website from the Big Book of Key. """
 
-from settings import BIGBOOK_DIR, WEBSITE_DIR, TEMPLATE_DIR, SHOW_INDEX_FILE
+import json
+from argparse import ArgumentParser
+from contextlib import ExitStack
+from hashlib import sha256
+from pathlib import Path
+from time import perf_counter
+from typing import List, Optional, Set
+
+from settings import (BIGBOOK_DIR, WEBSITE_DIR, TEMPLATE_DIR, SHOW_INDEX_FILE,
+                      MP3_INDEX_DIR)
+from api import write_api
 from index import Index
+from assets import ASSET_DIRECTORIES, AssetStore
+from backlinks import LinkGraph
+from cache import code_version, open_store
+from feeds import ArticleDates, write_sitemaps, write_feeds
+from git_tree import at_revision
+from image_sizes import ImageSizes
+from index_diff import SNAPSHOT_PATH, IndexDiff, snapshot, read_snapshot
+from mp3index import add_byte_ranges
+from offline import Precache, shell_files
+from render import Source, Target, WebsitePages, EpubSections, render_articles
+from sinks import Sink, FileSystemSink, MemorySink, open_sink
 
+DATE_INDEX_PAGES = {
+    'index-by-date-1992-2002.html': 0,
+    'index-by-date-2003-2006.html': 1,
+    'index-by-date-2007-2019.html': 2,
+}
+"""The date index pages' templates, and the blogs that they list."""
+
+
+def _build_key(bigbook_dir: Path, assets: Optional[AssetStore]) -> str:
+    """
+    A hash of what the pages depend on, besides the Index and the articles'
+    files: the tools, the templates, and the Big Book's images.
+    """
+    digest = sha256()
+    template_dir = TEMPLATE_DIR / 'website'
+    for file in sorted(Path(__file__).parent.glob('*.py')) + sorted(template_dir.rglob('*')):
+        if file.is_file():
+            digest.update(f'{file.name}\n'.encode('utf-8'))
+            digest.update(file.read_bytes())
+    for file in sorted((bigbook_dir / 'Images').glob('*')):
+        stat = file.stat()
+        digest.update(f'{file.name} {stat.st_size} {stat.st_mtime_ns}\n'.encode('utf-8'))
+    if assets:
+        digest.update(json.dumps(assets.names, sort_keys=True).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _index_page_changed(name: str, diff: IndexDiff, changed: Set[str], index: Index) -> bool:
+    """Whether an index page's template would render differently from the last build."""
+    if name == 'index-by-title.html':
+        return diff.titles
+    if name not in DATE_INDEX_PAGES:
+        return True
+    blog = DATE_INDEX_PAGES[name]
+    # The 2003-2006 blog's index includes the text of its monthly introductions.
+    return blog in diff.blogs or (blog == 1 and any(index.articles_by_id[id].blog == 1
+                                                    for id in changed))
 
-def main() -> None:
-    index = Index(BIGBOOK_DIR, SHOW_INDEX_FILE)
+
+def build(sink: Sink, fingerprint: bool = False, epub_sections: Sink = None,
+          everything: bool = False, bigbook_dir: Path = BIGBOOK_DIR,
+          show_index_file: Path = SHOW_INDEX_FILE) -> None:
+    """
+    Build the website.
+
+    Unless told to render everything, only the pages that have changed
+    since the last build into the same directory are rendered: the pages
+    of articles whose files have changed, or whose entries in the Index
+    have (see index_diff.py), and the index pages and feeds that list them.
+    Everything is rendered if the templates, the tools or the Big Book's
+    images have changed.
+
+    :param sink: where to write the website's files
+    :param fingerprint: if True publish styles, fonts and images under
+                        content-hashed names (see assets.py)
+    :param epub_sections: where to write the articles' EPUB sections too,
+                          from the same pass over the articles (see render.py)
+    :param everything: if True render every page
+    :param bigbook_dir: the Big Book of Key directory, or the same at a git revision
+                        (see git_tree.py)
+    :param show_index_file: archive_management's export.yaml file, or the same
+                            at a git revision
+    """
+    from mako.lookup import TemplateLookup  # slow to import
+
+    index = Index(bigbook_dir, show_index_file)
+    if MP3_INDEX_DIR.is_dir():
+        add_byte_ranges(index, MP3_INDEX_DIR)
 
     templates = TemplateLookup([TEMPLATE_DIR / 'website', TEMPLATE_DIR / 'website' / 'Jinja'],
                                strict_undefined=True)
 
-    # Create website directories, if necessary.
-    for dirname in ('Text', 'Images', 'Media', 'Fonts', 'Styles'):
-        (WEBSITE_DIR / dirname).mkdir(exist_ok=True, parents=True)
+    if fingerprint:
+        # Add the Big Book's images and the templates' files to the asset store,
+        # style sheets last so that their font and image references can be rewritten.
+        assets = AssetStore(open_store('assets', '1'))
+        assets.add_directory('Images', bigbook_dir / 'Images')
+        for dirname in ASSET_DIRECTORIES:
+            assets.add_directory(dirname, TEMPLATE_DIR / 'common' / dirname)
+            assets.add_directory(dirname, TEMPLATE_DIR / 'website' / dirname)
+        assets.publish(sink)
+        rewrite = assets.rewrite
+    else:
+        assets = None
+
+        def rewrite(html: str) -> str:
+            return html
 
-    # Copy in the styling files from the web template.
-    for dirname in ('Fonts', 'Styles', 'Images'):
-        for file in (TEMPLATE_DIR / 'common' / dirname).glob('*'):
-            copyfile(src=file, dst=WEBSITE_DIR / dirname / file.name)
-        for file in (TEMPLATE_DIR / 'website' / dirname).glob('*'):
-            copyfile(src=file, dst=WEBSITE_DIR / dirname / file.name)
+        # Copy in the styling files from the web template.
+        for dirname in ('Fonts', 'Styles', 'Images'):
+            for file in (TEMPLATE_DIR / 'common' / dirname).glob('*'):
+                sink.copy_file(f'{dirname}/{file.name}', file)
+            for file in (TEMPLATE_DIR / 'website' / dirname).glob('*'):
+                sink.copy_file(f'{dirname}/{file.name}', file)
 
     # Copy in the Big Book's media files, if necessary.
-    for dirname in ('Images', 'Media'):
-        for file in (BIGBOOK_DIR / dirname).glob('*'):
-            dst = WEBSITE_DIR / dirname / file.name
-            if not dst.exists():
-                copyfile(src=file, dst=dst)
+    for dirname in ('Media',) if assets else ('Images', 'Media'):
+        for file in (bigbook_dir / dirname).glob('*'):
+            path = f'{dirname}/{file.name}'
+            if not sink.exists(path):
+                sink.copy_file(path, file)
+
+    # Compare the Index and the articles' files with the last build's.
+    # The dates and the links between articles are kept in the website
+    # directory; archives start from those of the directory build.
+    last_build_dir = sink.root if isinstance(sink, FileSystemSink) else WEBSITE_DIR
+    dates = ArticleDates(last_build_dir)
+    changed = dates.update(index)
+    links = LinkGraph(last_build_dir, index)
+    current = dict(snapshot(index), build=_build_key(bigbook_dir, assets))
+    previous = None
+    if isinstance(sink, FileSystemSink) and not everything and not epub_sections:
+        previous = read_snapshot(sink.root / SNAPSHOT_PATH)
+    diff = (IndexDiff(previous, current)
+            if previous and previous.get('build') == current['build'] else None)
+
+    # The service worker's precache: the styles, the fonts that they use,
+    # the logo and the index pages (see offline.py).
+    precache = Precache()
+    for path, file in shell_files([TEMPLATE_DIR / 'common', TEMPLATE_DIR / 'website']).items():
+        precache.add_file(assets.names[path] if assets else path, file)
 
     # Expand the 'index.html' file template.
     file = TEMPLATE_DIR / 'website' / 'index.html'
     template = templates.get_template(file.name)
-    html_file = WEBSITE_DIR / file.name
-    html_file.write_text(template.render(index=index))
+    html = rewrite(template.render(index=index))
+    sink.write_text(file.name, html)
+    precache.add(file.name, html.encode('utf-8'))
 
     # Expand the index pages' templates.
-    for file in (TEMPLATE_DIR / 'website' / 'Text').glob('index-*.html'):
+    index_pages = []
+    for file in sorted((TEMPLATE_DIR / 'website' / 'Jinja').glob('index-*.html')):
+        path = 'Text/' + file.name
+        index_pages.append(path)
+        if (diff is not None and sink.exists(path)
+                and not _index_page_changed(file.name, diff, changed, index)):
+            precache.add_file(path, sink.root / path)
+            continue
         template = templates.get_template(file.name)
-        html_file = WEBSITE_DIR / 'Text' / file.name
-        html_file.write_text(template.render(index=index))
-
-    # Expand the pages for the Big Book, using the page.html template.
-    for article in index.articles():
-        # content = xhtml.content(article.file, heading=True)
-        # I'm going to be a barbarian instead and use a regex on HTML.
-        # It's acceptably accurate on these Big Book files, and much faster.
-        html = article.file.read_text()
-        content = re.search(r'<body[^>]*>(.+)</body>', html, re.DOTALL)[1]
-        content = content.replace('.xhtml"', '.html"')
-        template = templates.get_template('page.html')
-        destination = WEBSITE_DIR / 'Text' / (article.id + '.html')
-        destination.write_text(template.render(content=content, article=article))
+        html = rewrite(template.render(index=index))
+        sink.write_text(path, html)
+        precache.add(path, html.encode('utf-8'))
+    precache.write(sink, templates.get_template('sw.js'))
+
+    # Expand the pages for the Big Book, using the page.html template,
+    # and the EPUB sections, reading each article once, and noting the
+    # links between articles. The links of articles that the graph
+    # doesn't have yet are read first, so that pages list them.
+    for article in links.missing(index.articles()):
+        links.render(Source(article))
+    image_sizes = ImageSizes(open_store('image-sizes', code_version('image_sizes')))
+    pages = WebsitePages(sink, templates.get_template('page.html'), bigbook_dir,
+                         image_sizes, rewrite, assets, links.linked_from)
+    targets: List[Target] = [links, pages]
+    if epub_sections:
+        targets.append(EpubSections(epub_sections))
+    articles = index.articles()
+    if diff is not None:
+        image_sizes.keep()
+        articles = [article for article in articles
+                    if article.id in diff.pages or article.id in changed
+                    or not sink.exists(f'Text/{article.id}.html')]
+    render_articles(articles, targets)
+
+    # Render the pages whose lists of the articles that link to them have
+    # changed since they were rendered (see backlinks.py).
+    stale = set(links.stale())
+    if diff is not None:
+        stale |= links.linked_by(diff.retitled)
+    render_articles([article for article in index.articles() if article.id in stale], [pages])
+
+    # Write the sitemap and feeds, with dates from the article files' hashes,
+    # if they have changed.
+    if diff is None or diff.added or diff.removed or diff.retitled or changed:
+        write_sitemaps(sink, index, dates, index_pages)
+        write_feeds(sink, index, dates)
+
+    # Export the Index as JSON, for other tools (see api.py).
+    write_api(sink, index, dates)
+    dates.save(sink)
+    links.save(sink)
+    sink.write_text(SNAPSHOT_PATH, json.dumps(current, indent=1, sort_keys=True))
+
+
+def main() -> None:
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "-f", "--fingerprint", action="store_true",
+        help="publish styles, fonts and images under content-hashed names (see assets.py)")
+    parser.add_argument(
+        "-o", "--output", metavar="TARGET", default=str(WEBSITE_DIR),
+        help="a directory, a .zip or .tar[.gz] file, or 'memory' to time the build "
+             f"without writing anything (default: {WEBSITE_DIR})")
+    parser.add_argument(
+        "-e", "--epub-sections", metavar="DIR", type=Path,
+        help="also write the articles' EPUB sections into a directory, "
+             "for prepare_book.py --sections")
+    parser.add_argument(
+        "-a", "--all", action="store_true",
+        help="render every page, not just those that have changed since the last build")
+    parser.add_argument(
+        "-r", "--revision", metavar="REV",
+        help="build from a git revision of the Big Book, without checking it out "
+             "(default: the working tree)")
+    parser.add_argument(
+        "--shows-revision", metavar="REV",
+        help="likewise for archive_management's show index")
+    args = parser.parse_args()
+
+    start = perf_counter()
+    with ExitStack() as stack, open_sink(args.output) as sink:
+        build(sink, args.fingerprint,
+              FileSystemSink(args.epub_sections) if args.epub_sections else None,
+              args.all, at_revision(BIGBOOK_DIR, args.revision, stack),
+              at_revision(SHOW_INDEX_FILE, args.shows_revision, stack))
+    if isinstance(sink, MemorySink):
+        size = sum(len(data) for data in sink.files.values())
+        print(f"{len(sink.files)} files, {size} bytes, {perf_counter() - start:.2f} seconds")
 
 
 if __name__ == '__main__':
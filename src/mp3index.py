@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+"""
+Seek indexes for the Hooting Yard on the Air MP3 files.
+
+A seek index maps show time to byte offsets in a show's MP3 file,
+one offset per 'step' seconds. They are made by scanning every MPEG
+audio frame header in a local copy of the file, so they are exact
+even for variable bit rate files. (The Xing/Info header of a VBR file
+only has a coarse 100 point table of contents, which is used with
+the --quick option when scanning the whole file is too slow.)
+
+The website uses these indexes to give each narration's audio player
+a media fragment URL ('#t=start,end') and the byte range of the
+narration within the show.
+"""
+
+__all__ = [
+    'Frame',
+    'XingHeader',
+    'SeekIndex',
+    'frames',
+    'xing_header',
+    'scan',
+    'read_seek_index',
+    'write_seek_index',
+    'add_byte_ranges',
+]
+
+import struct
+from argparse import ArgumentParser
+from array import array
+from dataclasses import dataclass
+from mmap import mmap, ACCESS_READ
+from pathlib import Path
+from sys import byteorder, stderr
+from typing import Iterator, List, Optional, Tuple
+
+# Bit rates in kbit/s, indexed by [MPEG 1?][layer][bit rate index]
+_BIT_RATES = {
+    True: {
+        1: (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+        2: (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+        3: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    },
+    False: {
+        1: (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+        2: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+        3: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    },
+}
+
+# Sample rates in Hz, indexed by the header's version bits.
+_SAMPLE_RATES = {
+    3: (44100, 48000, 32000),  # MPEG 1
+    2: (22050, 24000, 16000),  # MPEG 2
+    0: (11025, 12000, 8000),   # MPEG 2.5
+}
+
+_SEEK_MAGIC = b'UBSK'
+_SEEK_HEADER = struct.Struct('<4sHHII')  # magic, version, step, count, audio end
+
+
+@dataclass
+class Frame:
+    """
+    An MPEG audio frame.
+
+    :ivar offset: byte offset of the frame header in the file
+    :ivar length: length of the frame in bytes, including the header
+    :ivar samples: number of audio samples in the frame
+    :ivar sample_rate: samples per second
+    :ivar mpeg1: True for MPEG 1, False for MPEG 2 and 2.5
+    :ivar mono: True for single channel audio
+    """
+    offset: int
+    length: int
+    samples: int
+    sample_rate: int
+    mpeg1: bool
+    mono: bool
+
+
+@dataclass
+class XingHeader:
+    """
+    The VBR information in the first frame of a Xing/LAME encoded file.
+
+    :ivar frames: number of audio frames, if given
+    :ivar bytes: number of audio bytes, if given
+    :ivar toc: 100 entries, entry 'i' is the byte position of
+              'i' percent of the way through the audio, in 256ths
+    """
+    frames: Optional[int]
+    bytes: Optional[int]
+    toc: Optional[bytes]
+
+
+@dataclass
+class SeekIndex:
+    """
+    Byte offsets of the frames at regular intervals through a show.
+
+    :ivar step: seconds between entries
+    :ivar offsets: offsets[i] is where the frame playing at i * step seconds starts
+    :ivar audio_end: offset of the end of the last audio frame
+    """
+    step: int
+    offsets: List[int]
+    audio_end: int
+
+    def offset(self, seconds: int) -> int:
+        """
+        The byte offset of the frame playing at a time, rounded down to the index step.
+        Times after the end of the audio give the end of the audio.
+        """
+        i = max(seconds, 0) // self.step
+        return self.offsets[i] if i < len(self.offsets) else self.audio_end
+
+    def byte_range(self, start_time: int, end_time: int) -> Optional[Tuple[int, int]]:
+        """
+        The inclusive byte range, as used in HTTP 'Range' headers,
+        for the audio between two times, or None if there is no audio
+        between them, e.g. if the start is at or past the end of the audio.
+        End times are rounded up to the next index step.
+
+        >>> index = SeekIndex(10, [100, 200, 300], 400)
+        >>> index.byte_range(5, 15), index.byte_range(25, 60), index.byte_range(30, 60)
+        ((100, 299), (300, 399), None)
+        """
+        start = self.offset(start_time)
+        end = self.offset(end_time + self.step - 1)
+        return (start, end - 1) if start < end else None
+
+
+def _frame_at(data: mmap, offset: int) -> Optional[Frame]:
+    """Decode the frame header at an offset, or None if there isn't a valid one."""
+    if offset + 4 > len(data):
+        return None
+    b0, b1, b2, b3 = data[offset:offset + 4]
+    if b0 != 0xFF or b1 & 0xE0 != 0xE0:
+        return None
+    version = (b1 >> 3) & 3
+    layer = 4 - ((b1 >> 1) & 3)
+    bit_rate_index = b2 >> 4
+    sample_rate_index = (b2 >> 2) & 3
+    if version == 1 or layer == 4 or bit_rate_index in (0, 15) or sample_rate_index == 3:
+        return None
+    mpeg1 = version == 3
+    bit_rate = _BIT_RATES[mpeg1][layer][bit_rate_index] * 1000
+    sample_rate = _SAMPLE_RATES[version][sample_rate_index]
+    padding = (b2 >> 1) & 1
+    if layer == 1:
+        length = (12 * bit_rate // sample_rate + padding) * 4
+        samples = 384
+    elif layer == 2 or mpeg1:
+        length = 144 * bit_rate // sample_rate + padding
+        samples = 1152
+    else:
+        length = 72 * bit_rate // sample_rate + padding
+        samples = 576
+    return Frame(offset, length, samples, sample_rate, mpeg1, mono=b3 >> 6 == 3)
+
+
+def _audio_start(data: mmap) -> int:
+    """Skip an ID3v2 tag at the start of the file, if there is one."""
+    if data[:3] != b'ID3' or len(data) < 10:
+        return 0
+    size = 0
+    for b in data[6:10]:  # a 'synchsafe' integer: 7 bits per byte
+        size = (size << 7) | (b & 0x7F)
+    footer = 10 if data[5] & 0x10 else 0
+    return 10 + size + footer
+
+
+def frames(data: mmap) -> Iterator[Frame]:
+    """
+    All the audio frames in an MP3 file's data.
+    Garbage between frames is skipped by searching for the next valid header
+    that is followed by another valid header.
+    """
+    offset = _audio_start(data)
+    end = len(data)
+    if data[end - 128:end - 125] == b'TAG':  # ID3v1 tag
+        end -= 128
+    while offset + 4 <= end:
+        frame = _frame_at(data, offset)
+        if frame and frame.offset + frame.length <= end:
+            following = frame.offset + frame.length
+            if following + 4 > end or _frame_at(data, following):
+                yield frame
+                offset = following
+                continue
+        offset = data.find(b'\xFF', offset + 1, end)
+        if offset == -1:
+            return
+
+
+def xing_header(data: mmap, frame: Frame) -> Optional[XingHeader]:
+    """The Xing/Info header inside the first frame, if there is one."""
+    if frame.mpeg1:
+        side_info = 17 if frame.mono else 32
+    else:
+        side_info = 9 if frame.mono else 17
+    position = frame.offset + 4 + side_info
+    if data[position:position + 4] not in (b'Xing', b'Info'):
+        return None
+    flags, = struct.unpack('>I', data[position + 4:position + 8])
+    position += 8
+    header = XingHeader(None, None, None)
+    if flags & 1:
+        header.frames, = struct.unpack('>I', data[position:position + 4])
+        position += 4
+    if flags & 2:
+        header.bytes, = struct.unpack('>I', data[position:position + 4])
+        position += 4
+    if flags & 4:
+        header.toc = bytes(data[position:position + 100])
+    return header
+
+
+def scan(mp3_file: Path, step: int = 1, quick: bool = False) -> SeekIndex:
+    """
+    Make a seek index for an MP3 file.
+
+    :param mp3_file: the MP3 file
+    :param step: seconds between index entries
+    :param quick: if True, and the file has a Xing table of contents,
+                  estimate the offsets from that instead of reading every frame
+    :return: the index
+    """
+    with mp3_file.open('rb') as f, mmap(f.fileno(), 0, access=ACCESS_READ) as data:
+        all_frames = frames(data)
+        first = next(all_frames, None)
+        if first is None:
+            raise ValueError(f'{mp3_file}: no MPEG audio frames')
+        xing = xing_header(data, first)
+        if xing:
+            # The Xing frame is silent padding, the audio starts after it.
+            audio_start = first.offset + first.length
+        else:
+            audio_start = first.offset
+            all_frames = _prepend(first, all_frames)
+
+        if quick and xing and xing.frames and xing.bytes and xing.toc:
+            return _estimate_from_xing(xing, first, audio_start, step)
+
+        offsets = []
+        samples = 0
+        audio_end = audio_start
+        for frame in all_frames:
+            while samples >= len(offsets) * step * frame.sample_rate:
+                offsets.append(frame.offset)
+            samples += frame.samples
+            audio_end = frame.offset + frame.length
+        return SeekIndex(step, offsets, audio_end)
+
+
+def _prepend(frame: Frame, rest: Iterator[Frame]) -> Iterator[Frame]:
+    yield frame
+    yield from rest
+
+
+def _estimate_from_xing(xing: XingHeader, first: Frame,
+                        audio_start: int, step: int) -> SeekIndex:
+    duration = xing.frames * first.samples / first.sample_rate
+    offsets = []
+    for i in range(int(duration // step) + 1):
+        percent = min(99, int(100 * i * step / duration))
+        offsets.append(audio_start + xing.toc[percent] * xing.bytes // 256)
+    return SeekIndex(step, offsets, audio_start + xing.bytes)
+
+
+def write_seek_index(file: Path, index: SeekIndex) -> None:
+    """Save a seek index in its compact binary form."""
+    offsets = array('I', index.offsets)
+    if byteorder != 'little':
+        offsets.byteswap()
+    with file.open('wb') as f:
+        f.write(_SEEK_HEADER.pack(_SEEK_MAGIC, 1, index.step, len(offsets), index.audio_end))
+        offsets.tofile(f)
+
+
+def read_seek_index(file: Path) -> SeekIndex:
+    """Load a seek index saved by 'write_seek_index'."""
+    with file.open('rb') as f:
+        magic, version, step, count, audio_end = _SEEK_HEADER.unpack(f.read(_SEEK_HEADER.size))
+        if magic != _SEEK_MAGIC or version != 1:
+            raise ValueError(f'{file}: not a seek index')
+        offsets = array('I')
+        offsets.fromfile(f, count)
+    if byteorder != 'little':
+        offsets.byteswap()
+    return SeekIndex(step, offsets.tolist(), audio_end)
+
+
+def add_byte_ranges(index, seek_index_dir: Path) -> None:
+    """
+    Set the 'byte_range' of every narration in an Index
+    whose show has a seek index file.
+
+    :param index: an 'index.Index'
+    :param seek_index_dir: the directory of '<show id>.seek' files
+    """
+    for show in index.shows_by_id.values():
+        file = seek_index_dir / (show.id + '.seek')
+        if file.exists():
+            seek_index = read_seek_index(file)
+            for narration in show.narrations:
+                narration.byte_range = seek_index.byte_range(narration.start_time,
+                                                             narration.end_time)
+
+
+def main() -> None:
+    from settings import SHOW_MP3_DIR, MP3_INDEX_DIR
+
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "-o", "--output", metavar="DIR", type=Path, default=MP3_INDEX_DIR,
+        help="directory for the seek index files")
+    parser.add_argument(
+        "-s", "--step", metavar="SECONDS", type=int, default=1,
+        help="seconds between index entries")
+    parser.add_argument(
+        "-q", "--quick", action="store_true",
+        help="use the Xing table of contents of VBR files instead of scanning them")
+    parser.add_argument(
+        "-f", "--force", action="store_true",
+        help="rebuild indexes that are newer than their MP3 files")
+    parser.add_argument(
+        "-v", "--verbose", action="store_true",
+        help="print file names as they are indexed")
+    parser.add_argument(
+        "files", type=Path, metavar="MP3", nargs="*",
+        help=f"show MP3 files (default: all of {SHOW_MP3_DIR})")
+    args = parser.parse_args()
+
+    args.output.mkdir(parents=True, exist_ok=True)
+    for mp3_file in args.files or sorted(SHOW_MP3_DIR.glob('*.mp3')):
+        seek_file = args.output / (mp3_file.stem + '.seek')
+        if (not args.force and seek_file.exists()
+                and seek_file.stat().st_mtime >= mp3_file.stat().st_mtime):
+            continue
+        if args.verbose:
+            print(mp3_file)
+        try:
+            write_seek_index(seek_file, scan(mp3_file, args.step, args.quick))
+        except (IOError, ValueError) as e:
+            print(f"{mp3_file}:0:0: {e}", file=stderr)
+
+
+if __name__ == '__main__':
+    main()
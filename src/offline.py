@@ -0,0 +1,116 @@
+"""
+A service worker, so that repeat visits to the website are served from
+the reader's browser, and readers can save years of articles to read
+offline.
+
+The website's shell, i.e. its style sheets, the fonts that they use,
+the logo and the index pages, is listed with each file's content hash
+in 'precache-manifest.json':
+
+    {"version": "...", "files": [{"url": "Styles/style.css", "revision": "..."}, ...]}
+
+The version is a hash of the revisions, and is also written into
+'sw.js', the service worker, made from the sw.js template. So 'sw.js'
+changes, and browsers install it again, exactly when the shell does.
+When installed, the worker caches the shell, and then serves it from
+the cache. Article pages and images are served from the cache too,
+once visited, and refreshed from the network in the background. Other
+files, such as the audio, are left to the network.
+
+The index pages' 'offline.html' script registers the worker, and asks it
+to save the articles of a year, listed in the JSON export (see api.py),
+when a reader clicks on a link with a 'data-years' attribute.
+"""
+
+__all__ = ['MANIFEST', 'SERVICE_WORKER', 'LOGO', 'Precache', 'font_references', 'shell_files']
+
+import json
+import re
+from hashlib import sha256
+from pathlib import Path
+from typing import Dict, Iterable, List
+
+from api import API_DIR
+from sinks import Sink
+
+MANIFEST = 'precache-manifest.json'
+SERVICE_WORKER = 'sw.js'
+LOGO = 'Images/yardlogo.gif'
+
+_REVISION_LENGTH = 16
+
+_FONT_REFERENCE = re.compile(r'''url\(\s*['"]?(?:\.\./)?(Fonts/[^'")?#]+)''')
+
+
+class Precache:
+    """
+    The files that the service worker caches when it is installed.
+
+    :ivar revisions: the files' website paths, and their content hashes
+    """
+    revisions: Dict[str, str]
+
+    def __init__(self) -> None:
+        self.revisions = {}
+
+    def add(self, path: str, data: bytes) -> None:
+        """Add a file, by its website path and contents."""
+        self.revisions[path] = sha256(data).hexdigest()[:_REVISION_LENGTH]
+
+    def add_file(self, path: str, file: Path) -> None:
+        """Add a file, by its website path and the file that it is copied from."""
+        self.add(path, file.read_bytes())
+
+    @property
+    def version(self) -> str:
+        """A hash of every file's path and revision."""
+        lines = ''.join(f'{path} {revision}\n' for path, revision in sorted(self.revisions.items()))
+        return sha256(lines.encode('utf-8')).hexdigest()[:_REVISION_LENGTH]
+
+    def write(self, sink: Sink, template) -> None:
+        """
+        Write the precache manifest and the service worker into a website.
+
+        :param sink: the website
+        :param template: the Mako sw.js template
+        """
+        version = self.version
+        sink.write_text(MANIFEST, json.dumps(
+            {'version': version,
+             'files': [{'url': path, 'revision': revision}
+                       for path, revision in sorted(self.revisions.items())]},
+            indent=1))
+        sink.write_text(SERVICE_WORKER, template.render(version=version, manifest=MANIFEST,
+                                                        api_dir=API_DIR))
+
+
+def font_references(style_sheet: str) -> List[str]:
+    """
+    The website paths of the fonts that a style sheet uses.
+
+    >>> font_references("src: url('../Fonts/a.ttf') format('truetype'); src: url(../Fonts/b.ttf)")
+    ['Fonts/a.ttf', 'Fonts/b.ttf']
+    """
+    return _FONT_REFERENCE.findall(style_sheet)
+
+
+def shell_files(template_dirs: Iterable[Path]) -> Dict[str, Path]:
+    """
+    The style sheets, the fonts that they use and the logo, in template
+    directories, by their website paths. A later directory's file replaces
+    an earlier one's, as when they are copied into the website.
+    """
+    template_dirs = list(template_dirs)
+    files = {}
+    for directory in template_dirs:
+        for file in sorted((directory / 'Styles').glob('*.css')):
+            files[f'Styles/{file.name}'] = file
+        if (directory / LOGO).is_file():
+            files[LOGO] = directory / LOGO
+    fonts = {font for path, file in files.items() if path.startswith('Styles/')
+             for font in font_references(file.read_text(encoding='utf-8'))}
+    for directory in template_dirs:
+        for font in fonts:
+            if (directory / font).is_file():
+                files[font] = directory / font
+    return files
@@ -0,0 +1,447 @@
+#!/usr/bin/env python3
+"""
+Build the complete works, every article in the Big Book, as a series of
+EPUB volumes.
+
+One book of everything has a huge book.xml, is slow to build, and too
+heavy for e-readers. Instead the Index is partitioned into volumes, each
+of consecutive years of one of Frank Key's blogs, with no more than a
+number of articles, and a size: that of the articles' files and the images
+that they use. A year that is too big for a volume is split between
+months, and a month between articles.
+
+Each volume gets a book directory, e.g. 'volume-03', in a books directory,
+with a book.xml made from a template book's, which gives the series'
+metadata, styling and front matter (the title page, contents, etc.),
+the volume's articles, in a section for each year, and the images that
+they use. EPUBs can't link to each other, so links to articles in other
+volumes go to the articles' pages on the website.
+
+The series manifest, 'series.json' in the books directory, lists every
+volume's title, articles, size, the volumes that it links to and a hash
+of its sources. Only the volumes whose hashes have changed, or whose
+EPUBs are missing, are built, in parallel (see batch_build.py). So
+that a new volume at the end of the series doesn't change the others,
+a volume's metadata gives its number but not how many volumes there are.
+"""
+
+__all__ = ['MANIFEST', 'Volume', 'ArticleSources', 'partition', 'volumes_of', 'write_volume',
+           'build_series']
+
+import json
+import re
+from argparse import ArgumentParser
+from contextlib import ExitStack
+from copy import deepcopy
+from hashlib import sha256
+from itertools import groupby
+from pathlib import Path
+from sys import stderr, exit
+from typing import Callable, Dict, Hashable, List, Optional, Sequence, Set, TypeVar, TYPE_CHECKING
+from uuid import NAMESPACE_URL, uuid5
+
+from lxml.etree import XML
+
+import xml
+from functions import parse_size
+from git_tree import at_revision
+from index import Index, Article
+from make_epub import add_build_arguments, image_budget
+from prepare_book import file_element, find_images
+from settings import WEBSITE_URL
+
+# The EPUB tools, the website's feeds and render.py are imported when a
+# series is built, so that the command line starts quickly.
+if TYPE_CHECKING:
+    from epub_images import ImageBudget
+    from render import Sections
+
+MANIFEST = 'series.json'
+"""The series manifest's file name, in the books directory."""
+
+_ARTICLE_LINK = re.compile(rb'href="([^"/:#]+)\.xhtml(#[^"]*)?"')
+
+T = TypeVar('T')
+
+
+def _fits(items: Sequence[T], size_of: Callable[[T], int],
+          max_bytes: int, max_sections: int) -> bool:
+    return len(items) <= max_sections and sum(map(size_of, items)) <= max_bytes
+
+
+def partition(items: Sequence[T], size_of: Callable[[T], int], max_bytes: int, max_sections: int,
+              era: Callable[[T], Hashable],
+              levels: Sequence[Callable[[T], Hashable]]) -> List[List[T]]:
+    """
+    Partition items into volumes of consecutive items, of the same era, of
+    at most 'max_sections' items and 'max_bytes' bytes (unless one item is
+    bigger). Volumes are filled with whole groups of items with the same
+    first level key, or if a group is too big, with the same next level key.
+
+    >>> partition(list(range(10)), lambda n: 10, 30, 100, lambda n: n // 5, [lambda n: n // 2])
+    [[0, 1], [2, 3, 4], [5, 6, 7], [8, 9]]
+    """
+    def units(group: List[T], levels: Sequence[Callable[[T], Hashable]]) -> List[List[T]]:
+        if _fits(group, size_of, max_bytes, max_sections):
+            return [group]
+        if not levels:
+            return [[item] for item in group]
+        return [unit for _, subgroup in groupby(group, levels[0])
+                for unit in units(list(subgroup), levels[1:])]
+
+    volumes = []
+    for _, era_items in groupby(items, era):
+        volume = []
+        for _, group in groupby(era_items, levels[0]):
+            for unit in units(list(group), levels[1:]):
+                if volume and not _fits(volume + unit, size_of, max_bytes, max_sections):
+                    volumes.append(volume)
+                    volume = []
+                volume += unit
+        if volume:
+            volumes.append(volume)
+    return volumes
+
+
+class Volume:
+    """
+    A volume of the complete works.
+
+    :ivar number: the volume's number, from 1
+    :ivar articles: its articles, in date order
+    """
+    number: int
+    articles: List[Article]
+
+    def __init__(self, number: int, articles: List[Article]) -> None:
+        self.number = number
+        self.articles = articles
+
+    @property
+    def name(self) -> str:
+        """The name of the volume's book directory."""
+        return f'volume-{self.number:02}'
+
+    @property
+    def blog(self) -> int:
+        return self.articles[0].blog
+
+    @property
+    def years(self) -> str:
+        """The years of the volume's articles, e.g. '2007–2008'."""
+        first, last = self.articles[0].date, self.articles[-1].date
+        if first.year == last.year:
+            return str(first.year)
+        return f'{first.year}–{last.year}'
+
+
+class ArticleSources:
+    """
+    Where the articles' files, and the names of the images that each uses, come from.
+
+    :ivar bigbook: the Big Book of Key directory
+    :ivar rendered: EPUB sections rendered with the website, if any (see render.py)
+    """
+    bigbook: Path
+    rendered: Optional['Sections']
+
+    def __init__(self, bigbook: Path, rendered: Optional['Sections']) -> None:
+        self.bigbook = bigbook
+        self.rendered = rendered
+        self._images: Dict[str, Set[str]] = {}
+
+    def file(self, article: Article) -> Path:
+        name = article.file.name
+        if self.rendered and self.rendered.current(article.file):
+            return self.rendered.file(name)
+        return article.file
+
+    def images(self, article: Article) -> Set[str]:
+        name = article.file.name
+        if name not in self._images:
+            if self.rendered and self.rendered.current(article.file):
+                self._images[name] = self.rendered.images(name)
+            else:
+                self._images[name] = find_images(article.file)
+        return self._images[name]
+
+    def size(self, article: Article) -> int:
+        """The size of an article's file and of the images that it uses."""
+        images = (self.bigbook / 'Images' / image for image in self.images(article))
+        return article.file.stat().st_size + sum(file.stat().st_size
+                                                 for file in images if file.exists())
+
+
+def volumes_of(index: Index, sources: ArticleSources,
+               max_bytes: int, max_sections: int) -> List[Volume]:
+    """Partition an Index's articles into volumes, by blog, year and month."""
+    articles = sorted(index.articles(), key=lambda a: a.date)
+    return [Volume(number, articles)
+            for number, articles in enumerate(
+                partition(articles, sources.size, max_bytes, max_sections,
+                          era=lambda a: a.blog,
+                          levels=[lambda a: a.date.year, lambda a: (a.date.year, a.date.month)]),
+                start=1)]
+
+
+def _link_rewriter(volume_of: Dict[str, int], number: int, linked: Set[int]) -> Callable:
+    """A function that points links to articles in other volumes at the website."""
+    def rewrite(match) -> bytes:
+        id = match.group(1).decode('utf-8')
+        other = volume_of.get(id)
+        if other is None or other == number:
+            return match.group()
+        linked.add(other)
+        anchor = (match.group(2) or b'').decode('utf-8')
+        return f'href="{WEBSITE_URL}/Text/{id}.html{anchor}"'.encode('utf-8')
+    return rewrite
+
+
+def _text(book: xml.Element, tag: str) -> str:
+    """The text of a book.xml element, without its markup."""
+    return ''.join(xml.get_one(book, tag).itertext()).strip()
+
+
+def _write_if_changed(file: Path, data: bytes) -> None:
+    if not file.exists() or file.read_bytes() != data:
+        file.write_bytes(data)
+
+
+def write_volume(volume: Volume, template_dir: Path, template: xml.Element,
+                 books_dir: Path, sources: ArticleSources, volume_of: Dict[str, int]) -> Dict:
+    """
+    Write a volume's book directory.
+
+    :param volume: the volume
+    :param template_dir: the template book's directory
+    :param template: the root of the template book's book.xml
+    :param books_dir: the directory to write the volume's book directory in
+    :param sources: where to copy the articles and images from
+    :param volume_of: every article's ID, and the number of its volume
+    :return: the volume's entry in the series manifest
+    """
+    from feeds import BLOG_TITLES  # slow to import
+    book_dir = books_dir / volume.name
+    digest = sha256()
+
+    def write(path: str, data: bytes) -> None:
+        file = book_dir / path
+        file.parent.mkdir(parents=True, exist_ok=True)
+        _write_if_changed(file, data)
+        digest.update(f'{path} {len(data)}\n'.encode('utf-8'))
+        digest.update(data)
+
+    # The template's own files, e.g. its cover and front matter.
+    for file in sorted(template_dir.rglob('*')):
+        if file.is_file() and file.name not in ('book.xml', 'book.xml.bak'):
+            write(file.relative_to(template_dir).as_posix(), file.read_bytes())
+
+    # The articles, with links to other volumes' articles changed, and their images.
+    linked: Set[int] = set()
+    rewrite = _link_rewriter(volume_of, volume.number, linked)
+    images = set()
+    for article in volume.articles:
+        data = sources.file(article).read_bytes()
+        write(f'Text/{article.file.name}', _ARTICLE_LINK.sub(rewrite, data))
+        images |= sources.images(article)
+    for image in sorted(images):
+        file = sources.bigbook / 'Images' / image
+        if file.exists():
+            write(f'Images/{image}', file.read_bytes())
+
+    # The book.xml, with the template's metadata, and front matter sections first.
+    book = deepcopy(template)
+    series = _text(book, 'title')
+    title = f'{series}, Volume {volume.number}: {volume.years}'
+    description = (f"{_text(book, 'description')} Volume {volume.number}: "
+                   f"{BLOG_TITLES[volume.blog]}, {volume.years}.")
+    book.set('file', f"{template.get('file')}-{volume.number:02}")
+    book.set('uuid', str(uuid5(NAMESPACE_URL, f"{template.get('uuid') or series}/{volume.name}")))
+    for tag, text in (('title', title), ('description', description)):
+        element = xml.get_one(book, tag)
+        for child in list(element):
+            element.remove(child)
+        element.text = text
+    contents = xml.get_one(book, 'contents')
+    for year, articles in groupby(volume.articles, lambda a: a.date.year):
+        year_section = xml.element('section')
+        year_section.text = '\n'
+        year_section.tail = '\n'
+        year_title = xml.element('title')
+        year_title.text = str(year)
+        year_section.append(year_title)
+        for article in articles:
+            section = file_element('section', article.file.name)
+            section.append(xml.rewrap('title', XML(article.link)))
+            year_section.append(section)
+        contents.append(year_section)
+    illustrations = book.find('illustrations')
+    if illustrations is None:
+        illustrations = xml.element('illustrations')
+        attributions = book.find('attributions')
+        if attributions is not None:
+            attributions.addprevious(illustrations)
+        else:
+            book.append(illustrations)
+    existing = set(xml.get_all_str(illustrations, 'image/@file'))
+    for image in sorted(images - existing):
+        illustrations.append(file_element('image', image))
+    xml.save(book_dir / 'book.xml', book, doctype='book')
+    digest.update((book_dir / 'book.xml').read_bytes())
+
+    return {
+        'number': volume.number,
+        'name': volume.name,
+        'file': book.get('file'),
+        'title': title,
+        'blog': volume.blog,
+        'first': volume.articles[0].id,
+        'last': volume.articles[-1].id,
+        'sections': len(volume.articles),
+        'bytes': sum(sources.size(article) for article in volume.articles),
+        'links_to': sorted(linked),
+        'articles': [article.id for article in volume.articles],
+        'sha256': digest.hexdigest(),
+    }
+
+
+def _tools_hash(options: str) -> str:
+    """A hash of what every volume depends on: the EPUB templates, tools and build options."""
+    from assemble import UBER  # slow to import
+    digest = sha256(options.encode('utf-8'))
+    files = sorted((UBER / 'templates' / 'epub').rglob('*')) + sorted((UBER / 'src').glob('*.py'))
+    for file in files:
+        if file.is_file():
+            digest.update(f'{file.name}\n'.encode('utf-8'))
+            digest.update(file.read_bytes())
+    return digest.hexdigest()
+
+
+def build_series(template_dir: Path, bigbook: Path, books_dir: Path, workspace: Path, output: Path,
+                 max_bytes: int, max_sections: int, jobs: int = None, images: 'ImageBudget' = None,
+                 split_size: int = None, rendered: 'Sections' = None, everything: bool = False,
+                 dry_run: bool = False) -> List[str]:
+    """
+    Write the volumes' book directories and the series manifest, and build
+    the volumes that have changed.
+
+    :param template_dir: the template book's directory
+    :param bigbook: the Big Book of Key directory, or the same at a git revision (see git_tree.py)
+    :param books_dir: the directory for the volumes' book directories and the manifest
+    :param workspace: the directory to assemble the volumes in
+    :param output: the directory for the EPUB files
+    :param max_bytes: the most bytes of articles and images in a volume
+    :param max_sections: the most articles in a volume
+    :param jobs: the number of volumes to build at once (default: one per CPU)
+    :param images: a budget to fit each volume's images to, if any
+    :param split_size: split sections' files that are bigger than this many bytes
+    :param rendered: EPUB sections rendered with the website, to copy articles from
+    :param everything: if True build every volume
+    :param dry_run: if True only print the volumes
+    :return: error messages
+    """
+    from feeds import BLOG_TITLES  # slow to import
+    index = Index(bigbook)
+    sources = ArticleSources(bigbook, rendered)
+    volumes = volumes_of(index, sources, max_bytes, max_sections)
+    if dry_run:
+        for volume in volumes:
+            size = sum(sources.size(article) for article in volume.articles)
+            print(f"{volume.name}  {volume.articles[0].id[:10]}–{volume.articles[-1].id[:10]}"
+                  f"  {len(volume.articles):5} articles  {size / 1024 ** 2:7.1f} MB"
+                  f"  {BLOG_TITLES[volume.blog]}")
+        return []
+
+    template = xml.read(template_dir / 'book.xml')
+    volume_of = {article.id: volume.number for volume in volumes for article in volume.articles}
+    manifest_file = books_dir / MANIFEST
+    previous = {}
+    if manifest_file.exists():
+        previous = {entry['name']: entry
+                    for entry in json.loads(manifest_file.read_text())['volumes']}
+    tools = _tools_hash(repr((images, split_size)))
+
+    entries = []
+    for volume in volumes:
+        entry = write_volume(volume, template_dir, template, books_dir, sources, volume_of)
+        entry['sha256'] = sha256((tools + entry['sha256']).encode('utf-8')).hexdigest()
+        entries.append(entry)
+    stale = [entry for entry in entries
+             if everything or previous.get(entry['name'], {}).get('sha256') != entry['sha256']
+             or not (output / (entry['file'] + '.epub')).exists()]
+
+    print(f"{len(stale)} of {len(entries)} volumes to build: "
+          f"{', '.join(entry['name'] for entry in stale) or 'none'}")
+    errors = []
+    if stale:
+        from batch_build import build_all  # slow to import
+        errors = build_all([books_dir / entry['name'] for entry in stale], workspace, output,
+                           jobs=jobs, images=images, split_size=split_size)
+    for entry in stale:
+        if any(str(books_dir / entry['name'] / 'book.xml') in message for message in errors):
+            entry['sha256'] = None  # so that it's built again next time
+    manifest_file.write_text(json.dumps(
+        {'title': _text(template, 'title'),
+         'volumes': entries}, indent=1, ensure_ascii=False))
+    return errors
+
+
+def main() -> None:
+    parser = ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument(
+        "template", type=Path, metavar="TEMPLATE",
+        help="the template book's directory, with the series' book.xml metadata and front matter")
+    parser.add_argument(
+        "-b", "--bigbook", metavar="DIR", type=Path, required=True,
+        help="the Big Book of Key directory")
+    parser.add_argument(
+        "-r", "--revision", metavar="REV",
+        help="build from a git revision of the Big Book, without checking it out "
+             "(default: the working tree)")
+    parser.add_argument(
+        "-d", "--books", metavar="DIR", type=Path, required=True,
+        help="the directory for the volumes' book directories and the series manifest")
+    parser.add_argument(
+        "-w", "--workspace", metavar="DIR", type=Path, required=True,
+        help="the directory to assemble the volumes in")
+    parser.add_argument(
+        "-o", "--output", metavar="DIR", type=Path, required=True,
+        help="the directory for the EPUB files")
+    parser.add_argument(
+        "--volume-size", metavar="SIZE", type=parse_size, default=parse_size('40M'),
+        help="the most bytes of articles and images in a volume (default: 40M)")
+    parser.add_argument(
+        "--volume-sections", metavar="N", type=int, default=1500,
+        help="the most articles in a volume (default: 1500)")
+    parser.add_argument(
+        "-s", "--sections", metavar="DIR", type=Path,
+        help="EPUB sections written by 'make_website.py --epub-sections', "
+             "to copy articles from")
+    parser.add_argument(
+        "-j", "--jobs", metavar="N", type=int,
+        help="the number of volumes to build at once (default: one per CPU)")
+    parser.add_argument(
+        "-a", "--all", action="store_true",
+        help="build every volume, not just those that have changed")
+    parser.add_argument(
+        "-n", "--dry-run", action="store_true",
+        help="print the volumes, without building them")
+    add_build_arguments(parser)
+    args = parser.parse_args()
+
+    from render import Sections  # slow to import
+    args.books.mkdir(parents=True, exist_ok=True)
+    with ExitStack() as stack:
+        errors = build_series(args.template, at_revision(args.bigbook, args.revision, stack),
+                              args.books, args.workspace, args.output, args.volume_size,
+                              args.volume_sections, args.jobs, image_budget(args),
+                              args.split_size, Sections(args.sections) if args.sections else None,
+                              args.all, args.dry_run)
+    for message in errors:
+        print(message, file=stderr)
+    if errors:
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
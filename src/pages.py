@@ -0,0 +1,211 @@
+"""
+Byte-level assembly of article pages.
+
+An article's page is its Big Book file's body, with the internal links
+changed from '.xhtml' to '.html', inside the 'page.html' template.
+Rather than decoding, copying and re-encoding the whole article, the
+body is located in the file's bytes, the link rewrites are recorded as
+splices, and the page is written as a list of buffers: the template's
+head, slices of the original bytes between the splices, and the
+template's tail.
+
+Images get 'width' and 'height' attributes, so the page's layout
+doesn't shift as they load, and are loaded lazily.
+"""
+
+__all__ = [
+    'CONTENT_MARKER',
+    'Buffer',
+    'Splice',
+    'body_span',
+    'link_splices',
+    'internal_links',
+    'ImageTag',
+    'image_tags',
+    'image_splices',
+    'audio_links',
+    'page_chunks',
+    'write_chunks',
+]
+
+import os
+import re
+from pathlib import Path
+from typing import Callable, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+from lxml.html import fragment_fromstring
+
+CONTENT_MARKER = '<!--ubercoordinator:content-->'
+"""Rendered into templates in place of the article's content, then split on."""
+
+Buffer = Union[bytes, memoryview]
+
+_BODY_START = re.compile(rb'<body[^>]*>')
+_XHTML_LINK = re.compile(rb'\.xhtml"')
+_IMG = re.compile(rb'<img\b[^>]*>')
+_SRC = re.compile(rb'\ssrc="([^"]*)"')
+_ATTRIBUTE_NAME = re.compile(rb'\s([a-zA-Z-]+)=')
+_AUDIO_LINK = re.compile(rb'<a [^>]*class="internal-audio"[^>]*>.*?</a>', re.DOTALL)
+_INTERNAL_LINK = re.compile(rb'<a [^>]*class="internal"[^>]*>')
+_ARTICLE_HREF = re.compile(rb'\shref="([^"/#]+)\.xhtml[#"]')
+
+_IOV_MAX = 1024  # the usual limit on buffers per 'writev' call
+
+
+class Splice(NamedTuple):
+    """Replace the bytes from 'start' to 'end' with 'replacement'."""
+    start: int
+    end: int
+    replacement: bytes
+
+
+def body_span(data: bytes) -> Tuple[int, int]:
+    """
+    The start and end of the content of an XHTML file's body element.
+
+    >>> body_span(b'<html><body class="x"><p>Hi</p></body></html>')
+    (22, 31)
+
+    :raise ValueError: if there is no body element
+    """
+    match = _BODY_START.search(data)
+    end = data.rfind(b'</body>')
+    if not match or end < match.end():
+        raise ValueError("no <body> element")
+    return match.end(), end
+
+
+def link_splices(data: bytes, start: int, end: int) -> List[Splice]:
+    """
+    Splices that change links to '.xhtml' files into links to '.html' files.
+
+    >>> link_splices(b'<a href="x.xhtml">x</a>', 0, 23)
+    [Splice(start=10, end=17, replacement=b'.html"')]
+    """
+    return [Splice(m.start(), m.end(), b'.html"')
+            for m in _XHTML_LINK.finditer(data, start, end)]
+
+
+def internal_links(data: bytes, start: int, end: int) -> List[str]:
+    """
+    The IDs of the articles that some XHTML's 'internal' links go to.
+
+    >>> internal_links(b'<a class="internal" href="2004-05-01-x.xhtml#y">x</a>', 0, 52)
+    ['2004-05-01-x']
+    """
+    ids = []
+    for match in _INTERNAL_LINK.finditer(data, start, end):
+        href = _ARTICLE_HREF.search(match.group())
+        if href:
+            ids.append(href.group(1).decode('utf-8'))
+    return ids
+
+
+class ImageTag(NamedTuple):
+    """An 'img' element's tag, where it starts, and its 'src' URL, if it has one."""
+    start: int
+    tag: bytes
+    src: Optional[str]
+
+
+def image_tags(data: bytes, start: int, end: int) -> List[ImageTag]:
+    """
+    The 'img' elements in some XHTML.
+
+    >>> image_tags(b'<p><img src="x.png"/></p>', 0, 25)
+    [ImageTag(start=3, tag=b'<img src="x.png"/>', src='x.png')]
+    """
+    images = []
+    for match in _IMG.finditer(data, start, end):
+        src = _SRC.search(match.group())
+        images.append(ImageTag(match.start(), match.group(),
+                               src.group(1).decode('utf-8') if src else None))
+    return images
+
+
+def image_splices(images: Sequence[ImageTag],
+                  size_of: Callable[[str], Optional[Tuple[int, int]]]) -> List[Splice]:
+    """
+    Splices that add 'width', 'height', 'loading="lazy"' and 'decoding="async"'
+    attributes to 'img' elements that don't have them.
+
+    :param images: the elements (see 'image_tags')
+    :param size_of: the width and height of the image at a 'src' URL, if known
+
+    >>> image_splices(image_tags(b'<img src="x.png"/>', 0, 18), lambda src: (4, 3))
+    [Splice(start=4, end=4, replacement=b' width="4" height="3" loading="lazy" decoding="async"')]
+    """
+    splices = []
+    for image in images:
+        names = set(_ATTRIBUTE_NAME.findall(image.tag))
+        size = size_of(image.src) if image.src is not None else None
+        attributes = []
+        if size and b'width' not in names and b'height' not in names:
+            attributes += [f'width="{size[0]}"', f'height="{size[1]}"']
+        attributes += [f'{name}="{value}"' for name, value in
+                       (('loading', 'lazy'), ('decoding', 'async')) if name.encode() not in names]
+        if attributes:
+            position = image.start + len(b'<img')
+            splices.append(Splice(position, position,
+                                  (' ' + ' '.join(attributes)).encode('utf-8')))
+    return splices
+
+
+def audio_links(data: bytes, start: int, end: int) -> List[Tuple[str, str]]:
+    """
+    The titles and URLs of the 'internal-audio' links in some XHTML,
+    for the page's 'Sounds' players.
+    """
+    links = []
+    for match in _AUDIO_LINK.finditer(data, start, end):
+        a = fragment_fromstring(match.group().decode('utf-8'))
+        links.append((a.get('title', ''), a.get('href')))
+    return links
+
+
+def page_chunks(head: bytes, data: bytes, start: int, end: int,
+                splices: Sequence[Splice], tail: bytes) -> List[Buffer]:
+    """
+    The buffers that make up a page, in order.
+    The splices must be sorted, and must not overlap.
+    Slices of 'data' are memoryviews, so nothing is copied.
+    """
+    view = memoryview(data)
+    chunks = [head]
+    position = start
+    for splice in splices:
+        chunks.append(view[position:splice.start])
+        chunks.append(splice.replacement)
+        position = splice.end
+    chunks.append(view[position:end])
+    chunks.append(tail)
+    return chunks
+
+
+def write_chunks(file: Path, chunks: Sequence[Buffer]) -> None:
+    """Write buffers to a file, with vectored writes where the OS has them."""
+    fd = os.open(str(file), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        if hasattr(os, 'writev'):
+            for i in range(0, len(chunks), _IOV_MAX):
+                _writev_all(fd, list(chunks[i:i + _IOV_MAX]))
+        else:
+            for chunk in chunks:
+                _write_all(fd, memoryview(chunk))
+    finally:
+        os.close(fd)
+
+
+def _writev_all(fd: int, chunks: List[Buffer]) -> None:
+    """'writev' until everything is written; it may stop part way."""
+    while chunks:
+        written = os.writev(fd, chunks)
+        while chunks and written >= len(chunks[0]):
+            written -= len(chunks.pop(0))
+        if chunks and written:
+            chunks[0] = memoryview(chunks[0])[written:]
+
+
+def _write_all(fd: int, chunk: memoryview) -> None:
+    while chunk:
+        chunk = chunk[os.write(fd, chunk):]
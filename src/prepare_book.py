@@ -1,7 +1,7 @@
 from argparse import ArgumentParser
 from pathlib import Path
 from time import strftime
-from typing import List, Set
+from typing import List, Optional, Set, TYPE_CHECKING
 import re
 import shutil
 
@@ -10,6 +10,10 @@ from lxml.etree import XML, DTD
 import xml
 from index import Index
 
+# render.py, with its templates and sinks, is only needed with --sections.
+if TYPE_CHECKING:
+    from render import Sections
+
 
 def copyfile(src: Path, dst: Path) -> None:
     print(f'{src} --> {dst}')
@@ -33,18 +37,28 @@ def find_images(file: Path) -> Set[str]:
 def run(ebook: Path,
         bigbook: Path,
         ubercoordinator: Path,
-        files: List[Path]) -> None:
+        files: List[Path],
+        index: Optional[Index] = None,
+        book_dtd: Optional[DTD] = None,
+        rendered: Optional['Sections'] = None) -> None:
     """
     :param ebook: the ebook source directory
     :param bigbook: the Big Book of Key
     :param ubercoordinator: the ubercoordinator source directory, for the DTD
     :param files: the XHTML file from the Big Book of Key that need adding
+    :param index: the Big Book's Index, if it has already been loaded
+    :param book_dtd: the book.xml DTD, if it has already been loaded
+    :param rendered: EPUB sections rendered with the website, if any, to copy
+                     articles from, with the images they use, rather than
+                     reading the Big Book's files again (see render.py)
     :return:
     """
 
-    index = Index(bigbook)
+    if index is None:
+        index = Index(bigbook)
 
-    book_dtd = DTD((ubercoordinator / 'src' / 'book.dtd').open())
+    if book_dtd is None:
+        book_dtd = DTD((ubercoordinator / 'src' / 'book.dtd').open())
     book = xml.read(ebook / 'book.xml', dtd=book_dtd)
 
     illustrations = xml.get_one(book, 'illustrations')
@@ -56,13 +70,25 @@ def run(ebook: Path,
     initial_sections = sections.copy()
     initial_images = images.copy()
 
+    def article_images(filename: str) -> Set[str]:
+        if rendered and rendered.current(bigbook / 'Text' / filename):
+            return rendered.images(filename)
+        return find_images(bigbook / 'Text' / filename)
+
+    def article_file(filename: str) -> Path:
+        if rendered and rendered.current(bigbook / 'Text' / filename):
+            return rendered.file(filename)
+        return bigbook / 'Text' / filename
+
     for filename in sections:
         ebook_file = ebook / 'Text' / filename
         bigbook_file = bigbook / 'Text' / filename
+        copied = False
         if not ebook_file.exists() and bigbook_file.exists():
-            copyfile(bigbook_file, ebook_file)
+            copyfile(article_file(filename), ebook_file)
+            copied = True
         if ebook_file.exists():
-            for img_filename in find_images(ebook_file):
+            for img_filename in (article_images(filename) if copied else find_images(ebook_file)):
                 if img_filename not in images:
                     illustrations.append(file_element('image', img_filename))
                     images.add(img_filename)
@@ -74,14 +100,14 @@ def run(ebook: Path,
         article = index.articles_by_id[article_id]
 
         if article.file.name not in sections:
-            copyfile(article.file, ebook / 'Text' / article.file.name)
+            copyfile(article_file(article.file.name), ebook / 'Text' / article.file.name)
             title = xml.rewrap('title', XML(article.link))
             section = file_element('section', article.file.name)
             section.append(title)
             contents.append(section)
             sections.add(file.name)
 
-        for img_filename in find_images(article.file):
+        for img_filename in article_images(article.file.name):
             if img_filename not in images:
                 illustrations.append(file_element('image', img_filename))
                 images.add(img_filename)
@@ -114,12 +140,20 @@ def main() -> None:
             "-v", "--verbose", action="store_true",
             help="print file names as they are added",
             default=False)
+    parser.add_argument(
+            "-s", "--sections", metavar="DIR", type=Path,
+            help="EPUB sections written by 'make_website.py --epub-sections', "
+                 "to copy articles from")
     parser.add_argument(
             "files", type=Path, metavar="XHTML", nargs="*",
             help="Big Book of Key files to add")
     args = parser.parse_args()
     if args.ebook and args.bigbook and args.ubercoordinator:
-        run(args.ebook, args.bigbook, args.ubercoordinator, args.files)
+        rendered = None
+        if args.sections:
+            from render import Sections
+            rendered = Sections(args.sections)
+        run(args.ebook, args.bigbook, args.ubercoordinator, args.files, rendered=rendered)
 
 
 if __name__ == "__main__":
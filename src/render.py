@@ -0,0 +1,229 @@
+"""
+Render the Big Book's articles for several targets in one pass.
+
+The website's pages and the ebooks' sections are both made from the
+articles' XHTML files. Rather than each reading and scanning every
+file, 'render_articles' reads each article once, as a Source, whose
+scans (the body, its links, images and audio links) are made when a
+target first asks for them, and are shared by every target.
+
+A target is a subclass of Target, which is given each article's Source
+in turn, and finished at the end. There are two here (and backlinks.py's
+LinkGraph, which notes the links between articles):
+
+    WebsitePages    the website's pages, in a sink (see make_website.py)
+
+    EpubSections    EPUB-ready sections, i.e. the articles' XHTML files with
+                    their '.xhtml' links, and a manifest of the images that
+                    each uses, which prepare_book.py reads instead of the
+                    Big Book (see Sections)
+"""
+
+__all__ = ['Source', 'Target', 'WebsitePages', 'EpubSections', 'Sections', 'render_articles']
+
+import json
+from abc import ABC, abstractmethod
+from os.path import normpath
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+from urllib.parse import unquote
+
+from assets import AssetStore
+from index import Article
+from image_sizes import ImageSizes
+from pages import (CONTENT_MARKER, ImageTag, Splice, body_span, link_splices, internal_links,
+                   image_tags, image_splices, audio_links, page_chunks)
+from sinks import Sink
+
+IMAGES_URL = '../Images/'
+"""The start of the URLs of the Big Book's images, in its articles."""
+
+
+class Source:
+    """
+    An article's file, read once, and scanned as targets need it.
+
+    :ivar article: the article
+    :ivar data: the file's contents
+    :ivar start: where the content of the file's 'body' element starts
+    :ivar end: where it ends
+    """
+    article: Article
+    data: bytes
+    start: int
+    end: int
+
+    def __init__(self, article: Article) -> None:
+        self.article = article
+        self.data = article.file.read_bytes()
+        self.start, self.end = body_span(self.data)
+        self._links: Optional[List[Splice]] = None
+        self._images: Optional[List[ImageTag]] = None
+        self._audio_links: Optional[List[Tuple[str, str]]] = None
+        self._internal_links: Optional[List[str]] = None
+
+    @property
+    def links(self) -> List[Splice]:
+        """Splices that change the body's links to '.xhtml' files to '.html' files."""
+        if self._links is None:
+            self._links = link_splices(self.data, self.start, self.end)
+        return self._links
+
+    @property
+    def images(self) -> List[ImageTag]:
+        """The body's 'img' elements."""
+        if self._images is None:
+            self._images = image_tags(self.data, self.start, self.end)
+        return self._images
+
+    @property
+    def image_files(self) -> Set[str]:
+        """The names of the files in the Big Book's 'Images' directory that the body uses."""
+        return {image.src[len(IMAGES_URL):] for image in self.images
+                if image.src and image.src.startswith(IMAGES_URL)}
+
+    @property
+    def audio_links(self) -> List[Tuple[str, str]]:
+        """The titles and URLs of the body's 'internal-audio' links."""
+        if self._audio_links is None:
+            self._audio_links = audio_links(self.data, self.start, self.end)
+        return self._audio_links
+
+    @property
+    def internal_links(self) -> List[str]:
+        """The IDs of the articles that the body's 'internal' links go to."""
+        if self._internal_links is None:
+            self._internal_links = internal_links(self.data, self.start, self.end)
+        return self._internal_links
+
+
+class Target(ABC):
+    """
+    Something made from every article.
+    Subclasses must implement 'render', and may implement 'finish'.
+    """
+
+    @abstractmethod
+    def render(self, source: Source) -> None:
+        """Make this target's output for an article."""
+
+    def finish(self) -> None:
+        """Called after the last article has been rendered."""
+        pass
+
+
+class WebsitePages(Target):
+    """
+    The website's article pages, made with the page.html template.
+    The article's body is spliced into the rendered template as bytes
+    (see pages.py), rather than parsing or decoding the article.
+    """
+
+    def __init__(self, sink: Sink, template, bigbook_dir: Path, image_sizes: ImageSizes,
+                 rewrite: Callable[[str], str] = None,
+                 assets: Optional[AssetStore] = None,
+                 linked_from: Callable[[Article], List[Article]] = None) -> None:
+        """
+        :param sink: where to write the pages
+        :param template: the Mako page.html template
+        :param bigbook_dir: the Big Book of Key directory
+        :param image_sizes: the sizes of the Big Book's images
+        :param rewrite: a function to rewrite the rendered template with,
+                        e.g. to use fingerprinted assets
+        :param assets: fingerprinted assets, if any (see assets.py)
+        :param linked_from: a function that gives the articles that link to
+                            an article, for the page's 'linked from' list,
+                            if any (see backlinks.py)
+        """
+        self.sink = sink
+        self.template = template
+        self.bigbook_dir = bigbook_dir
+        self.image_sizes = image_sizes
+        self.rewrite = rewrite or (lambda html: html)
+        self.assets = assets
+        self.linked_from = linked_from or (lambda article: [])
+
+    def image_size(self, src: str) -> Optional[Tuple[int, int]]:
+        return self.image_sizes.size(self.bigbook_dir / normpath(f'Text/{unquote(src)}'))
+
+    def render(self, source: Source) -> None:
+        html = self.rewrite(self.template.render(content=CONTENT_MARKER, article=source.article,
+                                                 audio_links=source.audio_links,
+                                                 linked_from=self.linked_from(source.article)))
+        head, tail = (part.encode('utf-8') for part in html.split(CONTENT_MARKER))
+        splices = source.links + image_splices(source.images, self.image_size)
+        if self.assets:
+            splices += self.assets.splices(source.data, source.start, source.end)
+        splices.sort()
+        self.sink.write_chunks(f'Text/{source.article.id}.html',
+                               page_chunks(head, source.data, source.start, source.end,
+                                           splices, tail))
+
+    def finish(self) -> None:
+        self.image_sizes.save()
+
+
+class EpubSections(Target):
+    """
+    The articles' XHTML files, as they go into EPUBs: unchanged, so links
+    between them still end in '.xhtml', in a sink's 'Text' directory, with
+    'manifest.json', which lists the images that each file uses, and the
+    size and modification time of the Big Book file it was copied from.
+    """
+    manifest: Dict[str, Dict]  # file name to 'images' and 'stat'
+
+    def __init__(self, sink: Sink) -> None:
+        self.sink = sink
+        self.manifest = {}
+
+    def render(self, source: Source) -> None:
+        name = source.article.file.name
+        self.sink.write_bytes(f'Text/{name}', source.data)
+        stat = source.article.file.stat()
+        self.manifest[name] = {'images': sorted(source.image_files),
+                               'stat': [stat.st_size, stat.st_mtime_ns]}
+
+    def finish(self) -> None:
+        self.sink.write_text('manifest.json', json.dumps(self.manifest, indent=1, sort_keys=True))
+
+
+class Sections:
+    """
+    EPUB sections made by EpubSections in a directory. A section is only
+    used while the Big Book file that it was copied from is unchanged;
+    otherwise the file is read again.
+
+    :ivar directory: the directory
+    """
+    directory: Path
+
+    def __init__(self, directory: Path) -> None:
+        self.directory = directory
+        self._manifest = json.loads((directory / 'manifest.json').read_text())
+
+    def current(self, file: Path) -> bool:
+        """Whether there is a section for a Big Book file, as the file is now."""
+        entry = self._manifest.get(file.name)
+        try:
+            stat = file.stat()
+        except OSError:
+            return False
+        return isinstance(entry, dict) and entry['stat'] == [stat.st_size, stat.st_mtime_ns]
+
+    def file(self, name: str) -> Path:
+        """A section's file, by the name of the article's file."""
+        return self.directory / 'Text' / name
+
+    def images(self, name: str) -> Set[str]:
+        """The names of the image files that a section uses."""
+        return set(self._manifest[name]['images'])
+
+
+def render_articles(articles: Iterable[Article], targets: Sequence[Target]) -> None:
+    """Render every article, reading each once, for every target, then finish the targets."""
+    for article in articles:
+        source = Source(article)
+        for target in targets:
+            target.render(source)
+    for target in targets:
+        target.finish()
@@ -1,9 +1,12 @@
 """
 Find the data files and directories that Ubercoordinator will need.
 
-If the environment variables BIGBOOK_DIR, WEBSITE_DIR or SHOW_INDEX_FILE
-are set then those values will be used, otherwise this module
-will look for repository directories inside '~/Projects/HootingYard'.
+If the environment variables BIGBOOK_DIR, WEBSITE_DIR, SHOW_INDEX_FILE,
+SHOW_MP3_DIR or MP3_INDEX_DIR are set then those values will be used,
+otherwise this module will look for repository directories inside
+'~/Projects/HootingYard'. Build caches go in UBERCOORDINATOR_CACHE,
+or '~/.cache/ubercoordinator', and are kept within UBERCOORDINATOR_CACHE_SIZE,
+or 2 GB.
 """
 
 __all__ = [
@@ -12,6 +15,11 @@ __all__ = [
     'TEMPLATE_DIR',
     'WEBSITE_DIR',
     'WEBSITE_URL',
+    'SHOW_MP3_DIR',
+    'MP3_INDEX_DIR',
+    'CACHE_DIR',
+    'CACHE_SIZE',
+    'CORPUS_FILE',
 ]
 
 from os import environ
@@ -48,6 +56,14 @@ SHOW_INDEX_FILE = _get_directory('SHOW_INDEX_FILE', 'analysis/index/export/expor
 """The 'export.yaml' file for the show index, from the 'analysis' repository."""
 
 
+SHOW_MP3_DIR = _get_directory('SHOW_MP3_DIR', 'archive_management/mp3')
+"""Local copies of the Hooting Yard on the Air MP3 files, named '<show id>.mp3'."""
+
+
+MP3_INDEX_DIR = _get_directory('MP3_INDEX_DIR', 'analysis/index/export/seek')
+"""Seek indexes for the show MP3 files, made by 'mp3index.py'."""
+
+
 WEBSITE_DIR = _get_directory('WEBSITE_DIR', 'HootingYard.github.io')
 """The output directory for the website, in the 'HootingYard.github.io' repository."""
 
@@ -56,3 +72,15 @@ TEMPLATE_DIR = _get_ubercoordinator_dir() / 'templates'
 """The directory of template files."""
 
 
+CACHE_DIR = Path(environ.get('UBERCOORDINATOR_CACHE', '~/.cache/ubercoordinator')).expanduser()
+"""Where the tools keep things that can be rebuilt, but take a while to."""
+
+
+CACHE_SIZE = environ.get('UBERCOORDINATOR_CACHE_SIZE', '2G')
+"""The most that the caches in CACHE_DIR may take, e.g. '500M', see 'cache.py'."""
+
+
+CORPUS_FILE = CACHE_DIR / 'corpus.sqlite'
+"""The parsed Big Book store, see 'corpus.py'."""
+
+
@@ -0,0 +1,229 @@
+"""
+Places to write the website to.
+
+A sink takes files by their path in the website, e.g. 'Text/index-by-title.html',
+and writes them into a directory, a zip or tar archive, or memory.
+The directory sink writes files atomically, and leaves files that would
+not change alone, so their modification times stay put.
+"""
+
+__all__ = [
+    'Sink',
+    'FileSystemSink',
+    'ZipSink',
+    'TarSink',
+    'MemorySink',
+    'open_sink',
+]
+
+import os
+import shutil
+import tarfile
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from filecmp import cmp
+from io import BytesIO
+from pathlib import Path
+from tempfile import NamedTemporaryFile, SpooledTemporaryFile
+from typing import BinaryIO, Dict, Iterator, Sequence, Set
+from zipfile import ZipFile, ZIP_DEFLATED
+
+from pages import Buffer, write_chunks
+
+
+class Sink(ABC):
+    """
+    Somewhere to write a website's files.
+    Subclasses must implement 'open' and 'exists'.
+    """
+
+    @abstractmethod
+    @contextmanager
+    def open(self, path: str) -> Iterator[BinaryIO]:
+        """A binary file to write a website file into. It is saved when closed."""
+
+    @abstractmethod
+    def exists(self, path: str) -> bool:
+        """True if a website file is already there."""
+
+    def write_bytes(self, path: str, data: bytes) -> None:
+        with self.open(path) as f:
+            f.write(data)
+
+    def write_text(self, path: str, text: str) -> None:
+        self.write_bytes(path, text.encode('utf-8'))
+
+    def write_chunks(self, path: str, chunks: Sequence[Buffer]) -> None:
+        """Write a file made of several buffers (see pages.py)."""
+        with self.open(path) as f:
+            for chunk in chunks:
+                f.write(chunk)
+
+    def copy_file(self, path: str, src: Path) -> None:
+        """Copy a file, a Path or anything else that can be opened, e.g. a GitPath."""
+        with self.open(path) as f, src.open('rb') as source:
+            shutil.copyfileobj(source, f)
+
+    def close(self) -> None:
+        pass
+
+    def __enter__(self) -> 'Sink':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class FileSystemSink(Sink):
+    """
+    Write into a directory. Each file is written to a temporary file first,
+    which replaces the real one only if their contents differ.
+    """
+
+    def __init__(self, root: Path) -> None:
+        self.root = root
+        root.mkdir(parents=True, exist_ok=True)
+
+    def exists(self, path: str) -> bool:
+        return (self.root / path).exists()
+
+    @contextmanager
+    def _temporary(self, path: str) -> Iterator[Path]:
+        destination = self.root / path
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        with NamedTemporaryFile(dir=str(destination.parent), prefix='.',
+                                delete=False) as f:
+            temporary = Path(f.name)
+        try:
+            yield temporary
+            if destination.exists() and cmp(str(temporary), str(destination), shallow=False):
+                temporary.unlink()
+            else:
+                os.chmod(str(temporary), 0o644)
+                os.replace(str(temporary), str(destination))
+        except BaseException:
+            if temporary.exists():
+                temporary.unlink()
+            raise
+
+    @contextmanager
+    def open(self, path: str) -> Iterator[BinaryIO]:
+        with self._temporary(path) as temporary, temporary.open('wb') as f:
+            yield f
+
+    def write_chunks(self, path: str, chunks: Sequence[Buffer]) -> None:
+        with self._temporary(path) as temporary:
+            write_chunks(temporary, chunks)
+
+    def copy_file(self, path: str, src: Path) -> None:
+        if not isinstance(src, Path):
+            return super().copy_file(path, src)
+        with self._temporary(path) as temporary:
+            shutil.copyfile(str(src), str(temporary))
+
+
+class ZipSink(Sink):
+    """Write into a zip file."""
+
+    def __init__(self, file: Path) -> None:
+        self.zip = ZipFile(str(file), 'w', ZIP_DEFLATED)
+        self._written: Set[str] = set()
+
+    def exists(self, path: str) -> bool:
+        return path in self._written
+
+    @contextmanager
+    def open(self, path: str) -> Iterator[BinaryIO]:
+        self._written.add(path)
+        with self.zip.open(path, 'w') as f:
+            yield f
+
+    def copy_file(self, path: str, src: Path) -> None:
+        if not isinstance(src, Path):
+            return super().copy_file(path, src)
+        self._written.add(path)
+        self.zip.write(str(src), path)
+
+    def close(self) -> None:
+        self.zip.close()
+
+
+class TarSink(Sink):
+    """
+    Write into a tar file, as a stream, compressed according to
+    the file's extension, e.g. '.tar.gz'.
+    """
+
+    def __init__(self, file: Path) -> None:
+        compression = {'.gz': 'gz', '.tgz': 'gz', '.bz2': 'bz2', '.xz': 'xz'}
+        mode = 'w|' + compression.get(file.suffix, '')
+        self.tar = tarfile.open(str(file), mode)
+        self._written: Set[str] = set()
+
+    def exists(self, path: str) -> bool:
+        return path in self._written
+
+    @contextmanager
+    def open(self, path: str) -> Iterator[BinaryIO]:
+        # A tar entry needs its size before its contents.
+        with SpooledTemporaryFile(max_size=1 << 22) as f:
+            yield f
+            info = tarfile.TarInfo(path)
+            info.size = f.tell()
+            info.mtime = int(time.time())
+            info.mode = 0o644
+            f.seek(0)
+            self.tar.addfile(info, f)
+        self._written.add(path)
+
+    def copy_file(self, path: str, src: Path) -> None:
+        if not isinstance(src, Path):
+            return super().copy_file(path, src)
+        self._written.add(path)
+        self.tar.add(str(src), arcname=path)
+
+    def close(self) -> None:
+        self.tar.close()
+
+
+class MemorySink(Sink):
+    """
+    Keep everything in memory, for tests and for timing the rendering alone.
+
+    :ivar files: website path to contents
+    """
+    files: Dict[str, bytes]
+
+    def __init__(self) -> None:
+        self.files = {}
+
+    def exists(self, path: str) -> bool:
+        return path in self.files
+
+    @contextmanager
+    def open(self, path: str) -> Iterator[BinaryIO]:
+        with BytesIO() as f:
+            yield f
+            self.files[path] = f.getvalue()
+
+    def write_bytes(self, path: str, data: bytes) -> None:
+        self.files[path] = bytes(data)
+
+    def write_chunks(self, path: str, chunks: Sequence[Buffer]) -> None:
+        self.files[path] = b''.join(chunks)
+
+
+def open_sink(target: str) -> Sink:
+    """
+    A sink for a target: 'memory', a '.zip' or '.tar[.gz|.bz2|.xz]' file,
+    or otherwise a directory.
+    """
+    if target == 'memory':
+        return MemorySink()
+    path = Path(target).expanduser()
+    if path.suffix == '.zip':
+        return ZipSink(path)
+    if '.tar' in path.suffixes or path.suffix == '.tgz':
+        return TarSink(path)
+    return FileSystemSink(path)
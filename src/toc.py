@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+Rebuild the Big Book's table of contents, 'Text/toc.xhtml', from the
+articles' headings, and report how it differs from the current one.
+
+The Index takes the articles' IDs and titles from the table of contents,
+so an article that is missing from it is missing from the website.
+Each contents item is
+'<p>DATE — <a class="internal" href="ID.xhtml">HEADING</a></p>', in file
+name order, where DATE starts the file's name and HEADING is the markup
+of the article's 'h1' (or, failing that, its 'title'), less any links in
+it. An item whose heading's text is unchanged is kept as it is, with the
+formatting of its title, which the Index uses, and an item's link keeps
+its attributes.
+Only the contents division of the file is rewritten.
+
+Headings are extracted in parallel, and cached by file hash, so only
+new and changed files are read again. (Files whose size and modification
+time are unchanged are not even hashed.)
+"""
+
+__all__ = ['Heading', 'HeadingCache', 'headings', 'dated', 'contents_items', 'differences']
+
+import json
+import re
+from argparse import ArgumentParser
+from datetime import datetime
+from hashlib import sha1
+from html import unescape
+from pathlib import Path
+from sys import stderr, exit
+from typing import Dict, List, NamedTuple, Optional, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from cache import Store
+
+_H1 = re.compile(rb'<h1[^>]*>(.*?)</h1>', re.DOTALL)
+_TITLE = re.compile(rb'<title[^>]*>(.*?)</title>', re.DOTALL)
+_LINK_TAG = re.compile(r'</?a\b[^>]*>')
+_TAG = re.compile(r'<[^>]*>')
+_SPACE = re.compile(r'\s+')
+_CONTENTS = re.compile(rb'(<div class="contents">)(.*?)(\s*</div>)', re.DOTALL)
+_ITEM = re.compile(r'<p>\s*([0-9]{4}-[0-9]{2}-[0-9]{2}) — (<a [^>]*?href="([^"]+)"[^>]*>)(.*?)</a>'
+                   r'\s*</p>', re.DOTALL)
+
+
+class Heading(NamedTuple):
+    """An article's heading, as XHTML markup, and the hash of the file it came from."""
+    hash: str
+    markup: str
+
+
+def _extract(file: Path) -> Tuple[str, Optional[Heading]]:
+    """An article file's heading, or None if it has neither 'h1' nor 'title'."""
+    data = file.read_bytes()
+    match = _H1.search(data) or _TITLE.search(data)
+    if not match:
+        return file.name, None
+    markup = _LINK_TAG.sub('', match.group(1).decode('utf-8'))
+    return file.name, Heading(sha1(data).hexdigest(), _SPACE.sub(' ', markup).strip())
+
+
+class HeadingCache:
+    """
+    Article headings, by file name, kept as JSON in a store (see cache.py)
+    with each file's hash, size and modification time.
+    """
+    _entries: Dict[str, dict]
+    _KEY = 'headings.json'
+
+    def __init__(self, store: 'Store') -> None:
+        self.store = store
+        self._entries = json.loads(store.get(self._KEY) or b'{}')
+
+    def get(self, file: Path) -> Optional[Heading]:
+        """A file's cached heading, if the file is unchanged."""
+        entry = self._entries.get(file.name)
+        if not entry:
+            return None
+        stat = file.stat()
+        if entry['stat'] != [stat.st_mtime_ns, stat.st_size]:
+            if entry['hash'] != sha1(file.read_bytes()).hexdigest():
+                return None
+            entry['stat'] = [stat.st_mtime_ns, stat.st_size]
+        return Heading(entry['hash'], entry['heading'])
+
+    def put(self, file: Path, heading: Heading) -> None:
+        stat = file.stat()
+        self._entries[file.name] = {'hash': heading.hash, 'heading': heading.markup,
+                                    'stat': [stat.st_mtime_ns, stat.st_size]}
+
+    def save(self, names: List[str]) -> None:
+        """Save the entries for some files, forgetting the rest."""
+        entries = {name: self._entries[name] for name in names if name in self._entries}
+        self.store.put(self._KEY, json.dumps(entries, indent=1, sort_keys=True).encode('utf-8'))
+
+
+def headings(files: List[Path], cache: HeadingCache,
+             jobs: int = None) -> Tuple[Dict[str, Heading], List[str]]:
+    """
+    The headings of article files.
+
+    :param files: the files
+    :param cache: cached headings, updated with any that are extracted
+    :param jobs: the number of worker processes (default: one per CPU)
+    :return: the headings by file name, and error messages for
+             files that have no heading
+    """
+    found = {}
+    todo = []
+    for file in files:
+        heading = cache.get(file)
+        if heading:
+            found[file.name] = heading
+        else:
+            todo.append(file)
+
+    if jobs == 1 or len(todo) < 100:
+        results = [_extract(file) for file in todo]
+    else:
+        from concurrent.futures import ProcessPoolExecutor  # slow to import
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            results = list(pool.map(_extract, todo, chunksize=64))
+
+    errors = []
+    for file, (name, heading) in zip(todo, results):
+        if heading:
+            cache.put(file, heading)
+            found[name] = heading
+        else:
+            errors.append(f"{file}:1:0: no 'h1' or 'title' heading")
+    return found, errors
+
+
+def dated(name: str) -> bool:
+    """
+    Whether a file's name starts with a date, as every article's must.
+
+    >>> dated('2004-05-01-badgers.xhtml'), dated('badgers.xhtml'), dated('2004-13-01-x.xhtml')
+    (True, False, False)
+    """
+    try:
+        datetime.strptime(name[:11], '%Y-%m-%d-')
+    except ValueError:
+        return False
+    return True
+
+
+def _items(toc: bytes) -> Dict[str, Tuple[str, str, str, str]]:
+    """
+    A table of contents' items, by link, with their dates, links' start
+    tags and titles' markup.
+    """
+    match = _CONTENTS.search(toc)
+    contents = match.group(2).decode('utf-8') if match else ''
+    return {m.group(3): (m.group(0), m.group(1), m.group(2), m.group(4))
+            for m in _ITEM.finditer(contents)}
+
+
+def _text(markup: str) -> str:
+    return _SPACE.sub(' ', unescape(_TAG.sub('', markup))).strip()
+
+
+def contents_items(found: Dict[str, Heading], toc: bytes = b'') -> List[str]:
+    """
+    The contents division's items, in file name order.
+
+    :param found: the articles' headings, by file name
+    :param toc: the current table of contents, whose items are kept
+                where their headings' text is unchanged
+    """
+    current = _items(toc)
+    items = []
+    for name in sorted(found):
+        item, date, tag, title = current.get(name, ('', '', '', ''))
+        if date != name[:10] or _text(title) != _text(found[name].markup):
+            tag = tag or f'<a class="internal" href="{name}">'
+            item = f'<p>{name[:10]} — {tag}{found[name].markup}</a></p>'
+        items.append(item)
+    return items
+
+
+def differences(toc: bytes, items: List[str]) -> List[str]:
+    """
+    How new contents items differ from the ones in a table of contents:
+    files that were added or removed, titles or dates that changed, and
+    items whose markup changed although their text didn't.
+    """
+    old = _items(toc)
+    new = _items(b'<div class="contents">' + '\n'.join(items).encode('utf-8') + b'</div>')
+    messages = []
+    for href in sorted(old.keys() | new.keys()):
+        if href not in new:
+            messages.append(f"removed {href}")
+        elif href not in old:
+            messages.append(f"added {href}: {_text(new[href][2])}")
+        elif old[href] != new[href]:
+            old_item, old_date, _, old_title = old[href]
+            new_item, new_date, _, new_title = new[href]
+            if (old_date, _text(old_title)) != (new_date, _text(new_title)):
+                messages.append(f"changed {href}: {_text(old_title)} → {_text(new_title)}")
+            else:
+                messages.append(f"changed {href}: {old_item} → {new_item}")
+    return messages
+
+
+def main() -> None:
+    from settings import BIGBOOK_DIR
+    from cache import code_version, open_store
+
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "-b", "--bigbook", metavar="DIR", type=Path, default=BIGBOOK_DIR,
+        help="the Big Book of Key directory")
+    parser.add_argument(
+        "-c", "--check", action="store_true",
+        help="only report the differences, and fail if there are any")
+    parser.add_argument(
+        "-j", "--jobs", metavar="N", type=int,
+        help="the number of processes to extract headings with (default: one per CPU)")
+    args = parser.parse_args()
+
+    toc_file = args.bigbook / 'Text' / 'toc.xhtml'
+    files = sorted(file for file in (args.bigbook / 'Text').glob('*.xhtml')
+                   if file.name != toc_file.name)
+    undated = [f"{file}:1:0: no date at the start of the file's name"
+               for file in files if not dated(file.name)]
+    files = [file for file in files if dated(file.name)]
+    cache = HeadingCache(open_store('headings', code_version('toc')))
+    found, errors = headings(files, cache, args.jobs)
+    cache.save([file.name for file in files])
+    errors = undated + errors
+    for message in errors:
+        print(message, file=stderr)
+
+    toc = toc_file.read_bytes()
+    if not _CONTENTS.search(toc):
+        print(f"{toc_file}:1:0: no '<div class=\"contents\">'", file=stderr)
+        exit(1)
+    items = contents_items(found, toc)
+    contents = ''.join('\n' + item for item in items).encode('utf-8')
+    new_toc = _CONTENTS.sub(lambda m: m.group(1) + contents + m.group(3), toc, count=1)
+    messages = differences(toc, items)
+    if new_toc != toc and not messages:
+        messages = ["the contents are reordered or respaced"]
+    for message in messages:
+        print(f"{toc_file}: {message}")
+
+    if args.check:
+        if messages or errors:
+            exit(1)
+        return
+    if new_toc != toc:
+        toc_file.write_bytes(new_toc)
+    if errors:
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
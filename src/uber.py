@@ -0,0 +1,122 @@
+"""
+The 'uber' command, which runs the Ubercoordinator tools as subcommands:
+
+    uber validate  test Big Book of Key XHTML files (bigbook.py)
+    uber check     ... quickly, with a validation server (validation_server.py)
+    uber website   build the website (make_website.py)
+    uber prepare   add Big Book files to a book's directory (prepare_book.py)
+    uber epub      build a book's EPUB file (make_epub.py)
+    uber omnibus   build the complete works in volumes (omnibus.py)
+    uber toc       rebuild the Big Book's table of contents (toc.py)
+    uber diff      report the changes to the Index (index_diff.py)
+    uber cache     show or prune the build caches (cache.py)
+    uber startup   time how long each subcommand takes to start
+
+'uber COMMAND --help' describes a subcommand's arguments.
+
+A subcommand's module is only imported when it is run, and the tools
+import slow libraries, such as PIL and Schematron, only on the code
+paths that use them, so that small jobs, such as validating one file,
+start quickly. 'uber startup' checks the start up times against
+STARTUP_BUDGET.
+
+Install the command with 'pip install -e .' in the Ubercoordinator
+directory, as the tools find their templates there (see 'settings.py').
+"""
+
+__all__ = ['COMMANDS', 'STARTUP_BUDGET', 'main']
+
+import sys
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+COMMANDS: Dict[str, Tuple[str, str]] = {
+    'validate': ('bigbook', "test Big Book of Key XHTML files"),
+    'check': ('validation_server', "test Big Book of Key XHTML files with a validation server"),
+    'website': ('make_website', "build the website"),
+    'prepare': ('prepare_book', "add Big Book files to a book's directory"),
+    'epub': ('make_epub', "build a book's EPUB file"),
+    'omnibus': ('omnibus', "build the complete works in volumes"),
+    'toc': ('toc', "rebuild the Big Book's table of contents"),
+    'diff': ('index_diff', "report the changes to the Index"),
+    'cache': ('cache', "show or prune the build caches"),
+}
+"""Subcommand to module name and description."""
+
+STARTUP_BUDGET: Dict[str, float] = {
+    'validate': 0.1,
+    'check': 0.05,
+    'website': 0.15,
+    'prepare': 0.1,
+    'epub': 0.08,
+    'omnibus': 0.12,
+    'toc': 0.05,
+    'diff': 0.1,
+    'cache': 0.05,
+}
+"""
+Subcommand to the most time, in seconds, that importing it and parsing
+its arguments may take, beyond starting a bare Python interpreter.
+"""
+
+_SRC_DIR = Path(__file__).resolve().parent
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] in COMMANDS:
+        run(argv[0], argv[1:])
+    elif argv and argv[0] == 'startup':
+        sys.exit(0 if startup(int(argv[1]) if len(argv) > 1 else 5) else 1)
+    elif argv and argv[0] not in ('-h', '--help'):
+        print(f"uber: unknown command '{argv[0]}'", file=sys.stderr)
+        sys.exit(2)
+    else:
+        print(__doc__.strip())
+
+
+def run(command: str, args: List[str]) -> None:
+    """Run a subcommand's 'main' function, as if it were run as a script."""
+    # The tools' modules are in this directory, and must come before the
+    # standard library on the path: 'xml.py' would otherwise be the standard 'xml'.
+    if sys.path[0] != str(_SRC_DIR):
+        sys.path.insert(0, str(_SRC_DIR))
+    from importlib import import_module
+    module = import_module(COMMANDS[command][0])
+    sys.argv = [f'uber {command}', *args]
+    module.main()
+
+
+def startup(repeat: int) -> bool:
+    """
+    Print how long each subcommand takes to start, the best of several runs,
+    beyond a bare interpreter.
+
+    :param repeat: the number of runs
+    :return: True if every subcommand is within its budget
+    """
+    from subprocess import run as run_process, DEVNULL
+    from time import perf_counter
+
+    def best(*args: str) -> float:
+        times = []
+        for _ in range(repeat):
+            start = perf_counter()
+            run_process([sys.executable, *args], stdout=DEVNULL, check=True)
+            times.append(perf_counter() - start)
+        return min(times)
+
+    bare = best('-c', 'pass')
+    print(f"{'python':10} {bare * 1000:6.1f} ms")
+    success = True
+    for command in COMMANDS:
+        elapsed = best(str(_SRC_DIR / 'uber.py'), command, '--help') - bare
+        over = elapsed > STARTUP_BUDGET[command]
+        success = success and not over
+        print(f"{command:10} {elapsed * 1000:+6.1f} ms"
+              f"{'  over budget' if over else ''}")
+    return success
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,286 @@
+"""
+Test Big Book of Key files with a validation server, which keeps
+bigbook.py's DTD and compiled Schematron in memory, so that files can be
+tested as they are saved, e.g. from Emacs:
+
+    uber check Text/2004-05-01-rose-garden.xhtml
+
+The client prints errors in bigbook.py's 'file:line:col: message' format,
+for a compilation buffer, and fails if any file does. It starts the server
+if it isn't running, or if the tools have changed since it started, so
+only the first check waits for lxml to be imported and the Schematron to
+be compiled; after that a file takes a few milliseconds.
+
+The server reloads the DTD and Schematron when they change. With
+'--linking' it also tests the files that link to the files given, e.g.
+after one has been renamed or deleted, from an index of the Big Book's
+links that it updates as files change. It listens on a Unix socket in
+the cache directory, and exits after an hour without requests, or when
+told to with '--stop'. Where there are no Unix sockets, the client tests
+the files itself.
+"""
+
+__all__ = ['SOCKET', 'IDLE_TIMEOUT', 'check', 'serve', 'stop']
+
+import json
+import os
+import socket
+import sys
+from argparse import ArgumentParser
+from io import StringIO
+from os.path import normpath
+from pathlib import Path
+from time import perf_counter, sleep
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from settings import CACHE_DIR
+
+SOCKET = CACHE_DIR / 'validation.sock'
+"""Where the server listens."""
+
+IDLE_TIMEOUT = 3600
+"""The server exits after this many seconds without requests."""
+
+_SRC_DIR = Path(__file__).resolve().parent
+_MODULES = ('bigbook', 'fast_schematron', 'validation_server')  # the server's code
+
+_START_TIMEOUT = 30  # seconds for a new server to start listening
+
+
+def _code_stamp() -> List[int]:
+    """The modification times of the server's modules."""
+    return [(_SRC_DIR / f'{module}.py').stat().st_mtime_ns for module in _MODULES]
+
+
+def _send(stream: BinaryIO, message: Dict) -> None:
+    stream.write(json.dumps(message).encode('utf-8') + b'\n')
+    stream.flush()
+
+
+class _Validator:
+    """
+    The DTD and Schematron, loaded again when their files or the
+    options change, and the links between the Big Book's files.
+    """
+    _loaded: Optional[Tuple]  # the files, their modification times and the options
+    _links: Dict[str, Tuple[int, Set[str]]]  # file to modification time and link targets
+
+    def __init__(self) -> None:
+        self._loaded = None
+        self._links = {}
+        self.dtd = self.schematron = None
+
+    def _load(self) -> None:
+        from bigbook import settings, open_dtd, open_schematron
+        loaded = (settings.dtd, settings.dtd.stat().st_mtime_ns,
+                  settings.schematron, settings.schematron.stat().st_mtime_ns, settings.strict)
+        if loaded != self._loaded:
+            self._loaded = None
+            self.dtd = open_dtd(settings.dtd)
+            self.schematron = open_schematron(settings.schematron)
+            self._loaded = loaded
+
+    def linking(self, files: List[Path]) -> List[Path]:
+        """The XHTML files in the same directories as some files that link to them."""
+        from bigbook import link_targets
+        targets = {normpath(file.resolve()) for file in files}
+        for directory in {Path(target).parent for target in targets}:
+            present = set()
+            for entry in os.scandir(str(directory)) if directory.is_dir() else []:
+                if entry.name.endswith('.xhtml') and entry.is_file():
+                    present.add(entry.path)
+                    mtime = entry.stat().st_mtime_ns
+                    if self._links.get(entry.path, (None,))[0] != mtime:
+                        path = Path(entry.path)
+                        self._links[entry.path] = (mtime, link_targets(path, path.read_bytes()))
+            for path in [path for path in self._links
+                         if Path(path).parent == directory and path not in present]:
+                del self._links[path]
+        return sorted(Path(path) for path, (_, links) in self._links.items()
+                      if links & targets and path not in targets)
+
+    def test(self, request: Dict) -> Iterator[Dict]:
+        """Test the files in a request, yielding errors and then whether they passed."""
+        import bigbook
+        settings = bigbook.settings
+        settings.errors = StringIO()
+        passed = True
+        try:
+            os.chdir(request['cwd'])
+            settings.dtd = Path(request['dtd'])
+            settings.schematron = Path(request['schematron'])
+            settings.test_images = request['test_images']
+            settings.strict = request['strict']
+            self._load()
+            files = [Path(file) for file in request['files']]
+            if request['linking']:
+                # Files that have been deleted are not tested, but those that linked to them are.
+                files = ([file for file in files if file.exists()]
+                         + [file for file in self.linking(files) if file not in files])
+            for file in files:
+                passed = bigbook.test(file, self.dtd, self.schematron) and passed
+        except SystemExit:  # the DTD or Schematron couldn't be loaded
+            passed = False
+        except Exception as e:
+            print(f"{(request['files'] or [SOCKET])[0]}:0:0: validation server: {e!r}",
+                  file=settings.errors)
+            passed = False
+        for line in settings.errors.getvalue().splitlines():
+            yield {'error': line}
+        yield {'passed': passed}
+
+
+def serve(idle_timeout: float = IDLE_TIMEOUT) -> None:
+    """Answer requests until none come for a while, or told to stop."""
+    import bigbook  # slow to import
+    bigbook.settings.verbose = False
+    code = _code_stamp()
+    validator = _Validator()
+
+    SOCKET.parent.mkdir(parents=True, exist_ok=True)
+    if SOCKET.exists():
+        SOCKET.unlink()
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(str(SOCKET))
+    inode = SOCKET.stat().st_ino
+    server.listen(8)
+    server.settimeout(idle_timeout)
+    try:
+        while True:
+            try:
+                connection, _ = server.accept()
+            except socket.timeout:
+                break
+            with connection, connection.makefile('rwb') as stream:
+                request = json.loads(stream.readline() or b'{}')
+                if request.get('stop') or _code_stamp() != code:
+                    _send(stream, {'stopping': True})
+                    break
+                for message in validator.test(request):
+                    _send(stream, message)
+    finally:
+        server.close()
+        # A new server may already be listening, if this one's code had changed.
+        if SOCKET.exists() and SOCKET.stat().st_ino == inode:
+            SOCKET.unlink()
+
+
+def _connect() -> Optional[socket.socket]:
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(str(SOCKET))
+    except OSError:
+        client.close()
+        return None
+    return client
+
+
+def _start_server() -> socket.socket:
+    from subprocess import Popen, DEVNULL
+    Popen([sys.executable, str(Path(__file__).resolve()), '--serve'],
+          stdin=DEVNULL, stdout=DEVNULL, stderr=DEVNULL, start_new_session=True)
+    start = perf_counter()
+    while perf_counter() - start < _START_TIMEOUT:
+        client = _connect()
+        if client:
+            return client
+        sleep(0.02)
+    raise SystemExit(f"{SOCKET}:0:0: the validation server didn't start")
+
+
+def check(files: List[Path], linking: bool = False, dtd: Path = None, schematron: Path = None,
+          test_images: bool = False, strict: bool = False) -> bool:
+    """
+    Test Big Book files with the validation server, starting it if need be,
+    and print their errors to stderr.
+
+    :param files: the files
+    :param linking: if True also test the files that link to them
+    :param dtd: a non-default DTD file
+    :param schematron: a non-default Schematron schema
+    :param test_images: if True also test image validity
+    :param strict: if True cross-check the fast Schematron with lxml's (see bigbook.py)
+    :return: True if every file passes
+    """
+    request = {
+        'cwd': os.getcwd(),
+        'files': [str(file) for file in files],
+        'linking': linking,
+        'dtd': str((dtd or _SRC_DIR / 'bigbook.dtd').resolve()),
+        'schematron': str((schematron or _SRC_DIR / 'bigbook.sch').resolve()),
+        'test_images': test_images,
+        'strict': strict,
+    }
+    if not hasattr(socket, 'AF_UNIX'):
+        return _print(_Validator().test(request))
+
+    # Twice, in case the server's code has changed, so it stops rather than answering.
+    for _ in range(2):
+        client = _connect() or _start_server()
+        with client, client.makefile('rwb') as stream:
+            _send(stream, request)
+            passed = _print(json.loads(line) for line in stream)
+        if passed is not None:
+            return passed
+        sleep(0.1)  # for the old server to stop listening
+    raise SystemExit(f"{SOCKET}:0:0: the validation server didn't answer")
+
+
+def _print(messages: Iterable[Dict]) -> Optional[bool]:
+    """Print the errors in a server's answer, and return whether the files passed, if it said."""
+    for message in messages:
+        if 'error' in message:
+            print(message['error'], file=sys.stderr)
+        elif 'passed' in message:
+            return message['passed']
+    return None
+
+
+def stop() -> None:
+    """Stop the server, if it's running."""
+    client = _connect()
+    if client:
+        with client, client.makefile('rwb') as stream:
+            _send(stream, {'stop': True})
+            stream.readline()
+
+
+def main() -> None:
+    parser = ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument(
+        "-l", "--linking", action="store_true",
+        help="also test the files that link to the files")
+    parser.add_argument(
+        "-d", "--dtd", metavar="DTD", type=Path,
+        help="a non-default DTD file")
+    parser.add_argument(
+        "-x", "--schematron", metavar="SCH", type=Path,
+        help="a non-default Schematron schema")
+    parser.add_argument(
+        "-i", "--test-images", action="store_true",
+        help="also test image validity")
+    parser.add_argument(
+        "-s", "--strict", action="store_true",
+        help="also test files with lxml's Schematron alone (see bigbook.py)")
+    parser.add_argument(
+        "--serve", action="store_true",
+        help="run the server, rather than testing files with it")
+    parser.add_argument(
+        "--stop", action="store_true",
+        help="stop the server")
+    parser.add_argument(
+        "files", type=Path, metavar="XHTML", nargs="*",
+        help="Big Book of Key files to test")
+    args = parser.parse_args()
+
+    if args.serve:
+        serve()
+    elif args.stop:
+        stop()
+    elif not check(args.files, args.linking, args.dtd, args.schematron,
+                   args.test_images, args.strict):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -14,7 +14,8 @@
       
       <navMap>
         <!-- Book content sections are turned into "navPoint" elements. -->
-        <xsl:for-each select="contents/section">
+        <!-- (Parts of split sections are not, see epub_split.py.) -->
+        <xsl:for-each select="contents/section[not(@part='yes')]">
           <xsl:call-template name="section-navPoints" />
         </xsl:for-each>
       </navMap>
@@ -34,7 +35,7 @@
       </xsl:choose>
 
       <!-- subsections -->
-      <xsl:for-each select="section">
+      <xsl:for-each select="section[not(@part='yes')]">
         <xsl:call-template name="section-navPoints" />
       </xsl:for-each>
     </navPoint>
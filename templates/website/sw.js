@@ -0,0 +1,128 @@
+// The Hooting Yard Archive's service worker (see offline.py).
+// VERSION is the hash of the files in the precache manifest, so this
+// file changes, and browsers install it again, whenever they do.
+'use strict';
+
+const VERSION = '${version}';
+const SHELL = 'shell-' + VERSION;   // the precache manifest's files
+const PAGES = 'pages';              // article pages and images, as they are visited
+const SAVED = 'saved';              // the articles of years saved for offline reading
+
+const SCOPE = new URL(self.registration.scope).pathname;
+const RUNTIME = /^(Text|Images)\//;
+const PRECACHED = /^(index\.html|Styles\/.*|Fonts\/.*)$/;
+
+self.addEventListener('install', function (event) {
+    event.waitUntil(
+        fetch('${manifest}', {cache: 'no-cache'})
+            .then(function (response) { return response.json(); })
+            .then(function (manifest) {
+                if (manifest.version !== VERSION) {
+                    throw new Error('precache manifest ' + manifest.version + ' is not ' + VERSION);
+                }
+                return caches.open(SHELL).then(function (cache) {
+                    return cache.addAll(manifest.files.map(function (file) {
+                        return new Request(file.url, {cache: 'no-cache'});
+                    }));
+                });
+            })
+            .then(function () { return self.skipWaiting(); })
+    );
+});
+
+self.addEventListener('activate', function (event) {
+    event.waitUntil(
+        caches.keys()
+            .then(function (names) {
+                return Promise.all(names.filter(function (name) {
+                    return name.startsWith('shell-') && name !== SHELL;
+                }).map(function (name) { return caches.delete(name); }));
+            })
+            .then(function () { return self.clients.claim(); })
+    );
+});
+
+// The response for a request in the named caches, in order, if any.
+function cached(request, names) {
+    return names.reduce(function (found, name) {
+        return found.then(function (response) {
+            return response || caches.open(name).then(function (cache) { return cache.match(request); });
+        });
+    }, Promise.resolve(undefined));
+}
+
+// Fetch a page or image, and keep it: in the saved articles if it is one, otherwise with the pages visited.
+function refresh(request) {
+    return fetch(request).then(function (response) {
+        if (response.ok) {
+            const copy = response.clone();
+            caches.open(SAVED)
+                .then(function (saved) {
+                    return saved.match(request).then(function (found) {
+                        return found ? saved : caches.open(PAGES);
+                    });
+                })
+                .then(function (cache) { return cache.put(request, copy); });
+        }
+        return response;
+    });
+}
+
+self.addEventListener('fetch', function (event) {
+    const request = event.request;
+    const url = new URL(request.url);
+    if (request.method !== 'GET' || url.origin !== self.location.origin || !url.pathname.startsWith(SCOPE)) {
+        return;
+    }
+    const path = url.pathname.slice(SCOPE.length) || 'index.html';
+    if (!PRECACHED.test(path) && !RUNTIME.test(path)) {
+        return;  // e.g. the audio, feeds and the JSON export
+    }
+    event.respondWith(
+        cached(path === 'index.html' ? 'index.html' : request, [SHELL]).then(function (shell) {
+            if (shell || !RUNTIME.test(path)) {
+                return shell || fetch(request);
+            }
+            // Stale while revalidate.
+            return cached(request, [SAVED, PAGES]).then(function (response) {
+                const fetched = refresh(request);
+                if (response) {
+                    event.waitUntil(fetched.catch(function () {}));
+                    return response;
+                }
+                return fetched;
+            });
+        })
+    );
+});
+
+// Save the articles of a year, listed in the JSON export, for offline reading.
+function saveYear(year) {
+    return fetch('${api_dir}/articles/' + year + '.json', {cache: 'no-cache'})
+        .then(function (response) {
+            if (!response.ok) {
+                throw new Error(response.status + ' ' + response.statusText);
+            }
+            return response.json();
+        })
+        .then(function (articles) {
+            const urls = articles.map(function (article) { return 'Text/' + article.id + '.html'; });
+            return caches.open(SAVED)
+                .then(function (cache) { return cache.addAll(urls); })
+                .then(function () { return urls.length; });
+        });
+}
+
+self.addEventListener('message', function (event) {
+    const message = event.data;
+    if (message && message.type === 'save-year') {
+        event.waitUntil(
+            saveYear(message.year)
+                .then(function (count) {
+                    event.source.postMessage({type: 'saved-year', year: message.year, count: count});
+                }, function (error) {
+                    event.source.postMessage({type: 'saved-year', year: message.year, error: String(error)});
+                })
+        );
+    }
+});